@@ -0,0 +1,45 @@
+# -*- coding:utf-8 -*-
+"""
+arrange_args 基准: 每次调用都解析签名 vs 装饰时缓存的 binding_plan
+
+    python benchmarks/bench_arrange_args.py
+"""
+import os
+import sys
+import timeit
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from validator import arrange_args, binding_plan
+
+
+def todo(a, b, c, d, e, f="f", g="g", h=None, *args):
+    return a
+
+
+ARGS = ("a", "b", "c", "d", "e", "f")
+KWARGS = {"x": 1}
+PLAN = binding_plan(todo)
+
+
+def per_call():
+    return arrange_args(ARGS, KWARGS, todo)
+
+
+def cached():
+    return arrange_args(ARGS, KWARGS, todo, PLAN)
+
+
+def main(number=20000, repeat=5):
+    assert per_call() == cached()
+    results = {}
+    for name, func in (("per_call", per_call), ("cached", cached)):
+        best = min(timeit.repeat(func, number=number, repeat=repeat))
+        results[name] = best / number
+        print("%-10s %8.3f us/call" % (name, results[name] * 1e6))
+    print("speedup    %8.1fx" % (results["per_call"] / results["cached"]))
+    return results
+
+
+if __name__ == "__main__":
+    main()
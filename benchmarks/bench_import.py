@@ -0,0 +1,80 @@
+# -*- coding:utf-8 -*-
+"""
+导入耗时: 在新的解释器里分别 import validator_core / validator, 记录耗时和导入了哪些第三方模块
+
+    python benchmarks/bench_import.py                    # 每个模块测 10 次, 取最小值
+    python benchmarks/bench_import.py --max-ms 30        # validator_core 超过 30ms 时退出码为1
+    python benchmarks/bench_import.py --json import.json
+
+validator_core 不能导入 flask/werkzeug/numpy/orjson, 只 import validator 也不能
+(它们在第一次用到时才导入), 否则退出码为1, 可以直接放进CI里作为检查
+"""
+import os
+import sys
+import json
+import argparse
+import subprocess
+from collections import OrderedDict
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+HEAVY = ("flask", "werkzeug", "numpy", "orjson")
+MODULES = ("validator_core", "validator")
+
+SCRIPT = """
+import sys, time
+clock = getattr(time, "perf_counter", time.time)
+start = clock()
+import %s
+elapsed = clock() - start
+heavy = sorted(set(m.split(".")[0] for m in sys.modules) & set(%r))
+print("%%r %%r" %% (elapsed, heavy))
+"""
+
+
+def measure(module, repeat=10):
+    """
+    repeat 次新进程里 import module 的耗时(秒), 以及导入了的重量级模块
+    """
+    times = []
+    heavy = set()
+    for _ in range(repeat):
+        output = subprocess.check_output([sys.executable, "-c", SCRIPT % (module, HEAVY)], cwd=ROOT)
+        elapsed, loaded = output.decode("utf-8").strip().split(" ", 1)
+        times.append(float(elapsed))
+        heavy.update(eval(loaded))
+    times.sort()
+    return OrderedDict([
+        ("min_ms", times[0] * 1e3),
+        ("median_ms", times[len(times) // 2] * 1e3),
+        ("heavy_modules", sorted(heavy)),
+    ])
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="import time of validator_core and validator")
+    parser.add_argument("--repeat", type=int, default=10)
+    parser.add_argument("--max-ms", type=float, default=50.0, help="allowed import time of validator_core")
+    parser.add_argument("--json", help="write the results to this file")
+    options = parser.parse_args(argv)
+
+    report = OrderedDict((module, measure(module, options.repeat)) for module in MODULES)
+    failures = []
+    for module, r in report.items():
+        print("import %-15s min %7.2f ms  median %7.2f ms  heavy modules: %s" % (
+            module, r["min_ms"], r["median_ms"], ", ".join(r["heavy_modules"]) or "-"))
+        if r["heavy_modules"]:
+            failures.append("import %s loads %s" % (module, ", ".join(r["heavy_modules"])))
+    if report["validator_core"]["min_ms"] > options.max_ms:
+        failures.append("import validator_core takes %.2f ms, more than %.2f ms" % (
+            report["validator_core"]["min_ms"], options.max_ms))
+    if options.json:
+        with open(options.json, "w") as f:
+            json.dump(report, f, indent=2)
+    for failure in failures:
+        print(failure)
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,159 @@
+# -*- coding:utf-8 -*-
+"""
+内存占用: 多租户场景下每个租户一份规则, 规则都由同样的几种校验器配置组成,
+用 tracemalloc 统计建好 --tenants 份规则后常驻的内存, 以及每种内置校验器单个实例的大小
+
+    python benchmarks/bench_memory.py                         # 默认 10000 个租户
+    python benchmarks/bench_memory.py --tenants 50000 --json memory.json
+
+shared 是默认行为(validator_registry 共享参数相同的校验器),
+unshared 关闭共享(validator_registry.enabled = False), 每份规则都有自己的校验器实例
+"""
+import os
+import gc
+import sys
+import json
+import platform
+import argparse
+import tracemalloc
+from collections import OrderedDict
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from validator_core import (
+    Required, Email, Url, Datetime, Date, Pattern, In, Not, Range, GreaterThan, Equals, Length, Contains, Coerce,
+    Isalnum, Isalpha, Isdigit, Truthy, Blank, InstanceOf, SubclassOf, validator_registry,
+)
+
+
+def tenant_rules():
+    # flask_validator_example.py 中的 rules_example, 再加上几个常见字段
+    return {
+        "a": [Required, Equals("123")],
+        "b": [Required, Truthy()],
+        "c": [In(["spam", "eggs", "bacon"])],
+        "d": [Not(Range(1, 100))],
+        "e": [Length(0, maximum=5)],
+        "f": [Required, InstanceOf(str)],
+        "g": [Required, Not(In(["spam", "eggs", "bacon"]))],
+        "h": [Required, Pattern(r"\d\d\%")],
+        "i": [Required, GreaterThan(1, reverse=True, auto=True)],
+        "k": [Required, Isalnum()],
+        "l": [Required, Isalpha()],
+        "m": [Required, Isdigit()],
+        "email": [Required, Email(), Length(3, 254)],
+        "site": [Url()],
+        "birthday": [Date()],
+        "page": [Coerce(int), Range(1, 1000, auto=False)],
+    }
+
+
+INSTANCES = (
+    ("Isalnum", lambda: Isalnum()),
+    ("Email", lambda: Email()),
+    ("Url", lambda: Url()),
+    ("Blank", lambda: Blank()),
+    ("Truthy", lambda: Truthy()),
+    ("Datetime", lambda: Datetime()),
+    ("Date", lambda: Date()),
+    ("Pattern", lambda: Pattern(r"\d\d\%")),
+    ("In", lambda: In(["spam", "eggs", "bacon"])),
+    ("Not", lambda: Not(Equals(2))),
+    ("Range", lambda: Range(1, 100)),
+    ("GreaterThan", lambda: GreaterThan(1)),
+    ("Equals", lambda: Equals("123")),
+    ("Length", lambda: Length(0, maximum=5)),
+    ("Contains", lambda: Contains(3)),
+    ("Coerce", lambda: Coerce(int)),
+    ("InstanceOf", lambda: InstanceOf(str)),
+    ("SubclassOf", lambda: SubclassOf(object)),
+)
+
+
+def retained(build, count):
+    """
+    建 count 个对象并保留, 返回平均每个常驻的字节数
+    """
+    gc.collect()
+    tracemalloc.start()
+    try:
+        before = tracemalloc.get_traced_memory()[0]
+        kept = [build() for _ in range(count)]
+        gc.collect()
+        after = tracemalloc.get_traced_memory()[0]
+    finally:
+        tracemalloc.stop()
+    size = (after - before - sys.getsizeof(kept)) / float(count)
+    return size, kept
+
+
+def distinct_validators(rule_sets):
+    seen = set()
+    for rules in rule_sets:
+        for validators in rules.values():
+            for v in validators:
+                seen.add(id(v))
+                inner = getattr(v, "validator", None)
+                if inner is not None:
+                    seen.add(id(inner))
+    return len(seen)
+
+
+def run(tenants=10000, instances=1000, quiet=False):
+    results = OrderedDict()
+    enabled = validator_registry.enabled
+    try:
+        for mode, share in (("unshared", False), ("shared", True)):
+            validator_registry.enabled = share
+            validator_registry.clear()
+            per_tenant, rule_sets = retained(tenant_rules, tenants)
+            per_instance = OrderedDict()
+            for name, build in INSTANCES:
+                per_instance[name] = retained(build, instances)[0]
+            results[mode] = OrderedDict([
+                ("bytes_per_tenant", per_tenant),
+                ("total_mb", per_tenant * tenants / 2.0 ** 20),
+                ("distinct_validators", distinct_validators(rule_sets)),
+                ("bytes_per_instance", per_instance),
+            ])
+            del rule_sets
+    finally:
+        validator_registry.enabled = enabled
+    if not quiet:
+        for mode, r in results.items():
+            print("%-9s %9.0f B per tenant  %8.2f MB for %d tenants  %d distinct validators" % (
+                mode, r["bytes_per_tenant"], r["total_mb"], tenants, r["distinct_validators"]))
+        print("")
+        print("bytes per instance, %s:" % ", ".join(results))
+        for name, _ in INSTANCES:
+            print("%-12s %s" % (name, "  ".join("%8.0f" % r["bytes_per_instance"][name] for r in results.values())))
+    return OrderedDict([
+        ("meta", OrderedDict([
+            ("python", platform.python_version()),
+            ("implementation", platform.python_implementation()),
+            ("tenants", tenants),
+            ("instances", instances),
+        ])),
+        ("results", results),
+    ])
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="memory used by validator rule sets")
+    parser.add_argument("--tenants", type=int, default=10000, help="number of rule sets kept in memory")
+    parser.add_argument("--instances", type=int, default=1000, help="instances per validator for the size table")
+    parser.add_argument("--json", help="write the results to this file, - for stdout")
+    options = parser.parse_args(argv)
+
+    report = run(options.tenants, options.instances, quiet=options.json == "-")
+    if options.json == "-":
+        json.dump(report, sys.stdout, indent=2)
+    elif options.json:
+        with open(options.json, "w") as f:
+            json.dump(report, f, indent=2)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
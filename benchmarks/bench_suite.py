@@ -0,0 +1,317 @@
+# -*- coding:utf-8 -*-
+"""
+校验引擎的微基准测试: validate() 在不同规模的平铺/嵌套dict/If-Then/Each规则下的耗时,
+每个内置校验器, 以及 arrange_args/do_strip/do_default/do_func
+
+    python benchmarks/bench_suite.py                          # 运行所有用例
+    python benchmarks/bench_suite.py -k each -k nested        # 只运行名字包含 each 或 nested 的用例
+    python benchmarks/bench_suite.py --json result.json       # 结果另外写成json
+    python benchmarks/bench_suite.py --save-baseline          # 保存为基线
+    python benchmarks/bench_suite.py --compare --threshold 0.1  # 和基线比较, 有用例的p50慢了10%以上时退出码为1
+
+每个用例先校准每个样本的调用次数(让一个样本耗时约 --sample-time 秒), 再采集 --samples 个样本,
+ops/sec 和 mean 取自所有样本, p50/p90/p99 是各样本单次调用耗时的分位数,
+alloc_bytes 是用 tracemalloc 测得的单次调用的内存分配峰值
+"""
+import os
+import sys
+import json
+import time
+import platform
+import argparse
+from collections import OrderedDict
+
+try:
+    import tracemalloc
+except ImportError:
+    # python 2
+    tracemalloc = None
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import validator
+from validator import (
+    Required, Email, Url, Datetime, Date, Pattern, In, Not, Range, GreaterThan, Equals, Length, Contains,
+    Isalnum, Isalpha, Isdigit, Truthy, Blank, InstanceOf, SubclassOf, Each, If, Then,
+    validate, compile_rules, arrange_args, binding_plan, do_strip, do_default, do_func,
+)
+
+clock = getattr(time, "perf_counter", time.time)
+
+DEFAULT_BASELINE = os.path.join(ROOT, "benchmarks", "baselines", "baseline.json")
+SIZES = (5, 20, 100)
+EACH_SIZES = (10, 100, 1000)
+
+CASES = OrderedDict()
+
+
+def case(name, func):
+    CASES[name] = func
+
+
+def flat(size):
+    rules = {}
+    data = {}
+    for i in range(size):
+        rules["f%d" % i] = [Required, Range(0, 1000), Length(1, 5)]
+        data["f%d" % i] = str(i)
+    return rules, data
+
+
+def nested(size):
+    # size 个字段分在若干层嵌套dict里, 每层5个字段
+    rules, data = flat(min(size, 5))
+    inner_rules, inner_data = rules, data
+    remaining = size - 5
+    while remaining > 0:
+        level_rules, level_data = flat(min(remaining, 5))
+        inner_rules["sub"] = [Required, level_rules]
+        inner_data["sub"] = level_data
+        inner_rules, inner_data = level_rules, level_data
+        remaining -= 5
+    return rules, data
+
+
+def if_then(size):
+    rules = {}
+    data = {}
+    for i in range(size):
+        rules["k%d" % i] = [If(Equals(1), Then({"v%d" % i: [Required, In([1, 2, 3])]}))]
+        data["k%d" % i] = 1
+        data["v%d" % i] = 2
+    return rules, data
+
+
+def each_dicts(size):
+    rules = {"items": [Required, Each({"id": [Required, GreaterThan(0)], "name": [Length(1, 20)]})]}
+    data = {"items": [{"id": i + 1, "name": "item%d" % i} for i in range(size)]}
+    return rules, data
+
+
+def each_values(size):
+    rules = {"items": [Required, Each([Range(0, size), InstanceOf(int)])]}
+    data = {"items": list(range(size))}
+    return rules, data
+
+
+def add_validate_cases():
+    for label, build, sizes in (
+            ("flat", flat, SIZES),
+            ("nested", nested, SIZES),
+            ("if_then", if_then, SIZES),
+            ("each_dicts", each_dicts, EACH_SIZES),
+            ("each_values", each_values, EACH_SIZES)):
+        for size in sizes:
+            rules, data = build(size)
+            plan = compile_rules(rules)
+            case("validate.%s.%d" % (label, size), lambda rules=rules, data=data: validate(rules, data))
+            case("plan.%s.%d" % (label, size), lambda plan=plan, data=data: plan(data))
+
+
+class Base(object):
+    pass
+
+
+class Child(Base):
+    pass
+
+
+def add_validator_cases():
+    validators = (
+        ("Email", Email(), "someone@example.com"),
+        ("Url", Url(), "https://example.com/path?q=1"),
+        ("Datetime", Datetime(), "2020-01-02T03:04:05.000123Z"),
+        ("Datetime.strptime", Datetime("%d %b %Y"), "02 Jan 2020"),
+        ("Date", Date(), "2020-01-02"),
+        ("Pattern", Pattern(r"\d+%"), "12%"),
+        ("In", In(["spam", "eggs", "bacon"]), "eggs"),
+        ("In.large", In(range(1000)), 999),
+        ("Not", Not(Equals(2)), 3),
+        ("Range", Range(1, 100), 50),
+        ("GreaterThan", GreaterThan(1), 50),
+        ("Equals", Equals("123"), "123"),
+        ("Length", Length(1, 10), "hello"),
+        ("Contains", Contains(3), [1, 2, 3]),
+        ("Isalnum", Isalnum(), "abc123"),
+        ("Isalpha", Isalpha(), "abc"),
+        ("Isdigit", Isdigit(), "123"),
+        ("Truthy", Truthy(), 1),
+        ("Blank", Blank(), ""),
+        ("InstanceOf", InstanceOf(int), 1),
+        ("SubclassOf", SubclassOf(Base), Child),
+    )
+    for name, v, value in validators:
+        assert v(value), name
+        case("validator.%s" % name, lambda v=v, value=value: v(value))
+
+
+def todo(a, b, c, d, e, f="f", g="g", h=None, *args):
+    return a
+
+
+def add_helper_cases():
+    args = ("a", "b", "c", "d", "e", "f")
+    kwargs = {"x": 1}
+    plan = binding_plan(todo)
+    case("arrange_args", lambda: arrange_args(args, kwargs, todo))
+    case("arrange_args.plan", lambda: arrange_args(args, kwargs, todo, plan))
+    data = dict(("k%d" % i, " v%d " % i if i % 2 else "") for i in range(20))
+    diy_func = {"k1": lambda x: x.upper(), "k3": lambda x: x + "!"}
+    case("do_strip", lambda: do_strip(dict(data), modify=True))
+    case("do_default", lambda: do_default(dict(data), (True, None)))
+    case("do_func", lambda: do_func(dict(data), diy_func, modify=True))
+
+
+add_validate_cases()
+add_validator_cases()
+add_helper_cases()
+
+
+def percentile(values, q):
+    values = sorted(values)
+    index = min(len(values) - 1, int(round(q / 100.0 * (len(values) - 1))))
+    return values[index]
+
+
+def calibrate(func, sample_time):
+    number = 1
+    while True:
+        start = clock()
+        for _ in range(number):
+            func()
+        elapsed = clock() - start
+        if elapsed >= sample_time / 10.0 or number >= 10 ** 7:
+            break
+        number *= 10
+    return max(1, int(number * sample_time / max(elapsed, 1e-9)))
+
+
+def allocations(func):
+    if tracemalloc is None:
+        return None
+    func()
+    tracemalloc.start()
+    try:
+        tracemalloc.clear_traces()
+        current = tracemalloc.get_traced_memory()[0]
+        if hasattr(tracemalloc, "reset_peak"):
+            tracemalloc.reset_peak()
+        func()
+        return tracemalloc.get_traced_memory()[1] - current
+    finally:
+        tracemalloc.stop()
+
+
+def measure(func, samples=20, sample_time=0.02):
+    number = calibrate(func, sample_time)
+    times = []
+    for _ in range(samples):
+        start = clock()
+        for _ in range(number):
+            func()
+        times.append((clock() - start) / number)
+    mean = sum(times) / len(times)
+    return OrderedDict([
+        ("ops_per_sec", 1.0 / mean),
+        ("mean_us", mean * 1e6),
+        ("p50_us", percentile(times, 50) * 1e6),
+        ("p90_us", percentile(times, 90) * 1e6),
+        ("p99_us", percentile(times, 99) * 1e6),
+        ("alloc_bytes", allocations(func)),
+        ("number", number),
+        ("samples", samples),
+    ])
+
+
+def run(patterns=(), samples=20, sample_time=0.02, quiet=False):
+    results = OrderedDict()
+    for name, func in CASES.items():
+        if patterns and not any(p in name for p in patterns):
+            continue
+        results[name] = measure(func, samples, sample_time)
+        if not quiet:
+            r = results[name]
+            print("%-28s %12.0f ops/s  p50 %9.3f us  p99 %9.3f us  alloc %s B" % (
+                name, r["ops_per_sec"], r["p50_us"], r["p99_us"], r["alloc_bytes"]))
+    return OrderedDict([
+        ("meta", OrderedDict([
+            ("python", platform.python_version()),
+            ("implementation", platform.python_implementation()),
+            ("machine", platform.machine()),
+            ("platform", platform.platform()),
+            ("validator_version", validator.__version__),
+            ("time", time.strftime("%Y-%m-%dT%H:%M:%S")),
+        ])),
+        ("results", results),
+    ])
+
+
+def compare(report, baseline, threshold=0.1):
+    """
+    和基线比较各用例的p50, 返回变慢超过 threshold 的用例名
+    """
+    regressions = []
+    for name, result in report["results"].items():
+        base = baseline["results"].get(name)
+        if base is None:
+            continue
+        ratio = result["p50_us"] / base["p50_us"]
+        flag = ""
+        if ratio > 1 + threshold:
+            regressions.append(name)
+            flag = "  REGRESSION"
+        print("%-28s %9.3f us -> %9.3f us  %+7.1f%%%s" % (
+            name, base["p50_us"], result["p50_us"], (ratio - 1) * 100, flag))
+    return regressions
+
+
+def dump(report, path):
+    directory = os.path.dirname(path)
+    if directory and not os.path.isdir(directory):
+        os.makedirs(directory)
+    with open(path, "w") as f:
+        json.dump(report, f, indent=2)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="validator.py micro-benchmarks")
+    parser.add_argument("-k", dest="patterns", action="append", default=[],
+                        help="only run cases whose name contains this, can be repeated")
+    parser.add_argument("--samples", type=int, default=20)
+    parser.add_argument("--sample-time", type=float, default=0.02, help="seconds per sample")
+    parser.add_argument("--json", help="write the results to this file")
+    parser.add_argument("--baseline", default=DEFAULT_BASELINE)
+    parser.add_argument("--save-baseline", action="store_true", help="save the results as the baseline")
+    parser.add_argument("--compare", action="store_true", help="compare with the baseline")
+    parser.add_argument("--threshold", type=float, default=0.1, help="allowed slowdown of p50, 0.1 = 10%%")
+    parser.add_argument("--list", action="store_true", help="list the case names")
+    options = parser.parse_args(argv)
+
+    if options.list:
+        for name in CASES:
+            print(name)
+        return 0
+    if options.compare and not options.save_baseline and not os.path.isfile(options.baseline):
+        parser.error("no baseline at %s, run with --save-baseline first or pass --baseline" % options.baseline)
+    report = run(options.patterns, options.samples, options.sample_time, quiet=options.json == "-")
+    if options.json == "-":
+        json.dump(report, sys.stdout, indent=2)
+    elif options.json:
+        dump(report, options.json)
+    if options.save_baseline:
+        dump(report, options.baseline)
+        print("baseline saved to %s" % options.baseline)
+    if options.compare:
+        with open(options.baseline) as f:
+            baseline = json.load(f)
+        regressions = compare(report, baseline, options.threshold)
+        if regressions:
+            print("%d case(s) slower than the baseline by more than %d%%: %s" % (
+                len(regressions), options.threshold * 100, ", ".join(regressions)))
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,312 @@
+# -*- coding:utf-8 -*-
+"""
+端到端的WSGI压测: 用并发客户端请求同一个flask应用, 比较 validator / validator_func / validator_sub
+和不做校验(none)时的吞吐量和 p50/p99 延迟, 分别测试合法/不合法的参数以及不同的字段数(payload宽度)
+
+    python benchmarks/load_wsgi.py                              # 进程内直接调用 app.wsgi_app
+    python benchmarks/load_wsgi.py --mode http --port 6001      # 启动本地werkzeug线程服务器, 走真实的http连接
+    python benchmarks/load_wsgi.py --concurrency 16 --requests 5000 --widths 13,52 --json load.json
+
+示例应用(flask_validator_example*.py)里还在用旧的 validator_wrap/validator_args, 不能直接import,
+所以这里按照示例中的 rules_example 和 curl 参数重新搭了一个应用, 参数都以json body的形式发送
+(validator_sub 会读取 request.json, 表单请求在新版本的werkzeug下会直接报415)
+"""
+import os
+import sys
+import json
+import time
+import platform
+import logging
+import argparse
+import threading
+from collections import OrderedDict
+
+try:
+    from http.client import HTTPConnection
+except ImportError:
+    # python 2
+    from httplib import HTTPConnection
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from flask import Flask, jsonify, request
+from werkzeug.test import EnvironBuilder
+from werkzeug.serving import make_server
+
+from validator import (
+    Required, Equals, Truthy, In, Not, Range, Length, InstanceOf, Pattern, GreaterThan, Isalnum, Isalpha, Isdigit,
+    validator, validator_func, validator_sub,
+)
+
+clock = getattr(time, "perf_counter", time.time)
+
+# flask_validator_example.py 中的 rules_example
+RULES_EXAMPLE = OrderedDict([
+    ("a", [Required, Equals("123")]),
+    ("b", [Required, Truthy()]),
+    ("c", [In(["spam", "eggs", "bacon"])]),
+    ("d", [Not(Range(1, 100))]),
+    ("e", [Length(0, maximum=5)]),
+    ("f", [Required, InstanceOf(str)]),
+    ("g", [Required, Not(In(["spam", "eggs", "bacon"]))]),
+    ("h", [Required, Pattern(r"\d\d\%")]),
+    ("i", [Required, GreaterThan(1, reverse=True, auto=True)]),
+    ("j", [lambda x: x == "bar"]),
+    ("k", [Required, Isalnum()]),
+    ("l", [Required, Isalpha()]),
+    ("m", [Required, Isdigit()]),
+])
+# README 中 curl 示例的参数
+VALID = {"a": "123", "b": "123", "c": "spam", "d": "123", "e": "1236", "f": "123", "g": "spa1", "h": "11%",
+         "i": "12", "j": "bar", "k": "32", "l": "abc", "m": "123"}
+INVALID = {"a": "1234", "b": "", "c": "nospam", "d": "13", "e": "123456", "f": "123", "g": "spa1", "h": "11%",
+           "i": "12", "j": "bar", "k": "3a2", "l": "1abc", "m": "123a"}
+
+ENTRY_POINTS = ("none", "validator", "validator_func", "validator_sub")
+
+
+def widen(mapping, width):
+    """
+    把示例的13个字段循环复制成 width 个字段: a, b, ... m, a1, b1, ...
+    """
+    keys = list(mapping)
+    wide = OrderedDict()
+    for index in range(width):
+        key = keys[index % len(keys)]
+        suffix = index // len(keys)
+        wide[key + (str(suffix) if suffix else "")] = mapping[key]
+    return wide
+
+
+def build_app(rules):
+    app = Flask(__name__)
+
+    @app.route("/none", methods=["POST"])
+    def none():
+        return jsonify({"code": 200, "data": request.get_json(), "err": None})
+
+    @app.route("/validator", methods=["POST"])
+    @validator(rules=rules, strip=True, json=True, args=False)
+    def with_validator():
+        return jsonify({"code": 200, "data": request.get_json(), "err": None})
+
+    @validator_func(rules=rules, strip=True)
+    def handle(**fields):
+        return True, fields
+
+    @app.route("/validator_func", methods=["POST"])
+    def with_validator_func():
+        result, data = handle(**request.get_json())
+        if not result:
+            return jsonify({"code": 500, "data": None, "err": data})
+        return jsonify({"code": 200, "data": data, "err": None})
+
+    @app.route("/validator_sub", methods=["POST"])
+    def with_validator_sub():
+        result, data = validator_sub(rules=rules, strip=True)
+        if not result:
+            return jsonify({"code": 500, "data": None, "err": data})
+        return jsonify({"code": 200, "data": data, "err": None})
+
+    return app
+
+
+class InProcessClient(object):
+    """
+    直接调用 app.wsgi_app, 不经过网络和http解析
+    """
+
+    def __init__(self, app):
+        self.app = app.wsgi_app
+
+    def post(self, path, body):
+        environ = EnvironBuilder(path=path, method="POST", data=body, content_type="application/json").get_environ()
+        status = []
+        chunks = self.app(environ, lambda s, headers, exc_info=None: status.append(s))
+        try:
+            data = b"".join(chunks)
+        finally:
+            if hasattr(chunks, "close"):
+                chunks.close()
+        return int(status[0].split(" ", 1)[0]), data
+
+    def close(self):
+        pass
+
+
+class HTTPClient(object):
+    """
+    每个客户端线程一个保持连接的 HTTPConnection
+    """
+
+    headers = {"Content-Type": "application/json"}
+
+    def __init__(self, host, port):
+        self.connection = HTTPConnection(host, port)
+
+    def post(self, path, body):
+        self.connection.request("POST", path, body, self.headers)
+        response = self.connection.getresponse()
+        return response.status, response.read()
+
+    def close(self):
+        self.connection.close()
+
+
+def percentile(values, q):
+    values = sorted(values)
+    index = min(len(values) - 1, int(round(q / 100.0 * (len(values) - 1))))
+    return values[index]
+
+
+def drive(make_client, path, body, requests, concurrency):
+    """
+    concurrency 个线程一共发送 requests 个请求, 返回吞吐量和延迟
+    """
+    latencies = []
+    errors = []
+    lock = threading.Lock()
+    per_thread = [requests // concurrency + (1 if i < requests % concurrency else 0) for i in range(concurrency)]
+    start_line = threading.Event()
+
+    def worker(count):
+        client = make_client()
+        own = []
+        try:
+            start_line.wait()
+            for _ in range(count):
+                start = clock()
+                status, _ = client.post(path, body)
+                own.append(clock() - start)
+                if status != 200:
+                    errors.append(status)
+        finally:
+            client.close()
+            with lock:
+                latencies.extend(own)
+
+    threads = [threading.Thread(target=worker, args=(count,)) for count in per_thread if count]
+    for t in threads:
+        t.start()
+    start = clock()
+    start_line.set()
+    for t in threads:
+        t.join()
+    elapsed = clock() - start
+    return OrderedDict([
+        ("requests", len(latencies)),
+        ("rps", len(latencies) / elapsed),
+        ("p50_ms", percentile(latencies, 50) * 1e3),
+        ("p99_ms", percentile(latencies, 99) * 1e3),
+        ("mean_ms", sum(latencies) / len(latencies) * 1e3),
+        ("http_errors", len(errors)),
+    ])
+
+
+def check_app(client, body, valid):
+    # 先确认每个入口对这份参数的校验结果符合预期
+    for entry in ENTRY_POINTS:
+        status, data = client.post("/" + entry, body)
+        code = json.loads(data.decode("utf-8"))["code"]
+        expected = 200 if valid or entry == "none" else 500
+        if status != 200 or code != expected:
+            raise AssertionError("/%s returned %s %s for a %s payload" % (
+                entry, status, data[:200], "valid" if valid else "invalid"))
+
+
+def run(mode="inprocess", widths=(13, 52, 208), requests=2000, concurrency=8, host="127.0.0.1", port=6001,
+        entries=ENTRY_POINTS, quiet=False):
+    results = []
+    for width in widths:
+        app = build_app(widen(RULES_EXAMPLE, width))
+        server = None
+        if mode == "http":
+            # 不输出每个请求的访问日志
+            logging.getLogger("werkzeug").setLevel(logging.ERROR)
+            server = make_server(host, port, app, threaded=True)
+            threading.Thread(target=server.serve_forever).start()
+            make_client = lambda: HTTPClient(host, port)
+        else:
+            make_client = lambda: InProcessClient(app)
+        try:
+            for payload, valid in (("valid", True), ("invalid", False)):
+                body = json.dumps(widen(VALID if valid else INVALID, width))
+                client = make_client()
+                try:
+                    check_app(client, body, valid)
+                finally:
+                    client.close()
+                for entry in entries:
+                    # 预热
+                    drive(make_client, "/" + entry, body, min(200, requests), concurrency)
+                    result = drive(make_client, "/" + entry, body, requests, concurrency)
+                    result = OrderedDict([("entry", entry), ("payload", payload), ("width", width)] +
+                                         list(result.items()))
+                    results.append(result)
+                    if not quiet:
+                        print("%-15s %-8s width %4d  %8.0f req/s  p50 %7.3f ms  p99 %7.3f ms" % (
+                            entry, payload, width, result["rps"], result["p50_ms"], result["p99_ms"]))
+        finally:
+            if server is not None:
+                server.shutdown()
+                server.server_close()
+    return OrderedDict([
+        ("meta", OrderedDict([
+            ("mode", mode),
+            ("concurrency", concurrency),
+            ("python", platform.python_version()),
+            ("platform", platform.platform()),
+            ("time", time.strftime("%Y-%m-%dT%H:%M:%S")),
+        ])),
+        ("results", results),
+    ])
+
+
+def overhead(report):
+    """
+    各入口相对 none 在同样的 payload/宽度 下每个请求多出的 p50 延迟(ms)
+    """
+    baseline = dict(((r["payload"], r["width"]), r["p50_ms"]) for r in report["results"] if r["entry"] == "none")
+    rows = []
+    for r in report["results"]:
+        base = baseline.get((r["payload"], r["width"]))
+        if r["entry"] != "none" and base is not None:
+            rows.append((r["entry"], r["payload"], r["width"], r["p50_ms"] - base))
+    return rows
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="end-to-end WSGI load test of the validator decorators")
+    parser.add_argument("--mode", choices=("inprocess", "http"), default="inprocess")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=6001)
+    parser.add_argument("--widths", default="13,52,208", help="number of fields per payload, comma separated")
+    parser.add_argument("--requests", type=int, default=2000, help="requests per entry point and payload")
+    parser.add_argument("--concurrency", type=int, default=8, help="client threads")
+    parser.add_argument("--entry", action="append", choices=ENTRY_POINTS, help="only these entry points")
+    parser.add_argument("--json", help="write the results to this file, - for stdout")
+    options = parser.parse_args(argv)
+
+    widths = [int(w) for w in options.widths.split(",")]
+    entries = options.entry or ENTRY_POINTS
+    if "none" not in entries:
+        entries = ("none",) + tuple(entries)
+    quiet = options.json == "-"
+    report = run(options.mode, widths, options.requests, options.concurrency, options.host, options.port,
+                 entries, quiet)
+    if quiet:
+        json.dump(report, sys.stdout, indent=2)
+    else:
+        print("")
+        print("p50 overhead per request compared to no validation:")
+        for entry, payload, width, extra in overhead(report):
+            print("%-15s %-8s width %4d  %+7.3f ms" % (entry, payload, width, extra))
+        if options.json:
+            with open(options.json, "w") as f:
+                json.dump(report, f, indent=2)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,30 @@
+# -*- coding:utf-8 -*-
+import os
+import ast
+import sys
+import subprocess
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+HEAVY = ("flask", "werkzeug", "numpy", "orjson")
+
+SCRIPT = """
+import sys, time
+start = time.perf_counter()
+import %s
+elapsed = time.perf_counter() - start
+heavy = sorted(set(m.split(".")[0] for m in sys.modules) & set(%r))
+print(repr((elapsed, heavy)))
+"""
+
+
+@pytest.mark.parametrize("module", ["validator_core", "validator"])
+def test_import_is_light(module):
+    # a fresh interpreter, other tests have imported flask already
+    output = subprocess.check_output([sys.executable, "-c", SCRIPT % (module, HEAVY)], cwd=ROOT)
+    elapsed, heavy = ast.literal_eval(output.decode("ascii"))
+    assert heavy == []
+    # about 25 ms for validator_core, generous for slow CI machines
+    assert elapsed < 1.0
@@ -0,0 +1,248 @@
+# -*- coding:utf-8 -*-
+import os
+import sys
+import logging
+import json
+import datetime
+from decimal import Decimal
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+flask = pytest.importorskip("flask")
+
+import validator as validator_module
+from validator import (
+    Required, Length, Range, GreaterThan, Coerce, Date, Each, validate, validator, validator_func, validator_sub,
+    validator_stream, ErrorLog, use_background_logging, ErrorResponse,
+)
+
+
+def test_strip_applies_to_keys_the_rules_do_not_read():
+    app = flask.Flask(__name__)
+
+    @app.route("/strip")
+    @validator({"a": [Required, Length(1, 3)]})
+    def strip():
+        return flask.jsonify(dict(flask.request.args.items()))
+
+    @app.route("/keep")
+    @validator({"a": [Required, Length(1, 3)]}, strip=False)
+    def keep():
+        return flask.jsonify(dict(flask.request.args.items()))
+
+    client = app.test_client()
+    assert client.get("/strip?a=1&b=%20x%20").get_json() == {"a": "1", "b": "x"}
+    assert client.get("/keep?a=1&b=%20x%20").get_json() == {"a": "1", "b": " x "}
+
+
+def test_stream_reports_validator_exceptions_as_errors():
+    app = flask.Flask(__name__)
+
+    @app.route("/lengths", methods=["POST"])
+    @validator_stream([Length(1, 3)])
+    def lengths(items):
+        return flask.jsonify(list(items))
+
+    @app.route("/ranges", methods=["POST"])
+    @validator_stream([Range(0, 10)])
+    def ranges(items):
+        return flask.jsonify(list(items))
+
+    client = app.test_client()
+    assert client.post("/lengths", data='["ab"]').get_json() == ["ab"]
+    response = client.post("/lengths", data='["ab", 5]')
+    assert response.status_code == 200
+    assert response.get_json()["err"] == {"1": ["all values must be between 1 and 3 elements in length"]}
+    assert client.post("/ranges", data='[1, "x"]').get_json()["err"] == {"1": ["all values must fall between 0 and 10"]}
+
+
+COERCED = {
+    "page": [Required, Coerce(int), Range(1, 100, auto=False)],
+    "flag": [Coerce(bool)],
+    "price": [Coerce(Decimal)],
+    "day": [Date(convert=True)],
+    "ratio": [GreaterThan(0, convert=True)],
+}
+RAW = {"page": "3", "flag": "false", "price": "1.50", "day": "2020-01-02", "ratio": "0.5"}
+TYPED = {"page": 3, "flag": False, "price": Decimal("1.50"), "day": datetime.date(2020, 1, 2), "ratio": 0.5}
+
+
+def test_validator_hands_converted_values_to_the_view():
+    app = flask.Flask(__name__)
+    seen = {}
+
+    @app.route("/args")
+    @validator(COERCED)
+    def args():
+        seen["args"] = dict((k, flask.request.args[k]) for k in RAW)
+        return "ok"
+
+    @app.route("/json", methods=["POST"])
+    @validator(COERCED, json=True, args=False)
+    def body():
+        seen["json"] = dict((k, flask.request.json[k]) for k in RAW)
+        return "ok"
+
+    client = app.test_client()
+    assert client.get("/args", query_string=RAW).data == b"ok"
+    assert client.post("/json", json=RAW).data == b"ok"
+    assert seen == {"args": TYPED, "json": TYPED}
+    assert client.get("/args", query_string=dict(RAW, page="three")).get_json()["err"] == {
+        "page": ["must be convertible to int"]}
+
+
+def test_validator_func_hands_converted_values_to_the_function():
+    @validator_func(COERCED)
+    def handler(page, flag, price, day, ratio=None):
+        return page, flag, price, day, ratio
+
+    assert handler("3", "false", "1.50", day="2020-01-02", ratio="0.5") == (
+        3, False, Decimal("1.50"), datetime.date(2020, 1, 2), 0.5)
+    assert handler("0", "false", "1.50", day="2020-01-02", ratio="1") == (False, {"page": ["must fall between 1 and 100"]})
+
+
+def test_validator_sub_returns_converted_values():
+    app = flask.Flask(__name__)
+    with app.test_request_context("/", method="POST", json=RAW):
+        assert validator_sub(COERCED) == (True, TYPED)
+
+
+def test_coerce_only_converts_in_a_list_of_rules():
+    data = {"bare": "3", "items": ["1", "2"]}
+    assert validate({"bare": Coerce(int), "items": [Each([Coerce(int)])]}, data).valid
+    assert data == {"bare": "3", "items": ["1", "2"]}
+
+
+class Records(logging.Handler):
+    def __init__(self):
+        logging.Handler.__init__(self)
+        self.records = []
+
+    def emit(self, record):
+        self.records.append(record)
+
+
+def fail(error_log, route, kind=ValueError):
+    try:
+        raise kind(route)
+    except Exception:
+        error_log.exception(route)
+
+
+def fail_elsewhere(error_log, route):
+    try:
+        raise ValueError(route)
+    except Exception:
+        error_log.exception(route)
+
+
+def test_error_log_limits_bursts_and_repeats(monkeypatch):
+    now = [0.0]
+    monkeypatch.setattr(validator_module, "_monotonic", lambda: now[0])
+    logger = logging.getLogger("validator.test")
+    logger.propagate = False
+    records = Records()
+    logger.addHandler(records)
+    error_log = ErrorLog(logger, burst=2, interval=60.0)
+    # the same signature is logged once per window
+    for _ in range(3):
+        fail(error_log, "a")
+    assert [r.suppressed for r in records.records] == [0]
+    # a new signature is logged with the count dropped before it
+    fail(error_log, "a", KeyError)
+    assert [r.suppressed for r in records.records] == [0, 2]
+    # burst reached, new signatures are dropped too
+    fail_elsewhere(error_log, "a")
+    fail(error_log, "a", TypeError)
+    assert len(records.records) == 2
+    # routes have their own windows
+    fail(error_log, "b")
+    assert [r.route for r in records.records] == ["a", "a", "b"]
+    assert records.records[0].exc_info[0] is ValueError and records.records[0].error_signature[0] is ValueError
+    # the next window reports what the last one dropped
+    now[0] = 61.0
+    fail(error_log, "a")
+    fail(error_log, "a")
+    assert [(r.route, r.suppressed) for r in records.records[3:]] == [("a", 2)]
+    assert "(2 similar suppressed)" in records.records[3].getMessage()
+    error_log.reset()
+    fail(error_log, "a")
+    assert records.records[-1].suppressed == 0 and len(records.records) == 5
+    logger.removeHandler(records)
+
+
+def test_background_logging_propagation():
+    logger = validator_module.logger
+    propagate, handlers = logger.propagate, list(logger.handlers)
+    records = Records()
+    try:
+        listener = use_background_logging(records)
+        assert logger.propagate is False
+        logger.error("queued")
+        listener.stop()
+        assert [r.getMessage() for r in records.records] == ["queued"]
+        listener = use_background_logging(records, propagate=True)
+        assert logger.propagate is True
+        # the earlier queue handler was replaced
+        assert len(logger.handlers) == len(handlers) + 1
+        listener.stop()
+    finally:
+        logger.handlers[:] = handlers
+        logger.propagate = propagate
+
+
+def test_error_response_status_and_envelope():
+    app = flask.Flask(__name__)
+    rejected = ErrorResponse(status=400, envelope=lambda err: {"error": err})
+
+    @app.route("/")
+    @validator({"a": [Required]}, response=rejected)
+    def view():
+        return "ok"
+
+    response = app.test_client().get("/?b=1")
+    assert response.status_code == 400 and response.content_type == "application/json"
+    assert response.get_json() == {"error": {"a": "must be present"}}
+    with app.app_context():
+        default = ErrorResponse()({"a": "x"})
+    assert default.status_code == 200 and json.loads(default.get_data()) == {"code": 500, "data": None, "err": {"a": "x"}}
+
+
+def test_error_response_keeps_a_bounded_lru_of_bodies():
+    encoded = []
+
+    def dumps(obj):
+        encoded.append(obj["err"])
+        return json.dumps(obj)
+
+    response = ErrorResponse(dumps=dumps, maxsize=2)
+    assert response.body({"a": 1}) == response.body({"a": 1}) == '{"code": 500, "data": null, "err": {"a": 1}}'
+    # equal but differently typed errors get their own body
+    response.body({"a": True})
+    assert encoded == [{"a": 1}, {"a": True}]
+    # {"a": 1} was used last, so {"a": True} is evicted
+    response.body({"a": 1})
+    response.body({"b": 1})
+    assert list(response._bodies) == [repr({"a": 1}), repr({"b": 1})]
+    response.body({"a": True})
+    assert len(encoded) == 4 and len(response._bodies) == 2
+    response.clear()
+    response.body({"b": 1})
+    assert len(encoded) == 5
+    uncached = ErrorResponse(dumps=dumps, maxsize=0)
+    uncached.body("x")
+    uncached.body("x")
+    assert encoded[-2:] == ["x", "x"] and not uncached._bodies
+
+
+def test_error_response_falls_back_to_str():
+    class Code(object):
+        def __str__(self):
+            return "E42"
+
+    response = ErrorResponse(maxsize=0)
+    assert json.loads(response.body({"a": Code()})) == {"code": 500, "data": None, "err": {"a": "E42"}}
+    assert json.loads(ErrorResponse(dumps=json.dumps).body({"a": {1, 2}}))["err"] == {"a": "{1, 2}"}
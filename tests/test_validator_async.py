@@ -0,0 +1,117 @@
+# -*- coding:utf-8 -*-
+import os
+import sys
+import time
+import asyncio
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+flask = pytest.importorskip("flask")
+
+from validator import Required, Length, Range, Coerce, Each, Equals, validate
+from validator_async import validate_async, validator_async, validator_func_async
+
+
+class Slow(object):
+    err_message = "too slow"
+
+    def __init__(self, delay=0.01, valid=True):
+        self.delay = delay
+        self.valid = valid
+        self.running = 0
+        self.most = 0
+        self.values = []
+
+    async def __call__(self, value):
+        self.values.append(value)
+        self.running += 1
+        self.most = max(self.most, self.running)
+        try:
+            await asyncio.sleep(self.delay)
+        finally:
+            self.running -= 1
+        return self.valid
+
+
+def test_concurrency_limits_the_running_validators():
+    slow = Slow()
+    data = {"items": list(range(10)), "a": 1}
+    result = asyncio.run(validate_async({"items": [Each([slow])], "a": [slow]}, data, concurrency=3))
+    assert result == (True, {})
+    assert slow.most == 3 and sorted(slow.values) == sorted(list(range(10)) + [1])
+    unbounded = Slow()
+    asyncio.run(validate_async({"items": [Each([unbounded])]}, data))
+    assert unbounded.most == 10
+
+
+def test_timeout_fails_the_validator():
+    started = time.time()
+    result = asyncio.run(validate_async({"a": [Slow(5)], "b": [Slow(0)]}, {"a": 1, "b": 2}, timeout=0.05))
+    assert result == (False, {"a": ["too slow"]})
+    assert time.time() - started < 1
+
+
+class Fixed(object):
+    # Slow without the awaiting, for validate
+    err_message = "too slow"
+
+    def __init__(self, delay=0, valid=True):
+        self.valid = valid
+
+    def __call__(self, value):
+        return self.valid
+
+
+def test_errors_match_validate():
+    def broken(value):
+        raise ValueError(value)
+
+    def rules(make):
+        return {
+            "late": [make(0.03, False)],
+            "a": [Required, Length(1, 2), Equals("x")],
+            "missing": [Required],
+            "early": [make(0, False)],
+            "items": [Each([Range(0, 10), make(0.01, True)])],
+            "raising": [Each([broken])],
+            "nested": [{"x": [Required], "y": [make(0.02, False)]}],
+        }
+
+    data = {"late": 1, "a": "abc", "early": 2, "items": [1, "x", 20], "raising": [1], "nested": {"y": 1}}
+    for fail_fast in (False, True):
+        result = asyncio.run(validate_async(rules(Slow), data, fail_fast))
+        expected = validate(rules(Fixed), data, fail_fast)
+        assert result == expected and list(result.errors) == list(expected.errors)
+    assert list(result.errors) == ["late"]
+    assert validate(rules(Fixed), data).errors["raising"] == ["failed validation"]
+
+
+def test_converted_values_reach_later_validators_and_the_function():
+    positive = Slow()
+    data = {"page": "3"}
+    rules = {"page": [Coerce(int), positive, Range(1, 5, auto=False)]}
+    assert asyncio.run(validate_async(rules, data)) == (True, {})
+    assert positive.values == [3] and data == {"page": 3}
+
+    @validator_func_async(rules)
+    async def handler(page):
+        return page
+
+    assert asyncio.run(handler("4")) == 4
+    assert asyncio.run(handler("x")) == (False, {"page": ["must be convertible to int"]})
+
+
+def test_validator_async_converts_the_request_values():
+    app = flask.Flask(__name__)
+
+    @validator_async({"page": [Required, Coerce(int), Slow()]}, timeout=1)
+    async def view():
+        return flask.request.args["page"]
+
+    with app.test_request_context("/?page=3"):
+        assert asyncio.run(view()) == 3
+    with app.test_request_context("/?page=x"):
+        assert asyncio.run(view()).get_json()["err"] == {"page": ["must be convertible to int"]}
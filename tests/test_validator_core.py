@@ -0,0 +1,307 @@
+# -*- coding:utf-8 -*-
+import io
+import os
+import sys
+import json
+import datetime
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import validator_core
+from validator_core import (
+    Required, Length, Range, GreaterThan, Equals, In, Isalnum, Not, Each, Then, If, BatchValidator, ValidationResult,
+    validate, validate_many, validator_registry, compile_rules, compile_pattern, ResultCache, Memoized, memoize_rules, InstanceOf, Date, Email, iter_json_array, StreamValidationError, enable_metrics, disable_metrics,
+)
+
+
+def test_validate_follows_a_mapping_edited_in_place():
+    rules = {"a": [Required, Length(1, 3)], "n": [{"x": [Required]}], "c": Range(0, 10)}
+    data = {"a": "xy", "n": {"x": 1}, "c": 5}
+    assert validate(rules, data) == (True, {})
+    rules["b"] = [Required]
+    rules["a"].append(Equals("z"))
+    rules["n"][0]["y"] = [Required]
+    expected = {"a": ["must be equal to 'z'"], "n": [{"y": "must be present"}], "b": "must be present"}
+    assert validate(rules, data).errors == expected
+    # the same answers as the compiled plan
+    for fail_fast in (False, True):
+        for record in (data, {}, {"a": 5, "n": {}, "c": "x", "b": 1}):
+            assert validate(rules, record, fail_fast) == compile_rules(rules)(record, fail_fast)
+
+
+def test_fail_fast_stops_each_at_the_first_bad_item():
+    rules = {"lines": [Each({"qty": [Required, GreaterThan(0)]})], "tags": [Each([Length(1, 3)])]}
+    data = {"lines": [{"qty": 0}, {"qty": -1}, {}, {"qty": 2}], "tags": ["abcd", "", "ok"]}
+    assert validate(rules, data).errors == {
+        "lines": [{0: {"qty": ["must be greater than 0"]},
+                   1: {"qty": ["must be greater than 0"]},
+                   2: {"qty": "must be present"}}],
+        "tags": ["all values must be between 1 and 3 elements in length"] * 2,
+    }
+    assert validate(rules, data, fail_fast=True).errors == {"lines": [{0: {"qty": ["must be greater than 0"]}}]}
+    assert validate({"tags": rules["tags"]}, data, fail_fast=True).errors == {
+        "tags": ["all values must be between 1 and 3 elements in length"]}
+    generated = compile_rules(rules, codegen=True)
+    assert generated(data, fail_fast=True).errors == {"lines": [{0: {"qty": ["must be greater than 0"]}}]}
+
+
+def test_vectorized_each_keeps_nul_characters():
+    # long enough for the NumPy path, which must not treat "a\x00" as "a"
+    values = ["a\x00"] + ["a"] * (Each.vectorize_min + 10)
+    for each in (Each([Equals("a")]), Each([In(["a", "b"])]), Each([Length(1, 1)])):
+        valid, errors = each(values)
+        assert not valid and len(errors) == 1
+        assert each.failing_indices(values) == [0]
+    valid, errors = Each([Equals("a\x00")])(["a"] * (Each.vectorize_min + 10))
+    assert not valid
+
+
+def test_vectorized_each_keeps_large_ints_exact():
+    values = [2 ** 53 + 1] + [0.5] * (Each.vectorize_min + 10)
+    for each in (Each([Range(0, 2 ** 53, auto=False)]), Each([In([2 ** 53, 0.5])])):
+        for container in (values, values[:10], [2 ** 53 + 1] * (Each.vectorize_min + 10)):
+            valid, errors = each(container)
+            assert not valid and each.failing_indices(container)[0] == 0
+    # as float64 2 ** 53 + 1 would round down to the bound
+    assert Each([GreaterThan(2.0 ** 53, auto=False)])([2 ** 53 + 1] * (Each.vectorize_min + 10)) == (True, [])
+    assert Each([Range(-1, 2 ** 53 + 2, auto=False)])(values) == (True, [])
+
+
+def test_iter_json_array_rejects_data_after_the_array():
+    assert list(iter_json_array(io.BytesIO(b" [1, {\"a\": [2]}] \n"), 3)) == [1, {"a": [2]}]
+    for body in (b"[1] x", b"[1]]", b"[1] [2]"):
+        with pytest.raises(ValueError):
+            list(iter_json_array(io.BytesIO(body), 2))
+
+
+def test_iter_json_array_reads_elements_longer_than_a_chunk():
+    items = [{"blob": "x\\\"y" * 5000, "n": [1, [2, {"z": "]}"}]]}, "tail", 12.5e3]
+    body = json.dumps(items).encode("utf-8")
+    for chunk_size in (1, 7, 4096):
+        assert list(iter_json_array(io.BytesIO(body), chunk_size)) == items
+
+
+def test_iter_valid_counts_exceptions_as_failures():
+    each = Each([Length(1, 3)])
+    items = each.iter_valid(iter(["ab", 5]))
+    assert next(items) == "ab"
+    with pytest.raises(StreamValidationError) as e:
+        next(items)
+    assert (e.value.index, e.value.errors) == (1, ["all values must be between 1 and 3 elements in length"])
+    with pytest.raises(StreamValidationError) as e:
+        list(Each([Range(0, 10)]).iter_valid([1, "x"]))
+    assert e.value.errors == ["all values must fall between 0 and 10"]
+
+
+def test_in_indexes_its_collection():
+    hashed = In([1, "a", (2, 3)])
+    assert hashed.index == frozenset([1, "a", (2, 3)]) and hashed.sorted is None
+    assert hashed("a") and hashed((2, 3)) and not hashed(4)
+    # an unhashable value falls back to the collection
+    assert not hashed([1]) and In([[1], 2])([1]) is True
+
+    ordered = In([[3, 4], [1, 2], [5]])
+    assert ordered.index is None and ordered.sorted == [[1, 2], [3, 4], [5]]
+    assert ordered([3, 4]) and ordered([5]) and not ordered([2]) and not ordered([9])
+    assert not ordered("x")
+
+    ports = In([(8000, 8999), (1, 1023), (1000, 2000), (3000, 3000)], intervals=True)
+    assert ports.sorted == [1, 3000, 8000] and ports.highs == [2000, 3000, 8999]
+    for port in (1, 1023, 1500, 2000, 3000, 8080):
+        assert ports(port)
+    for port in (0, 2001, 2999, 3001, 9000):
+        assert not ports(port)
+    assert ports.err_message.startswith("must fall within one of [(8000, 8999)")
+
+
+def test_in_lists_at_most_max_listed_values():
+    assert In([1, 2]).err_message == "must be one of [1, 2]"
+    many = In(list(range(100)))
+    assert many.err_message == "must be one of [%s, ...] (100 values)" % ", ".join(map(str, range(20)))
+    assert many.not_message.startswith("must not be one of [0, 1,") and many.not_message.endswith("(100 values)")
+
+    class Short(In):
+        max_listed = 3
+
+    assert Short(list(range(10))).err_message == "must be one of [0, 1, 2, ...] (10 values)"
+
+
+class Calls(object):
+    err_message = "odd"
+
+    def __init__(self, check):
+        self.check = check
+        self.values = []
+
+    def __call__(self, value):
+        self.values.append(value)
+        return self.check(value)
+
+
+def test_result_cache_counts_and_evicts():
+    cache = ResultCache(maxsize=2)
+    even = Calls(lambda value: value % 2 == 0)
+    memoized = Memoized(even, cache)
+    assert [memoized(value) for value in (2, 3, 2, 2)] == [True, False, True, True]
+    assert even.values == [2, 3] and cache.info() == (2, 2, 2, 2)
+    # 3 is the least recently used, 4 evicts it
+    memoized(4)
+    memoized(2)
+    memoized(3)
+    assert even.values == [2, 3, 4, 3] and cache.info() == (3, 4, 2, 2)
+    # unhashable values are validated every time
+    assert not Memoized(InstanceOf(int), cache)([1]) and cache.info().misses == 4
+    cache.clear()
+    assert cache.info() == (0, 0, 2, 0)
+
+
+def test_result_cache_tells_equal_values_of_other_types_apart():
+    cache = ResultCache()
+    is_int = Memoized(Calls(lambda value: type(value) is int), cache)
+    assert is_int(1) and not is_int(True) and not is_int(1.0) and is_int(1)
+    assert cache.info() == (1, 3, 4096, 3)
+
+
+def test_result_cache_does_not_keep_exceptions():
+    cache = ResultCache()
+    length = Calls(len)
+    memoized = Memoized(length, cache)
+    for _ in range(2):
+        with pytest.raises(TypeError):
+            memoized(5)
+    assert length.values == [5, 5] and cache.info() == (0, 0, 4096, 0)
+    assert validate({"a": [memoized]}, {"a": 5}).errors == {"a": ["odd"]}
+
+
+def test_memoize_rules_keeps_converting_validators():
+    cache = ResultCache()
+    rules = memoize_rules({"d": [Date(convert=True)], "e": [Email()], "n": [{"d": [Date()]}]}, cache)
+    assert rules["d"] == [Date(convert=True)]
+    assert isinstance(rules["e"][0], Memoized) and isinstance(rules["n"][0]["d"][0], Memoized)
+    data = {"d": "2020-01-02", "e": "a@b.co", "n": {"d": "2020-01-02"}}
+    assert validate(rules, data).valid
+    assert data["d"] == datetime.date(2020, 1, 2) and data["n"]["d"] == "2020-01-02"
+
+
+def test_compile_pattern_is_bounded():
+    first = compile_pattern(r"^first\d$")
+    for i in range(validator_core._PATTERNS_MAXSIZE + 10):
+        compile_pattern(r"^p%d$" % i)
+    assert len(validator_core._patterns) == validator_core._PATTERNS_MAXSIZE
+    assert compile_pattern(r"^p%d$" % validator_core._PATTERNS_MAXSIZE) is compile_pattern(
+        r"^p%d$" % validator_core._PATTERNS_MAXSIZE)
+    # dropped from the registry, the regex itself still works
+    assert first.match("first1")
+
+
+class Known(BatchValidator):
+    err_message = "unknown"
+
+    def __init__(self, known):
+        self.known = set(known)
+        self.calls = []
+
+    def batch_call(self, values):
+        self.calls.append(list(values))
+        return [value in self.known for value in values]
+
+
+def test_validate_many_batches_across_records():
+    known = Known([1, 2])
+    rules = {"id": [Required, known], "lines": [Each({"id": [known]})]}
+    records = [{"id": 1, "lines": [{"id": 3}]}, {"id": 3}, {"id": 2, "lines": [{"id": 2}]}]
+    result = validate_many(rules, records)
+    assert type(result) is ValidationResult
+    assert result == (False, {0: {"lines": [{0: {"id": ["unknown"]}}]}, 1: {"id": ["unknown"]}})
+    assert known.calls == [[1, 3, 3, 2, 2]]
+    assert validate_many(rules, [{"id": 1}]) == (True, {})
+
+
+class CountingPool(ThreadPoolExecutor):
+    def __init__(self, *args):
+        super(CountingPool, self).__init__(*args)
+        self.chunks = 0
+
+    def map(self, fn, *iterables):
+        iterables = [list(iterable) for iterable in iterables]
+        self.chunks += len(iterables[0])
+        return super(CountingPool, self).map(fn, *iterables)
+
+
+def test_parallel_each_merges_chunks_in_index_order():
+    rules = {"id": [Required, GreaterThan(0)], "name": [Length(1, 3)]}
+    items = [{"id": i % 7, "name": "x" * (i % 5)} for i in range(40)] + [{}]
+    serial = Each(rules)(items)
+    with CountingPool(4) as pool:
+        each = Each(rules, executor=pool, parallel_min=10, chunk_size=3)
+        valid, errors = each(items)
+        assert pool.chunks == 14
+        assert (valid, errors) == serial and not valid
+        assert list(errors) == sorted(errors) and 40 in errors
+        # only the first failing item, although later chunks fail too
+        assert each(items, fail_fast=True) == (False, {0: {"id": ["must be greater than 0"]}})
+        # below parallel_min the pool isn't used
+        assert each(items[1:4]) == Each(rules)(items[1:4]) and pool.chunks == 28
+
+
+def test_batched_each_returns_a_tuple():
+    batched = Each({"id": [Known([1])]})([{"id": 1}, {"id": 2}])
+    plain = Each({"id": [Equals(1)]})([{"id": 1}, {"id": 2}])
+    assert type(batched) is type(plain) is tuple
+    assert batched == (False, {1: {"id": ["unknown"]}})
+
+
+def test_metrics_label_nested_fields_with_their_path():
+    rules = {"order": [{"id": [Required, Equals(1)]}], "lines": [Each({"qty": [GreaterThan(0)]})]}
+    data = {"order": {"id": 2}, "lines": [{"qty": 1}, {"qty": 0}]}
+    registries = []
+    for codegen in (False, True):
+        plan = compile_rules(rules, codegen=codegen)
+        registry = enable_metrics()
+        try:
+            assert not plan(data).valid
+        finally:
+            disable_metrics()
+        registries.append(registry)
+        fields = set(dict(labels)["field"] for name, labels in registry.histograms if name == "validator_field_seconds")
+        assert fields == {"order", "order.id", "lines", "lines.qty"}
+        assert registry.counters[("validator_calls_total", (("validator", "dict"),))] == 1
+        assert registry.counters[("validator_failures_total", (("validator", "GreaterThan"),))] == 1
+    # the generated plan ran its own instrumented function
+    assert plan.instrumented_func is not None
+    assert registries[0].counters == registries[1].counters
+
+
+def test_custom_messages():
+    custom = Length(1, 5, err_message="custom")
+    assert custom is Length(1, 5, err_message="custom") and custom is not Length(1, 5)
+    assert Length(1, 5).err_message == "must be between 1 and 5 elements in length"
+    assert validate({"a": [custom], "b": [Isalnum(err_message="letters")]}, {"a": "", "b": "-"}).errors == {
+        "a": ["custom"], "b": ["letters"]}
+    assert Not(Equals(1, not_message="is one")).err_message == "is one"
+    assert Isalnum.err_message == Isalnum().err_message == "must be numbers and letters"
+    # the messages are kept in slots, built-ins have no __dict__
+    for validator in (custom, Isalnum(err_message="letters"), Length(1, 5)):
+        assert not hasattr(validator, "__dict__")
+    with pytest.raises(AttributeError):
+        Length(1, 5).err_message = "custom"
+    # validators that aren't shared can be modified as before
+    for validator in (Each([Length(1, 5)]), Then({"b": [Required]}), If(Length(1, 5), Then({"b": [Required]})),
+                      In([[1]])):
+        validator.err_message = "custom"
+        assert validator.err_message == "custom"
+    validator_registry.enabled = False
+    try:
+        built_in = Length(1, 5)
+        built_in.err_message = "custom"
+        assert validate({"a": [built_in]}, {"a": ""}).errors == {"a": ["custom"]}
+        constant = Isalnum()
+        constant.err_message = "letters"
+        assert constant.err_message == "letters" and Isalnum().err_message == "must be numbers and letters"
+    finally:
+        validator_registry.enabled = True
+    assert Length(1, 5).err_message == "must be between 1 and 5 elements in length"
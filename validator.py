@@ -12,827 +12,380 @@ url: https://github.com/mansam/validator.py
 __doc__ = "入参校验装饰器"
 __version__ = "1.2.8"
 
-import re
-import copy
-import datetime
-import traceback
+import sys
+import json
+import time
+import threading
+import logging
 from functools import wraps
-from collections import namedtuple, defaultdict, OrderedDict
-from abc import ABCMeta, abstractmethod
-from inspect import getargspec  # , getfullargspec , signature
-from flask import jsonify, request
-from werkzeug.datastructures import MultiDict
-
+from collections import namedtuple, OrderedDict
 try:
     # python 3
-    from urllib.parse import urlparse
+    from inspect import signature, Parameter
 except ImportError:
-    from urlparse import urlparse
-
-ValidationResult = namedtuple('ValidationResult', ['valid', 'errors'])
-# Taken from https://github.com/kvesteri/validators/blob/master/validators/email.py
-USER_REGEX = re.compile(
-    # dot-atom
-    r"(^[-!#$%&'*+/=?^_`{}|~0-9A-Z]+"
-    r"(\.[-!#$%&'*+/=?^_`{}|~0-9A-Z]+)*$"
-    # quoted-string
-    r'|^"([\001-\010\013\014\016-\037!#-\[\]-\177]|'
-    r"""\\[\001-\011\013\014\016-\177])*"$)""",
-    re.IGNORECASE
-)
-DOMAIN_REGEX = re.compile(
-    # domain
-    r'(?:[A-Z0-9](?:[A-Z0-9-]{0,61}[A-Z0-9])?\.)+'
-    r'(?:[A-Z]{2,6}\.?|[A-Z0-9-]{2,}\.?$)'
-    # literal form, ipv4 address (SMTP 4.1.3)
-    r'|^\[(25[0-5]|2[0-4]\d|[0-1]?\d?\d)'
-    r'(\.(25[0-5]|2[0-4]\d|[0-1]?\d?\d)){3}\]$',
-    re.IGNORECASE)
-
-
-def is_str(s):
-    """
-    Python 2/3 compatible check to see
-    if an object is a string type.
-    """
+    from inspect import getargspec
+    signature = None
 
-    try:
-        return isinstance(s, str)
-    except NameError:
-        return isinstance(s, basestring)
+try:
+    import queue
+    from logging.handlers import QueueHandler, QueueListener
+except ImportError:
+    # python 2
+    import Queue as queue
+    QueueHandler = QueueListener = None
 
+import validator_core as _core
+from validator_core import *
 
-# def ChangeType(instance, new_type):
-#     try:
-#         instance = new_type(instance)
-#         return instance
-#     except Exception as e:
-#         return False
+_BindingPlan = namedtuple('_BindingPlan', ['names', 'defaults', 'varargs'])
+# flask/werkzeug and orjson are imported on first use,
+# `import validator` alone costs about as much as validator_core
+_FLASK_NAMES = ("current_app", "jsonify", "request", "MultiDict")
+# optional, faster encoding of error responses;
+# False until _load_orjson has tried to import it
+orjson = False
 
 
-class Validator(object):
+class _LazyFlask(object):
     """
-    Abstract class that advanced
-    validators can inherit from in order
-    to set custom error messages and such.
-
+    Imports flask and werkzeug the first time one of
+    their names is looked up, then keeps them as plain
+    attributes so later lookups cost nothing extra.
     """
 
-    __metaclass__ = ABCMeta
-
-    err_message = "failed validation"
-    not_message = "failed validation"
-
-    @abstractmethod
-    def __call__(self, *args, **kwargs):
-        raise NotImplementedError
-
-
-class Isalnum(Validator):
-    """判断字符串中只能由字母和数字的组合，不能有特殊符号"""
-
-    def __init__(self):
-        self.err_message = "must be numbers and letters"
-        self.not_message = "must not be numbers and letters"
-
-    def __call__(self, value):
-        if is_str(value):
-            return value.isalnum()
-        else:
-            return False
-
+    def __getattr__(self, name):
+        if name not in _FLASK_NAMES:
+            raise AttributeError(name)
+        from flask import current_app, jsonify, request
+        from werkzeug.datastructures import MultiDict
+        self.current_app = current_app
+        self.jsonify = jsonify
+        self.request = request
+        self.MultiDict = MultiDict
+        return getattr(self, name)
 
-class Isalpha(Validator):
-    """字符串里面都是字母，并且至少是一个字母，结果就为真，（汉字也可以）其他情况为假"""
 
-    def __init__(self):
-        self.err_message = "must be all letters"
-        self.not_message = "must not be all letters"
+_flask = _LazyFlask()
 
-    def __call__(self, value):
-        if is_str(value):
-            # if isinstance(value, str) or isinstance(value, unicode):
-            return value.isalpha()
-        else:
-            return False
-
-
-class Isdigit(Validator):
-    """函数判断是否全为数字"""
-
-    def __init__(self):
-        self.err_message = "must be all numbers"
-        self.not_message = "must not be all numbers"
 
-    def __call__(self, value):
-        if is_str(value):
-            return value.isdigit()
-        else:
-            return False
-
-
-class Email(Validator):
-    """Verify that the value is an Email or not.
-    """
-
-    def __init__(self):
-        self.err_message = "Invalid Email"
-        self.not_message = "Invalid Email"
-
-    def __call__(self, value):
+def _load_orjson():
+    global orjson
+    if orjson is False:
         try:
-            if not value or "@" not in value:
-                return False
-            user_part, domain_part = value.rsplit('@', 1)
-            if not (USER_REGEX.match(user_part) and DOMAIN_REGEX.match(domain_part)):
-                return False
-            return True
-        except:
-            return False
-
-
-class Datetime(Validator):
-    """Validate that the value matches the datetime format."""
-
-    DEFAULT_FORMAT = '%Y-%m-%dT%H:%M:%S.%fZ'
-
-    def __init__(self, format=None):
-        self.format = format or self.DEFAULT_FORMAT
-        self.err_message = "Invalid Datetime format"
-        self.not_message = "Invalid Datetime format"
+            import orjson as module
+        except ImportError:
+            module = None
+        orjson = module
+    return orjson
 
-    def __call__(self, v):
-        try:
-            datetime.datetime.strptime(v, self.format)
-        except (TypeError, ValueError):
-            return False
-        return True
 
-    def __repr__(self):
-        return 'Datetime(format=%s)' % self.format
+if sys.version_info >= (3, 7):
+    def __getattr__(name):
+        # validator.request etc. keep working without importing flask up front (PEP 562)
+        if name in _FLASK_NAMES:
+            return getattr(_flask, name)
+        raise AttributeError("module %r has no attribute %r" % (__name__, name))
+else:
+    # no module __getattr__, import them as before
+    from flask import current_app, jsonify, request
+    from werkzeug.datastructures import MultiDict
 
 
-class Date(Validator):
-    """Validate that the value matches the date format."""
+logger = logging.getLogger("validator")
 
-    DEFAULT_FORMAT = '%Y-%m-%d'
 
-    def __init__(self, format=None):
-        self.format = format or self.DEFAULT_FORMAT
-        self.err_message = "Invalid Date format"
-        self.not_message = "Invalid Date format"
+class _ErrorWindow(object):
+    __slots__ = ("start", "logged", "seen", "dropped")
 
-    def __call__(self, v):
+    def __init__(self, start, dropped=0):
+        self.start = start
+        self.logged = 0
+        self.seen = set()
+        # suppressed since the last record of the route
+        self.dropped = dropped
+
+
+class ErrorLog(object):
+    """
+    Logs the exceptions caught by the decorators. Per
+    route at most `burst` records are written every
+    `interval` seconds and an exception with the same
+    signature (type and the line that raised it) only
+    once, the others are counted and the count is
+    added to the next record of the route as
+    `suppressed`. The traceback is only formatted by
+    the handlers, see use_background_logging.
+    """
+
+    def __init__(self, logger, burst=10, interval=60.0):
+        self.logger = logger
+        self.burst = burst
+        self.interval = interval
+        self._windows = {}
+        self._lock = threading.Lock()
+
+    def exception(self, route):
+        """
+        Record the exception being handled, call
+        from an except block.
+        """
+        if not self.logger.isEnabledFor(logging.ERROR):
+            return
+        exc_info = sys.exc_info()
+        tb = exc_info[2]
+        while tb.tb_next is not None:
+            tb = tb.tb_next
+        signature = (exc_info[0], tb.tb_frame.f_code.co_filename, tb.tb_lineno)
+        now = _monotonic()
+        with self._lock:
+            window = self._windows.get(route)
+            if window is None or now - window.start >= self.interval:
+                window = self._windows[route] = _ErrorWindow(now, window.dropped if window else 0)
+            if signature in window.seen or window.logged >= self.burst:
+                window.dropped += 1
+                return
+            window.seen.add(signature)
+            window.logged += 1
+            suppressed, window.dropped = window.dropped, 0
+        self.logger.error("validation of %s raised %s (%d similar suppressed)", route, exc_info[0].__name__,
+                          suppressed, exc_info=exc_info,
+                          extra={"route": route, "error_signature": signature, "suppressed": suppressed})
+
+    def reset(self):
+        with self._lock:
+            self._windows.clear()
+
+
+_monotonic = getattr(time, "monotonic", time.time)
+error_log = ErrorLog(logger)
+
+
+class _DeferredQueueHandler(QueueHandler or object):
+    """
+    QueueHandler that puts the record on the queue
+    as is, the message and the traceback are formatted
+    by the listener thread instead of the request thread.
+    """
+
+    def prepare(self, record):
+        return record
+
+    def enqueue(self, record):
+        # a full queue drops the record instead of blocking the request
         try:
-            datetime.datetime.strptime(v, self.format)
-        except (TypeError, ValueError):
-            return False
-        return True
+            self.queue.put_nowait(record)
+        except queue.Full:
+            pass
 
-    def __repr__(self):
-        return 'Date(format=%s)' % self.format
 
-
-class In(Validator):
+def use_background_logging(*handlers, **kwargs):
     """
-    Use to specify that the
-    value of the key being
-    validated must exist
-    within the collection
-    passed to this validator.
+    Send the records of the "validator" logger through a queue
+    to `handlers` (a StreamHandler by default), which format and
+    write them in a background thread. By default the logger
+    stops propagating to the root logger, whose handlers would
+    format every record in the request thread again; pass
+    propagate=True to keep them.
 
     # Example:
-        validations = {
-            "field": [In([1, 2, 3])]
-        }
-        passes = {"field":1}
-        fails  = {"field":4}
+        listener = use_background_logging(logging.FileHandler("validator.log"))
+        ...
+        listener.stop()
 
+    :param handlers: logging handlers receiving the records
+    :param maxsize: bound of the queue, records are dropped when it is full
+    :param propagate: value of logger.propagate, False by default
+    :return: the started QueueListener
     """
+    if QueueHandler is None:
+        raise RuntimeError("use_background_logging needs Python 3.2+")
+    records = queue.Queue(kwargs.get("maxsize", 10000))
+    handler = _DeferredQueueHandler(records)
+    listener = QueueListener(records, *(handlers or (logging.StreamHandler(),)), respect_handler_level=True)
+    for old in [h for h in logger.handlers if isinstance(h, _DeferredQueueHandler)]:
+        logger.removeHandler(old)
+    logger.addHandler(handler)
+    logger.propagate = kwargs.get("propagate", False)
+    listener.start()
+    return listener
 
-    def __init__(self, collection):
-        self.collection = collection
-        self.err_message = "must be one of %r" % collection
-        self.not_message = "must not be one of %r" % collection
 
-    def __call__(self, value):
-        return (value in self.collection)
+def default_envelope(err):
+    return {"code": 500, "data": None, "err": err}
 
 
-class Not(Validator):
+def default_dumps(obj):
     """
-    Use to negate the requirement
-    of another validator. Does not
-    work with Required.
-
+    orjson when it is installed, json otherwise.
     """
-
-    def __init__(self, validator):
-        self.validator = validator
-        self.err_message = getattr(validator, "not_message", "failed validation")
-        self.not_message = getattr(validator, "err_message", "failed validation")
-
-    def __call__(self, value):
-        return not self.validator(value)
-
-
-class Range(Validator):
-    """
-    Use to specify that the value of the
-    key being validated must fall between
-    the start and end values. By default
-    the range is inclusive, though the
-    range can be made excusive by setting
-    inclusive to false.
-
-    # Example:
-        validations = {
-            "field": [Range(0, 10)]
-        }
-        passes = {"field": 10}
-        fails = {"field" : 11}
-
-    """
-
-    def __init__(self, start, end, reverse=True, auto=True):
-        self.start = start
-        self.end = end
-        self.reverse = reverse
-        self.auto = auto
-        self.err_message = "must fall between %s and %s" % (start, end)
-        self.not_message = "must not fall between %s and %s" % (start, end)
-
-    def __call__(self, value):
-        if self.auto:
-            value = float(value)
-        if self.reverse:
-            return self.start <= value <= self.end
-        else:
-            return self.start < value < self.end
+    if _load_orjson() is not None:
+        return orjson.dumps(obj, option=orjson.OPT_NON_STR_KEYS)
+    return json.dumps(obj, separators=(",", ":"))
 
 
-class GreaterThan(Validator):
+class ErrorResponse(object):
     """
-    Use to specify that the value of the
-    key being validated must be greater
-    than a given value. By default the
-    bound is exclusive, though the bound
-    can be made inclusive by setting
-    inclusive to true.
+    Builds the responses of rejected requests. The body is
+    envelope(err) encoded with dumps, and the encoded bodies
+    are kept in a bounded LRU keyed on the errors, so a bad
+    payload sent again and again is only encoded once.
+    orjson encodes faster than the key is built, so with the
+    default dumps and orjson installed there is no cache
+    unless maxsize is given.
 
     # Example:
-        validations = {
-            "field": [GreaterThan(10)]
-        }
-        passes = {"field": 11}
-        fails = {"field" : 10}
-
-    """
+        rejected = ErrorResponse(status=400, envelope=lambda err: {"error": err})
+
+        @validator(rules, response=rejected)
+        def view():
+            ...
+
+    :param status: HTTP status of the response
+    :param envelope: callable turning the errors into the object to encode
+    :param dumps: callable encoding that object to str or bytes
+    :param maxsize: number of bodies kept, 0 for no cache, None to decide as above
+    """
+
+    content_type = "application/json"
+
+    def __init__(self, status=200, envelope=default_envelope, dumps=default_dumps, maxsize=None):
+        self.status = status
+        self.envelope = envelope
+        self.dumps = dumps
+        self.maxsize = maxsize
+        self._bodies = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __call__(self, err):
+        return _flask.current_app.response_class(self.body(err), self.status, content_type=self.content_type)
+
+    def body(self, err):
+        if self.maxsize is None:
+            # decided on first use, so that importing doesn't import orjson
+            self.maxsize = 0 if self.dumps is default_dumps and _load_orjson() is not None else 1024
+        if not self.maxsize:
+            return self.encode(err)
+        # repr tells 1, 1.0 and True or "a" and ["a"] apart,
+        # and is much cheaper than encoding with json
+        key = repr(err)
+        with self._lock:
+            if key in self._bodies:
+                body = self._bodies[key] = self._bodies.pop(key)
+                return body
+        body = self.encode(err)
+        with self._lock:
+            self._bodies[key] = body
+            if len(self._bodies) > self.maxsize:
+                self._bodies.popitem(last=False)
+        return body
+
+    def encode(self, err):
+        obj = self.envelope(err)
+        try:
+            return self.dumps(obj)
+        except TypeError:
+            # e.g. a custom error object orjson doesn't know
+            return json.dumps(obj, default=str)
 
-    def __init__(self, lower_bound, reverse=False, auto=True):
-        self.lower_bound = lower_bound
-        self.reverse = reverse
-        self.auto = auto
-        self.err_message = "must be greater than %s" % lower_bound
-        self.not_message = "must not be greater than %s" % lower_bound
-
-    def __call__(self, value):
-        if self.auto:
-            value = float(value)
-        if self.reverse:
-            return self.lower_bound <= value
-        else:
-            return self.lower_bound < value
+    def clear(self):
+        with self._lock:
+            self._bodies.clear()
 
 
-class Equals(Validator):
-    """
-    Use to specify that the
-    value of the key being
-    validated must be equal to
-    the value that was passed
-    to this validator.
+error_response = ErrorResponse()
 
-    # Example:
-        validations = {
-            "field": [Equals(1)]
-        }
-        passes = {"field":1}
-        fails  = {"field":4}
 
+class Overlay(object):
     """
-
-    def __init__(self, obj):
-        self.obj = obj
-        self.err_message = "must be equal to %r" % obj
-        self.not_message = "must not be equal to %r" % obj
-
-    def __call__(self, value):
-        return value == self.obj
-
-
-class Blank(Validator):
+    只读合并视图 + 写时复制: 读取时依次查找 changes 和 maps(靠前的优先),
+    写入只落到 changes,原始的 dict/MultiDict 不会被修改,也不需要 deepcopy
     """
-    Use to specify that the
-    value of the key being
-    validated must be equal to
-    the empty string.
-
-    This is a shortcut for saying
-    Equals("").
 
-    # Example:
-        validations = {
-            "field": [Blank()]
-        }
-        passes = {"field":""}
-        fails  = {"field":"four"}
-
-    """
+    def __init__(self, *maps):
+        self.maps = maps
+        self.changes = {}
 
-    def __init__(self):
-        self.err_message = "must be an empty string"
-        self.not_message = "must not be an empty string"
+    def __getitem__(self, key):
+        if key in self.changes:
+            return self.changes[key]
+        for m in self.maps:
+            if key in m:
+                return m[key]
+        raise KeyError(key)
 
-    def __call__(self, value):
-        return value == ""
+    def __setitem__(self, key, value):
+        self.changes[key] = value
 
-
-class Truthy(Validator):
-    """
-    Use to specify that the
-    value of the key being
-    validated must be truthy,
-    i.e. would cause an if statement
-    to evaluate to True.
-
-    # Example:
-        validations = {
-            "field": [Truthy()]
-        }
-        passes = {"field": 1}
-        fails  = {"field": 0}
-
-
-    """
-
-    def __init__(self):
-        self.err_message = "must be True-equivalent value"
-        self.not_message = "must be False-equivalent value"
-
-    def __call__(self, value):
-        if value:
+    def __contains__(self, key):
+        if key in self.changes:
             return True
-        else:
-            return False
-
-
-def Required(field, dictionary):
-    """
-    When added to a list of validations
-    for a dictionary key indicates that
-    the key must be present. This
-    should not be called, just inserted
-    into the list of validations.
-
-    # Example:
-        validations = {
-            "field": [Required, Equals(2)]
-        }
+        for m in self.maps:
+            if key in m:
+                return True
+        return False
 
-    By default, keys are considered
-    optional and their validations
-    will just be ignored if the field
-    is not present in the dictionary
-    in question.
+    def __iter__(self):
+        seen = set()
+        for m in reversed(self.maps):
+            for key in m:
+                if key not in seen:
+                    seen.add(key)
+                    yield key
+        for key in self.changes:
+            if key not in seen:
+                yield key
 
-    """
-
-    return (field in dictionary)
-
-
-class InstanceOf(Validator):
-    """
-    Use to specify that the
-    value of the key being
-    validated must be an instance
-    of the passed in base class
-    or its subclasses.
-
-    # Example:
-        validations = {
-            "field": [InstanceOf(basestring)]
-        }
-        passes = {"field": ""} # is a <'str'>, subclass of basestring
-        fails  = {"field": str} # is a <'type'>
+    def __len__(self):
+        return sum(1 for _ in self)
 
-    """
+    def __bool__(self):
+        return bool(self.changes) or any(self.maps)
 
-    def __init__(self, base_class):
-        self.base_class = base_class
-        self.err_message = "must be an instance of %s or its subclasses" % base_class.__name__
-        self.not_message = "must not be an instance of %s or its subclasses" % base_class.__name__
+    __nonzero__ = __bool__
 
-    def __call__(self, value):
-        return isinstance(value, self.base_class)
-
-
-class SubclassOf(Validator):
-    """
-    Use to specify that the
-    value of the key being
-    validated must be a subclass
-    of the passed in base class.
-
-    # Example:
-        validations = {
-            "field": [SubclassOf(basestring)]
-        }
-        passes = {"field": str} # is a subclass of basestring
-        fails  = {"field": int}
-
-    """
-
-    def __init__(self, base_class):
-        self.base_class = base_class
-        self.err_message = "must be a subclass of %s" % base_class.__name__
-        self.not_message = "must not be a subclass of %s" % base_class.__name__
-
-    def __call__(self, class_):
-        return issubclass(class_, self.base_class)
-
-
-class Pattern(Validator):
-    """
-    Use to specify that the
-    value of the key being
-    validated must match the
-    pattern provided to the
-    validator.
-
-    # Example:
-        validations = {
-            "field": [Pattern('\d\d\%')]
-        }
-        passes = {"field": "30%"}
-        fails  = {"field": "30"}
-
-    """
-
-    def __init__(self, pattern):
-        self.pattern = pattern
-        self.err_message = "must match regex pattern %s" % pattern
-        self.not_message = "must not match regex pattern %s" % pattern
-        self.compiled = re.compile(pattern)
-
-    def __call__(self, value):
-        return self.compiled.match(value)
-
-
-class Then(Validator):
-    """
-    Special validator for use as
-    part of the If rule.
-    If the conditional part of the validation
-    passes, then this is used to apply another
-    set of dependent rules.
-
-    # Example:
-        validations = {
-            "foo": [If(Equals(1), Then({"bar": [Equals(2)]}))]
-        }
-        passes = {"foo": 1, "bar": 2}
-        also_passes = {"foo": 2, "bar": 3}
-        fails = {"foo": 1, "bar": 3}
-    """
-
-    def __init__(self, validation):
-        self.validation = validation
-
-    def __call__(self, dictionary):
-        return validate(self.validation, dictionary)
-
-
-class If(Validator):
-    """
-    Special conditional validator.
-    If the validator passed as the first
-    parameter to this function passes,
-    then a second set of rules will be
-    applied to the dictionary.
-
-    # Example:
-        validations = {
-            "foo": [If(Equals(1), Then({"bar": [Equals(2)]}))]
-        }
-        passes = {"foo": 1, "bar": 2}
-        also_passes = {"foo": 2, "bar": 3}
-        fails = {"foo": 1, "bar": 3}
-    """
-
-    def __init__(self, validator, then_clause):
-        self.validator = validator
-        self.then_clause = then_clause
-
-    def __call__(self, value, dictionary):
-        conditional = False
-        dependent = None
-        if self.validator(value):
-            conditional = True
-            dependent = self.then_clause(dictionary)
-        return conditional, dependent
-
-
-class Length(Validator):
-    """
-    Use to specify that the
-    value of the key being
-    validated must have at least
-    `minimum` elements and optionally
-    at most `maximum` elements.
-
-    At least one of the parameters
-    to this validator must be non-zero,
-    and neither may be negative.
-
-    # Example:
-        validations = {
-            "field": [Length(0, maximum=5)]
-        }
-        passes = {"field": "hello"}
-        fails  = {"field": "hello world"}
-
-    """
-
-    err_messages = {
-        "maximum": "must be at most {0} elements in length",
-        "minimum": "must be at least {0} elements in length",
-        "range": "must{0}be between {1} and {2} elements in length"
-    }
-
-    def __init__(self, minimum, maximum=0):
-        if not minimum and not maximum:
-            raise ValueError("Length must have a non-zero minimum or maximum parameter.")
-        if minimum < 0 or maximum < 0:
-            raise ValueError("Length cannot have negative parameters.")
-
-        self.minimum = minimum
-        self.maximum = maximum
-        if minimum and maximum:
-            self.err_message = self.err_messages["range"].format(' ', minimum, maximum)
-            self.not_message = self.err_messages["range"].format(' not ', minimum, maximum)
-        elif minimum:
-            self.err_message = self.err_messages["minimum"].format(minimum)
-            self.not_message = self.err_messages["maximum"].format(minimum - 1)
-        elif maximum:
-            self.err_message = self.err_messages["maximum"].format(maximum)
-            self.not_message = self.err_messages["minimum"].format(maximum + 1)
-
-    def __call__(self, value):
-        if self.maximum:
-            return self.minimum <= len(value) <= self.maximum
-        else:
-            return self.minimum <= len(value)
-
-
-class Contains(Validator):
-    """
-    Use to ensure that the value of the key
-    being validated contains the value passed
-    into the Contains validator. Works with
-    any type that supports the 'in' syntax.
-
-    # Example:
-        validations = {
-            "field": [Contains(3)]
-        }
-        passes = {"field": [1, 2, 3]}
-        fails  = {"field": [4, 5, 6]}
-
-    """
-
-    def __init__(self, contained):
-        self.contained = contained
-        self.err_message = "must contain {0}".format(contained)
-        self.not_message = "must not contain {0}".format(contained)
-
-    def __call__(self, container):
-        return self.contained in container
-
-
-class Each(Validator):
-    """
-    Use to ensure that
-
-    If Each is passed a list of validators, it
-    just applies each of them to each element in
-    the list.
-
-    If it's instead passed a *dictionary*, it treats
-    it as a validation to be applied to each element in
-    the dictionary.
-
-    """
-
-    def __init__(self, validations):
-        assert isinstance(validations, (list, tuple, set, dict))
-        self.validations = validations
-
-    def __call__(self, container):
-        assert isinstance(container, (list, tuple, set))
-
-        # handle the "apply simple validation to each in list"
-        # use case
-        if isinstance(self.validations, (list, tuple, set)):
-            errors = []
-            for item in container:
-                for v in self.validations:
-                    valid = v(item)
-                    if not valid:
-                        errors.append("all values " + v.err_message)
-
-        # handle the somewhat messier list of dicts case
-        if isinstance(self.validations, dict):
-            errors = defaultdict(list)
-            for index, item in enumerate(container):
-                valid, err = validate(self.validations, item)
-                if not valid:
-                    errors[index] = err
-            errors = dict(errors)
-
-        return (len(errors) == 0, errors)
-
-
-class Url(Validator):
-    """
-    Use to specify that the
-    value of the key being
-    validated must be a Url.
-
-    This is a shortcut for saying
-    Url().
-
-    # Example:
-        validations = {
-            "field": [Url()]
-        }
-        passes = {"field":"http://vk.com"}
-        fails  = {"field":"/1https://vk.com"}
-
-    """
-
-    def __init__(self):
-        self.err_message = "must be a valid URL"
-        self.not_message = "must not be a valid URL"
-
-    def __call__(self, value):
-        try:
-            result = urlparse(value)
-            return all([result.scheme, result.netloc])
-        except:
-            return False
-
-
-def validate(validation, dictionary):
-    """
-    Validate that a dictionary passes a set of
-    key-based validators. If all of the keys
-    in the dictionary are within the parameters
-    specified by the validation mapping, then
-    the validation passes.
-
-    :param validation: a mapping of keys to validators
-    :type validation: dict
-
-    :param dictionary: dictionary to be validated
-    :type dictionary: dict
-
-    :return: a tuple containing a bool indicating
-    success or failure and a mapping of fields
-    to error messages.
-
-    """
-
-    errors = defaultdict(list)
-    for key in validation:
-        if isinstance(validation[key], (list, tuple)):
-            if Required in validation[key]:
-                if not Required(key, dictionary):
-                    errors[key] = "must be present"
-                    continue
-            _validate_list_helper(validation, dictionary, key, errors)
-        else:
-            v = validation[key]
-            if v == Required:
-                if not Required(key, dictionary):
-                    errors[key] = "must be present"
-            else:
-                _validate_and_store_errs(v, dictionary, key, errors)
-    if len(errors) > 0:
-        # `errors` gets downgraded from defaultdict to dict
-        # because it makes for prettier output
-        return ValidationResult(valid=False, errors=dict(errors))
-    else:
-        return ValidationResult(valid=True, errors={})
-
-
-def _validate_and_store_errs(validator, dictionary, key, errors):
-    # Validations shouldn't throw exceptions because of
-    # type mismatches and the like. If the rule is 'Length(5)' and
-    # the value in the field is 5, that should be a validation failure,
-    # not a TypeError because you can't call len() on an int.
-    # It's not ideal to have to hide exceptions like this because
-    # there could be actual problems with a validator, but we're just going
-    # to have to rely on tests preventing broken things.
-    try:
-        valid = validator(dictionary[key])
-    except Exception:
-        # Since we caught an exception while trying to validate,
-        # treat it as a failure and return the normal error message
-        # for that validator.
-        valid = (False, validator.err_message)
-    if isinstance(valid, tuple):
-        valid, errs = valid
-        if errs and isinstance(errs, list):
-            errors[key] += errs
-        elif errs:
-            errors[key].append(errs)
-    elif not valid:
-        # set a default error message for things like lambdas
-        # and other callables that won't have an err_message set.
-        msg = getattr(validator, "err_message", "failed validation")
-        errors[key].append(msg)
-
-
-def _validate_list_helper(validation, dictionary, key, errors):
-    for v in validation[key]:
-        # don't break on optional keys
-        if key in dictionary:
-            # Ok, need to deal with nested
-            # validations.
-            if isinstance(v, dict):
-                _, nested_errors = validate(v, dictionary[key])
-                if nested_errors:
-                    errors[key].append(nested_errors)
-                continue
-            # Done with that, on to the actual
-            # validating bit.
-            # Skip Required, since it was already
-            # handled before this point.
-            if not v == Required:
-                # special handling for the
-                # If(Then()) form
-                if isinstance(v, If):
-                    conditional, dependent = v(dictionary[key], dictionary)
-                    # if the If() condition passed and there were errors
-                    # in the second set of rules, then add them to the
-                    # list of errors for the key with the condtional
-                    # as a nested dictionary of errors.
-                    if conditional and dependent[1]:
-                        errors[key].append(dependent[1])
-                # handling for normal validators
-                else:
-                    _validate_and_store_errs(v, dictionary, key, errors)
+    def get(self, key, default=None):
+        if key in self:
+            return self[key]
+        return default
 
 
 # hook func
-def validator_func(rules, strip=True, default=(False, None), diy_func=None, release=False):
+def validator_func(rules, strip=True, default=(False, None), diy_func=None, release=False, fail_fast=False):
     """针对普通函数的参数校验的装饰器 --- arbitrary argument lists(任意长参数)
     :param rules:参数的校验规则,map
     :param strip:对字段进行前后过滤空格
     :param default:将"" 装换成None
     :param diy_func:自定义的对某一参数的校验函数格式: {key:func},类似check, diy_func={"a": lambda x: x + "aa"})
     :param release:发生参数校验异常后是否依然让参数进入主流程函数
+    :param fail_fast:遇到第一个不符合规则的字段就停止校验,只返回这一个错误
     """
+    if rules:
+        rules = compile_rules(rules)
 
     def decorator(f):
+        plan = binding_plan(f)
+        route = f.__name__
+
         @wraps(f)
         def decorated_func(*args, **kwargs):
-            if release:
-                args_bak = args[:]
-                kwargs_bak = copy.deepcopy(kwargs)  # 下面流程异常时,是否直接使用 原参数传入f # fixme
             try:
-                args_dict, kwargs_dict = arrange_args(args, kwargs, f)
-                # strip
-                if strip:
-                    do_strip(args_dict, modify=True)
-                    do_strip(kwargs_dict, modify=True)
-                do_default(args_dict, default)
-                # diy_func
-                if diy_func:
-                    do_func(args_dict, diy_func, modify=True)
-                    do_func(kwargs_dict, diy_func, modify=True)
+                args_dict, kwargs_dict = _prepare_args(args, kwargs, f, plan, strip, default, diy_func)
                 # rules
                 if rules:
-                    args_dict_bak = copy.deepcopy(args_dict)
-                    args_dict_bak.update(kwargs_dict)
-                    result, err = validate(rules, args_dict_bak)
+                    overlay = Overlay(kwargs_dict, args_dict)
+                    instrument = _core._instrument
+                    if instrument is not None:
+                        result, err = instrument.measure(route, validate, rules, overlay, fail_fast)
+                    else:
+                        result, err = validate(rules, overlay, fail_fast)
                     if not result:
                         return False, err
+                    _apply_args_changes(overlay, args_dict, kwargs_dict)
             except Exception as e:
-                print("validator_arbitrary_args catch err: ", traceback.format_exc())
+                error_log.exception(route)
                 if release:
-                    return f(*args_bak, **kwargs_bak)
+                    # arrange_args 生成的是新的 dict,原始参数没有被修改过
+                    return f(*args, **kwargs)
                 else:
                     return False, str(e)
             return f(*args_dict.values(), **kwargs_dict)
@@ -842,69 +395,119 @@ def validator_func(rules, strip=True, default=(False, None), diy_func=None, rele
     return decorator
 
 
-def validator_sub(rules, strip=True, default=(False, None), diy_func=None, release=False):
+def _prepare_args(args, kwargs, f, plan, strip, default, diy_func):
+    args_dict, kwargs_dict = arrange_args(args, kwargs, f, plan)
+    # strip
+    if strip:
+        do_strip(args_dict, modify=True)
+        do_strip(kwargs_dict, modify=True)
+    do_default(args_dict, default)
+    # diy_func
+    if diy_func:
+        do_func(args_dict, diy_func, modify=True)
+        do_func(kwargs_dict, diy_func, modify=True)
+    return args_dict, kwargs_dict
+
+
+def _apply_args_changes(overlay, args_dict, kwargs_dict):
+    # convert=True 的校验器解析后的值
+    for k in overlay.changes:
+        if k in kwargs_dict:
+            kwargs_dict[k] = overlay.changes[k]
+        else:
+            args_dict[k] = overlay.changes[k]
+
+
+def validator_sub(rules, strip=True, default=(False, None), diy_func=None, release=False, fail_fast=False):
     """返回dict,代替request.values/request.json使用,这个方法比较low ...
     :param rules:参数的校验规则,map
     :param strip:对字段进行前后过滤空格
     :param default:将"" 装换成None
     :param diy_func:自定义的对某一参数的校验函数格式: {key:func},类似check, diy_func={"a": lambda x: x + "aa"})
     :param release:发生参数校验异常后是否依然让参数进入主流程函数
+    :param fail_fast:遇到第一个不符合规则的字段就停止校验,只返回这一个错误
     """
+    request = _flask.request
     args_dict = OrderedDict()
     try:
         if request.values:
             args_dict.update(request.values)
         if request.json:
             args_dict.update(request.json)
-        if release:
-            args_dict_copy = copy.deepcopy(args_dict)  # 下面流程异常时,是否直接使用 原参数传入f # fixme
+        # 修改只写入 overlay,出现异常时 args_dict 还是原始参数
+        overlay = Overlay(args_dict)
         # strip
         if strip:
-            do_strip(args_dict, modify=True)
+            do_strip(overlay, modify=True)
         # default
-        do_default(args_dict, default)
+        do_default(overlay, default)
         # diy_func
         if diy_func:
-            do_func(args_dict, diy_func, modify=True)
+            do_func(overlay, diy_func, modify=True)
         # rules
         if rules:
-            result, err = do_rules(args_dict, rules)
+            instrument = _core._instrument
+            if instrument is not None:
+                result, err = instrument.measure(request.endpoint or "", do_rules, overlay, rules, fail_fast)
+            else:
+                result, err = do_rules(overlay, rules, fail_fast)
             if not result:
                 return False, err
+        args_dict.update(overlay.changes)
     except Exception as e:
-        print("verify_args catch err: ", traceback.format_exc())  # TODO
+        error_log.exception(request.endpoint or "validator_sub")
         if release:
-            return True, args_dict_copy
+            return True, args_dict
         else:
             return False, str(e)
     return True, args_dict
 
 
-def validator(rules, strip=True, modify=True, default=(False, None), diy_func=[], **dict_args):
+def validator(rules, strip=True, modify=True, default=(False, None), diy_func=[], fail_fast=False, response=None,
+              **dict_args):
     """装饰器版 - 检测是否符合规则,并修改参数
-    werkzeug.datastructures.ImmutableDict是最快的且不可变的
-    werkzeug.wrappers.BaseRequest中对parameter_storage_class的说明中说可使用可变结构(但不建议这样做),这里我们就
-    变更参数的存储方式为MultiDict,进一步实现对参数的校验以及修改,主要是默认值,参数校验,参数规范化操作
+    werkzeug.datastructures.ImmutableDict是最快的且不可变的,所以这里不再变更parameter_storage_class,
+    args/form 先以只读的方式校验,只有真的需要修改(strip/diy_func/default)时才复制成 MultiDict 替换回 request
+    读取哪些数据来源只由 json/args/form/values 决定; strip 和 default 的结果视图函数也会读到,所以它们作用于来源中的所有key,
+    只有 strip=False 且没有开启 default 时才只逐个处理 diy_func 里的key
     :param rules:参数的校验规则,map
     :param strip:对字段进行前后空格检测
     :param dict_args:检测范围,默认 json=False,args=Ture,form=False,values=False(values包括了args和form)
     :param modify:对字段进行检测并修改,不再返回错误提示
     :param default:将"" 装换成None
     :param diy_func:自定义的对某一参数的校验函数格式: {key:func},类似check, diy_func={"a": lambda x: x=="aa"})
+    :param fail_fast:遇到第一个不符合规则的字段就停止校验,只返回这一个错误
+    :param response:校验失败时返回的响应,ErrorResponse,默认是全局的 error_response
     """
+    if rules:
+        rules = compile_rules(rules)
+    # 装饰时就确定要读取哪些数据来源,以及需要逐个处理的key
+    sources = request_sources(dict_args)
+    if not (rules or strip or diy_func or default[0]):
+        sources = ()
+    # strip/default 改写的是视图函数读到的参数,不只是 rules 用到的key,所以要处理所有key;
+    # 否则只有 diy_func 里的key需要逐个处理
+    keys = None if strip or default[0] else tuple(diy_func)
 
     def decorator(f):
+        route = f.__name__
+
         @wraps(f)
         def decorated_func(*args, **kwargs):
-            # print("form:", request.form)  # 不可事先调用,不然会被缓存.........
-            request.parameter_storage_class = MultiDict  # 设置为可修改
+            if not sources:
+                return f(*args, **kwargs)
             try:
-                result, err = limits(dict_args, strip, modify, default, diy_func, rules)
+                instrument = _core._instrument
+                if instrument is not None:
+                    result, err = instrument.measure(route, limits, sources, strip, modify, default, diy_func, rules,
+                                                     fail_fast, keys)
+                else:
+                    result, err = limits(sources, strip, modify, default, diy_func, rules, fail_fast, keys)
                 if not result:
-                    return jsonify({"code": 500, "data": None, "err": err})
+                    return (response or error_response)(err)
             except Exception as e:
-                print("verify_args catch err: ", traceback.format_exc())
-                return jsonify({"code": 500, "data": None, "err": str(e)})
+                error_log.exception(route)
+                return (response or error_response)(str(e))
             return f(*args, **kwargs)
 
         return decorated_func
@@ -912,37 +515,138 @@ def validator(rules, strip=True, modify=True, default=(False, None), diy_func=[]
     return decorator
 
 
-def limits(dict_args, strip, modify, default, diy_func, rules):
+def validator_stream(rules, arg="items", chunk_size=65536, fail_fast=False, response=None):
+    """装饰器版 - 流式读取request.stream中的JSON数组,边解析边逐个元素校验,不会把整个body读进内存
+    被装饰的函数通过关键字参数 arg 拿到已校验元素的生成器,遇到不符合规则的元素时返回错误json
+    注意: 需要在函数内消费完生成器,不要直接把它作为流式响应返回
+    :param rules:数组中每个元素的校验规则,map 或 Each
+    :param arg:传给被装饰函数的关键字参数名
+    :param chunk_size:每次从request.stream读取的字节数
+    :param fail_fast:遇到第一个不符合规则的字段就停止校验,只返回这一个错误
+    :param response:校验失败时返回的响应,ErrorResponse,默认是全局的 error_response
+    """
+    if not isinstance(rules, Each):
+        rules = Each(rules, fail_fast=fail_fast)
+
+    def decorator(f):
+        @wraps(f)
+        def decorated_func(*args, **kwargs):
+            kwargs[arg] = _stream_items(rules, _flask.request.stream, chunk_size)
+            try:
+                return f(*args, **kwargs)
+            except StreamValidationError as e:
+                return (response or error_response)({e.index: e.errors})
+
+        return decorated_func
+
+    return decorator
+
+
+def _stream_items(each, stream, chunk_size):
+    index = 0
+    items = each.iter_valid(iter_json_array(stream, chunk_size))
+    try:
+        for item in items:
+            yield item
+            index += 1
+    except StreamValidationError:
+        raise
+    except ValueError as e:
+        # 不合法的json也当作校验失败
+        raise StreamValidationError(index, str(e))
+
+
+def request_sources(dict_args):
+    """
+    根据 json/args/form/values 的配置得到需要校验的数据来源
+    :param dict_args:
+    :return: ("json", "args", "form") 的子集,按校验顺序排列
+    """
+    sources = []
     if dict_args.get("json", False):
-        result, err = check(request.json, strip, modify, default, diy_func, rules)
-        if not result:
-            return result, err
+        sources.append("json")
     if dict_args.get("args", True) or dict_args.get("values", False):
-        result, err = check(request.args, strip, modify, default, diy_func, rules)
-        if not result:
-            return result, err
+        sources.append("args")
     if dict_args.get("form", False) or dict_args.get("values", False):
-        result, err = check(request.form, strip, modify, default, diy_func, rules)
+        sources.append("form")
+    return tuple(sources)
+
+
+def limits(sources, strip, modify, default, diy_func, rules, fail_fast=False, keys=None):
+    req = _flask.request._get_current_object()
+    for source in sources:
+        if source == "json":
+            # request.json 本身就是可修改的dict
+            result, err = check(req.json, strip, modify, default, diy_func, rules, fail_fast, keys)
+        else:
+            data = getattr(req, source)
+            overlay = Overlay(data)
+            result, err = check(overlay, strip, modify, default, diy_func, rules, fail_fast, keys)
+            _replace_source(req, source, data, overlay)
         if not result:
             return result, err
     return True, None
 
 
-def check(data, strip, modify, default, diy_func, rules):
-    if strip:
-        result, err = do_strip(data, modify=modify)
-        if not result:
-            return result, err
-    if diy_func:
-        do_func(data, diy_func, modify=modify)
+def _replace_source(req, source, data, overlay):
+    if overlay.changes:
+        # 有修改时才复制成可修改的MultiDict,并让request.values重新合并
+        data = _flask.MultiDict(data)
+        for k in overlay.changes:
+            data[k] = overlay.changes[k]
+        setattr(req, source, data)
+        req.__dict__.pop("values", None)
+
+
+def check(data, strip, modify, default, diy_func, rules, fail_fast=False, keys=None):
+    """
+    strip/diy_func/default 合并成对 data 的一次遍历,效果和依次调用
+    do_strip -> do_func -> do_rules -> do_default 一致: default 仍然在 rules 之后才写入
+    :param keys:只处理这些key,None表示处理所有key
+    :return: (result, err)
+    """
+    result, empties = _normalize(data, strip, modify, default, diy_func, keys)
+    if not result:
+        return result, empties
     if rules:
-        result, err = do_rules(data, rules)
+        result, err = do_rules(data, rules, fail_fast)
         if not result:
             return result, err
-    do_default(data, default)
+    for k in empties:
+        data[k] = default[1]
     return True, None
 
 
+def _normalize(data, strip, modify, default, diy_func, keys=None):
+    """
+    check 中对每个key的一次遍历: strip + diy_func, 并记下需要写入 default 的key
+    :return: (False, err) 或者 (True, empties)
+    """
+    if keys is not None:
+        keys = [k for k in keys if k in data]
+    empties = []
+    for k in (data if keys is None else keys):
+        value = data[k]
+        changed = False
+        # strip
+        if strip and value and is_str(value):
+            if value[0] == " " or value[-1] == " ":
+                if not modify:
+                    return False, "%s should not contain spaces" % k
+                value = value.strip()
+                changed = True
+        # diy_func
+        if diy_func and modify and k in diy_func:
+            value = diy_func[k](value)
+            changed = True
+        if changed:
+            data[k] = value
+        # default 只记录下来,等 rules 校验通过后再写入
+        if default[0] and value == "":
+            empties.append(k)
+    return True, empties
+
+
 def do_default(args_dict, default):
     """
     入参时写入到数据库不好看,转换成None
@@ -956,16 +660,17 @@ def do_default(args_dict, default):
                 args_dict[x] = default[1]
 
 
-def do_rules(args_dict, rules):
+def do_rules(args_dict, rules, fail_fast=False):
     """
     参数校验的核心
     :param args_dict:
     :param rules:
+    :param fail_fast:
     :return:
     """
     if not args_dict:
         return True, None
-    result, err = validate(rules, args_dict)
+    result, err = validate(rules, args_dict, fail_fast)
     return result, err
 
 
@@ -1005,28 +710,60 @@ def do_strip(args_dict, modify=True):
     return True, None
 
 
-def arrange_args(args, kwargs, f):
+_NO_DEFAULT = object()
+
+
+def binding_plan(f):
+    """
+    只解析一次函数签名,得到位置参数名/对齐后的默认值/可变长参数名
+    :param f: 函数
+    :return: _BindingPlan
+    """
+    if signature is None:
+        spec = getargspec(f)
+        names = tuple(spec.args)
+        defaults = tuple(spec.defaults or ())
+        defaults = (_NO_DEFAULT,) * (len(names) - len(defaults)) + defaults
+        return _BindingPlan(names, defaults, spec.varargs)
+    names = []
+    defaults = []
+    varargs = None
+    for param in signature(f).parameters.values():
+        if param.kind in (Parameter.POSITIONAL_ONLY, Parameter.POSITIONAL_OR_KEYWORD):
+            names.append(param.name)
+            defaults.append(_NO_DEFAULT if param.default is Parameter.empty else param.default)
+        elif param.kind == Parameter.VAR_POSITIONAL:
+            varargs = param.name
+    return _BindingPlan(tuple(names), tuple(defaults), varargs)
+
+
+def arrange_args(args, kwargs, f, plan=None):
     """
     参数规整
     :param args: 位置和可变长参数
     :param kwargs: 字典参数
     :param f: 函数
+    :param plan: binding_plan(f)的结果,不传则每次调用都重新解析签名
     :return: 解析后的位置参数和字典参数
     """
-    args_dict = OrderedDict()
-    kwargs_dict = OrderedDict()
-    args_template = getargspec(f)
-    kwargs_dict.update(kwargs)
+    if plan is None:
+        plan = binding_plan(f)
+    names, defaults, varargs = plan
+    kwargs_dict = OrderedDict(kwargs)
+    args_dict = OrderedDict(zip(names, args))
     # 多退少补
-    index_of_defaults = 0
-    index_of_args = 0
-    for i, k in enumerate(args_template.args):
-        try:
-            args_dict[k] = args[i]
-        except IndexError as e:
-            args_dict[k] = args_template.defaults[index_of_defaults]
-            index_of_defaults += 1
-        index_of_args += 1
-    if args_template.varargs:
-        args_dict[args_template.varargs] = args[index_of_args:]
+    if len(args) < len(names):
+        for k, value in zip(names[len(args):], defaults[len(args):]):
+            if k in kwargs_dict:
+                value = kwargs_dict.pop(k)
+            elif value is _NO_DEFAULT:
+                raise TypeError("%s() missing required argument: %r" % (f.__name__, k))
+            args_dict[k] = value
+    if varargs:
+        args_dict[varargs] = args[len(names):]
     return args_dict, kwargs_dict
+
+
+# `from validator import *` also gives request/jsonify as before,
+# flask is only imported at that point
+__all__ = [name for name in globals() if not name.startswith("_")] + list(_FLASK_NAMES)
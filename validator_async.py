@@ -0,0 +1,340 @@
+# -*- coding:utf-8 -*-
+"""
+validator_async.py
+asyncio support for validator.py: validators that return
+awaitables (e.g. "username not taken" checks against a
+cache or a database) are run concurrently instead of one
+after another.
+
+Needs Python 3.5+, validator.py itself keeps working on
+Python 2 without this module.
+
+"""
+__doc__ = "异步入参校验"
+
+import asyncio
+import inspect
+from functools import wraps
+from collections import defaultdict
+
+from validator_core import (
+    Each, Then, ValidationResult, compile_rules, _plan_for, _validate_and_store_errs, _run_each, _run_nested,
+    _run_if,
+)
+from validator import (
+    Overlay, binding_plan, request_sources, error_log, error_response,
+    _flask, _normalize, _replace_source, _prepare_args, _apply_args_changes,
+)
+
+
+def validate_async(validation, dictionary, fail_fast=False, concurrency=None, timeout=None):
+    """
+    Coroutine version of validate. Validators may be
+    plain callables or return awaitables, e.g. async
+    functions or objects with an async __call__.
+
+    The fields of the mapping, the items of Each and
+    the awaitables they produce all run together with
+    asyncio.gather. Steps of one field still run in
+    order, so a convert=True validator is parsed before
+    the validators after it see the value. The errors
+    are the ones validate gives, in the same order.
+
+    An exception raised by an awaitable validator, or
+    one that runs longer than `timeout` seconds, fails
+    it with its err_message. Not and Memoized only work
+    with plain validators.
+
+    # Example:
+        async def username_free(value):
+            return not await db.user_exists(value)
+
+        validations = {
+            "username": [Required, Length(3, 20), username_free]
+        }
+        result = await validate_async(validations, data, concurrency=10, timeout=0.5)
+
+    :param validation: a mapping of keys to validators,
+    or a plan returned by compile_rules
+    :type validation: dict
+
+    :param dictionary: dictionary to be validated
+    :type dictionary: dict
+
+    :param fail_fast: check the fields one after another
+    and stop at the first failing one
+    :type fail_fast: bool
+
+    :param concurrency: maximum number of awaitable
+    validators running at the same time, None for no limit
+    :type concurrency: int
+
+    :param timeout: seconds each awaitable validator may
+    take, None for no limit
+    :type timeout: float
+
+    :return: a ValidationResult
+
+    """
+
+    return _AsyncRun(concurrency, timeout).validate(_plan_for(validation), dictionary, fail_fast)
+
+
+class _AsyncRun(object):
+    """
+    Walks the steps of a compiled plan, awaiting the
+    results of async validators. One instance is used
+    per validate_async call, its semaphore has to be
+    created inside the running event loop.
+    """
+
+    def __init__(self, concurrency=None, timeout=None):
+        self.semaphore = asyncio.Semaphore(concurrency) if concurrency else None
+        self.timeout = timeout
+
+    async def validate(self, plan, dictionary, fail_fast=False):
+        errors = await self.collect(plan, dictionary, fail_fast)
+        if errors:
+            return ValidationResult(valid=False, errors=errors)
+        return ValidationResult(valid=True, errors={})
+
+    async def collect(self, plan, dictionary, fail_fast=False):
+        if fail_fast:
+            errors = defaultdict(list)
+            for field in plan.fields:
+                await self.field(field, dictionary, errors, fail_fast)
+                if errors:
+                    break
+            return dict(errors)
+        # each field collects into its own mapping, merged
+        # in plan order so the output doesn't depend on
+        # which awaitable finished first
+        results = await asyncio.gather(*[self.field_errors(field, dictionary) for field in plan.fields])
+        errors = {}
+        for field_errors in results:
+            errors.update(field_errors)
+        return errors
+
+    async def field_errors(self, field, dictionary):
+        errors = defaultdict(list)
+        await self.field(field, dictionary, errors)
+        return errors
+
+    async def field(self, field, dictionary, errors, fail_fast=False):
+        key, required, guarded, steps = field
+        if guarded and key not in dictionary:
+            if required:
+                errors[key] = "must be present"
+            return
+        for run, v in steps:
+            if run is _validate_and_store_errs or run is _run_each:
+                await self.call(v, dictionary, key, errors, fail_fast)
+            elif run is _run_nested:
+                nested_errors = await self.collect(v, dictionary[key], fail_fast)
+                if nested_errors:
+                    errors[key].append(nested_errors)
+            elif run is _run_if and isinstance(v.then_clause, Then):
+                await self.run_if(v, dictionary, key, errors, fail_fast)
+            # a value that couldn't be converted isn't
+            # checked any further
+            elif run(v, dictionary, key, errors, fail_fast) is False:
+                break
+            if fail_fast and errors:
+                break
+
+    async def call(self, validator, dictionary, key, errors, fail_fast=False):
+        # same rules as _validate_and_store_errs, exceptions
+        # and timeouts count as a failed validation
+        try:
+            if isinstance(validator, Each):
+                valid = await self.each(validator, dictionary[key], fail_fast)
+            else:
+                valid = await self.result(validator(dictionary[key]))
+        except Exception:
+            valid = (False, getattr(validator, "err_message", "failed validation"))
+        if isinstance(valid, tuple):
+            valid, errs = valid
+            if errs and isinstance(errs, list):
+                errors[key] += errs
+            elif errs:
+                errors[key].append(errs)
+        elif not valid:
+            errors[key].append(getattr(validator, "err_message", "failed validation"))
+
+    async def run_if(self, validator, dictionary, key, errors, fail_fast=False):
+        conditional = await self.result(validator.validator(dictionary[key]))
+        if conditional:
+            dependent = await self.collect(validator.then_clause.compiled, dictionary, fail_fast)
+            if dependent:
+                errors[key].append(dependent)
+
+    async def each(self, each, container, fail_fast=False):
+        if not isinstance(container, (list, tuple, set)):
+            return False, each.err_message
+        fail_fast = fail_fast or each.fail_fast
+        if isinstance(each.validations, dict):
+            if fail_fast:
+                for index, item in enumerate(container):
+                    item_errors = await self.collect(each.compiled, item, True)
+                    if item_errors:
+                        return False, {index: item_errors}
+                return True, {}
+            results = await asyncio.gather(*[self.collect(each.compiled, item) for item in container])
+            errors = dict((index, item_errors) for index, item_errors in enumerate(results) if item_errors)
+            return len(errors) == 0, errors
+        if fail_fast:
+            for item in container:
+                item_errors = await self.item(each.validations, item, True)
+                if item_errors:
+                    return False, item_errors
+            return True, []
+        results = await asyncio.gather(*[self.item(each.validations, item) for item in container])
+        errors = [message for item_errors in results for message in item_errors]
+        return len(errors) == 0, errors
+
+    async def item(self, validations, item, fail_fast=False):
+        # an exception fails the whole Each with its
+        # err_message in call, like _run_each does
+        errors = []
+        for v in validations:
+            valid = await self.result(v(item))
+            if not valid:
+                errors.append("all values " + v.err_message)
+                if fail_fast:
+                    break
+        return errors
+
+    async def result(self, valid):
+        if not inspect.isawaitable(valid):
+            return valid
+        if self.timeout is not None:
+            # wait_for only starts the clock once awaited,
+            # time spent waiting for the semaphore isn't counted
+            valid = asyncio.wait_for(valid, self.timeout)
+        if self.semaphore is None:
+            return await valid
+        async with self.semaphore:
+            return await valid
+
+
+def validator_async(rules, strip=True, modify=True, default=(False, None), diy_func=[], fail_fast=False,
+                    concurrency=None, timeout=None, response=None, **dict_args):
+    """装饰器版 - 用于 async def 的flask视图函数(flask>=2.0, pip install flask[async]),rules 中可以使用异步校验器
+    其余行为和 validator 一致
+    :param rules:参数的校验规则,map
+    :param strip:对字段进行前后空格检测
+    :param dict_args:检测范围,默认 json=False,args=Ture,form=False,values=False(values包括了args和form)
+    :param modify:对字段进行检测并修改,不再返回错误提示
+    :param default:将"" 装换成None
+    :param diy_func:自定义的对某一参数的校验函数格式: {key:func},类似check, diy_func={"a": lambda x: x=="aa"})
+    :param fail_fast:遇到第一个不符合规则的字段就停止校验,只返回这一个错误
+    :param concurrency:同时运行的异步校验器的最大数量,None表示不限制
+    :param timeout:每个异步校验器的超时时间(秒),超时按校验失败处理
+    :param response:校验失败时返回的响应,ErrorResponse,默认是全局的 error_response
+    """
+    if rules:
+        rules = compile_rules(rules)
+    sources = request_sources(dict_args)
+    if not (rules or strip or diy_func or default[0]):
+        sources = ()
+    keys = None if strip or default[0] else tuple(diy_func)
+
+    def decorator(f):
+        route = f.__name__
+
+        @wraps(f)
+        async def decorated_func(*args, **kwargs):
+            if not sources:
+                return await f(*args, **kwargs)
+            try:
+                result, err = await limits_async(sources, strip, modify, default, diy_func, rules, fail_fast, keys,
+                                                 concurrency, timeout)
+                if not result:
+                    return (response or error_response)(err)
+            except Exception as e:
+                error_log.exception(route)
+                return (response or error_response)(str(e))
+            return await f(*args, **kwargs)
+
+        return decorated_func
+
+    return decorator
+
+
+def validator_func_async(rules, strip=True, default=(False, None), diy_func=None, release=False, fail_fast=False,
+                         concurrency=None, timeout=None):
+    """针对 async def 函数的参数校验的装饰器,rules 中可以使用异步校验器,其余行为和 validator_func 一致
+    :param rules:参数的校验规则,map
+    :param strip:对字段进行前后过滤空格
+    :param default:将"" 装换成None
+    :param diy_func:自定义的对某一参数的校验函数格式: {key:func},类似check, diy_func={"a": lambda x: x + "aa"})
+    :param release:发生参数校验异常后是否依然让参数进入主流程函数
+    :param fail_fast:遇到第一个不符合规则的字段就停止校验,只返回这一个错误
+    :param concurrency:同时运行的异步校验器的最大数量,None表示不限制
+    :param timeout:每个异步校验器的超时时间(秒),超时按校验失败处理
+    """
+    if rules:
+        rules = compile_rules(rules)
+
+    def decorator(f):
+        plan = binding_plan(f)
+        route = f.__name__
+
+        @wraps(f)
+        async def decorated_func(*args, **kwargs):
+            try:
+                args_dict, kwargs_dict = _prepare_args(args, kwargs, f, plan, strip, default, diy_func)
+                # rules
+                if rules:
+                    overlay = Overlay(kwargs_dict, args_dict)
+                    result, err = await validate_async(rules, overlay, fail_fast, concurrency, timeout)
+                    if not result:
+                        return False, err
+                    _apply_args_changes(overlay, args_dict, kwargs_dict)
+            except Exception as e:
+                error_log.exception(route)
+                if release:
+                    return await f(*args, **kwargs)
+                else:
+                    return False, str(e)
+            return await f(*args_dict.values(), **kwargs_dict)
+
+        return decorated_func
+
+    return decorator
+
+
+async def limits_async(sources, strip, modify, default, diy_func, rules, fail_fast=False, keys=None,
+                       concurrency=None, timeout=None):
+    req = _flask.request._get_current_object()
+    for source in sources:
+        if source == "json":
+            result, err = await check_async(req.json, strip, modify, default, diy_func, rules, fail_fast, keys,
+                                            concurrency, timeout)
+        else:
+            data = getattr(req, source)
+            overlay = Overlay(data)
+            result, err = await check_async(overlay, strip, modify, default, diy_func, rules, fail_fast, keys,
+                                            concurrency, timeout)
+            _replace_source(req, source, data, overlay)
+        if not result:
+            return result, err
+    return True, None
+
+
+async def check_async(data, strip, modify, default, diy_func, rules, fail_fast=False, keys=None,
+                      concurrency=None, timeout=None):
+    """
+    check 的异步版本, rules 用 validate_async 校验
+    :return: (result, err)
+    """
+    result, empties = _normalize(data, strip, modify, default, diy_func, keys)
+    if not result:
+        return result, empties
+    if rules and data:
+        result, err = await validate_async(rules, data, fail_fast, concurrency, timeout)
+        if not result:
+            return result, err
+    for k in empties:
+        data[k] = default[1]
+    return True, None
@@ -0,0 +1,2895 @@
+# -*- coding:utf-8 -*-
+# The MIT License (MIT)
+# Copyright (c) 2014 Samuel Lucidi
+"""
+validator_core.py
+A library for validating that dictionary
+values fit inside of certain sets of parameters.
+Author: Samuel Lucidi <sam@samlucidi.com>
+url: https://github.com/mansam/validator.py
+
+The validators and the validation engine only, no
+Flask: importing this module needs nothing outside
+the standard library, so workers, CLIs and other
+frameworks can use validate() without paying for
+flask and werkzeug. validator.py re-exports all of it.
+
+"""
+__doc__ = "校验器和校验引擎, 不依赖flask"
+
+import re
+import json
+import time
+import random
+import codecs
+import datetime
+import itertools
+import threading
+import weakref
+from bisect import bisect_left, bisect_right
+from collections import namedtuple, defaultdict, OrderedDict
+from abc import ABCMeta, abstractmethod
+
+try:
+    # python 3
+    from urllib.parse import urlparse
+except ImportError:
+    from urlparse import urlparse
+
+try:
+    # python 2
+    _OWN_CONTAINS = (set, frozenset, dict, xrange, basestring)
+except NameError:
+    _OWN_CONTAINS = (set, frozenset, dict, range, str, bytes)
+
+# optional, used by Each for large homogeneous lists;
+# False until _load_numpy has tried to import it
+numpy = False
+
+
+def _load_numpy():
+    """
+    Import numpy on first use, it takes longer to
+    import than everything else here together.
+    """
+    global numpy
+    if numpy is False:
+        try:
+            import numpy as module
+        except ImportError:
+            module = None
+        numpy = module
+    return numpy
+
+ValidationResult = namedtuple('ValidationResult', ['valid', 'errors'])
+# Taken from https://github.com/kvesteri/validators/blob/master/validators/email.py
+USER_REGEX = re.compile(
+    # dot-atom
+    r"(^[-!#$%&'*+/=?^_`{}|~0-9A-Z]+"
+    r"(\.[-!#$%&'*+/=?^_`{}|~0-9A-Z]+)*$"
+    # quoted-string
+    r'|^"([\001-\010\013\014\016-\037!#-\[\]-\177]|'
+    r"""\\[\001-\011\013\014\016-\177])*"$)""",
+    re.IGNORECASE
+)
+DOMAIN_REGEX = re.compile(
+    # domain
+    r'(?:[A-Z0-9](?:[A-Z0-9-]{0,61}[A-Z0-9])?\.)+'
+    r'(?:[A-Z]{2,6}\.?|[A-Z0-9-]{2,}\.?$)'
+    # literal form, ipv4 address (SMTP 4.1.3)
+    r'|^\[(25[0-5]|2[0-4]\d|[0-1]?\d?\d)'
+    r'(\.(25[0-5]|2[0-4]\d|[0-1]?\d?\d)){3}\]$',
+    re.IGNORECASE)
+
+
+def is_str(s):
+    """
+    Python 2/3 compatible check to see
+    if an object is a string type.
+    """
+
+    try:
+        return isinstance(s, str)
+    except NameError:
+        return isinstance(s, basestring)
+
+
+# def ChangeType(instance, new_type):
+#     try:
+#         instance = new_type(instance)
+#         return instance
+#     except Exception as e:
+#         return False
+
+
+class Validator(object):
+    """
+    Abstract class that advanced
+    validators can inherit from in order
+    to set custom error messages and such.
+
+    """
+
+    __metaclass__ = ABCMeta
+    # subclasses without __slots__ still get a __dict__
+    __slots__ = ()
+
+    err_message = "failed validation"
+    not_message = "failed validation"
+    # set to True on validators whose result only depends on
+    # the value and is worth caching, see memoize_rules
+    pure = False
+    # validators can define batch_call(values) to check
+    # many values with one lookup, see BatchValidator
+    batch_call = None
+
+    @abstractmethod
+    def __call__(self, *args, **kwargs):
+        raise NotImplementedError
+
+
+class lazy_message(object):
+    """
+    Decorator for err_message/not_message methods.
+    The message is only rendered when it is first
+    read, usually for a failing value, and kept in
+    the slot named "_" + name (or the __dict__ of
+    classes without slots), which is also where an
+    assigned or err_message= message is kept.
+    """
+
+    def __init__(self, render):
+        self.render = render
+        self.__name__ = render.__name__
+        self.slot = "_" + render.__name__
+
+    def __get__(self, instance, owner):
+        if instance is None:
+            return self
+        try:
+            return getattr(instance, self.slot)
+        except AttributeError:
+            message = self.render(instance)
+            # bypasses the frozen check of shared validators,
+            # the message only depends on their arguments
+            object.__setattr__(instance, self.slot, message)
+            return message
+
+    def __set__(self, instance, value):
+        object.__setattr__(instance, self.slot, value)
+
+
+class fixed_message(lazy_message):
+    """
+    A constant err_message/not_message of a shared
+    validator, which SharedValidator subclasses get in
+    place of a plain string class attribute so a
+    custom message can be kept in the slot.
+    """
+
+    def __init__(self, name, text):
+        self.__name__ = name
+        self.slot = "_" + name
+        self.text = text
+
+    def __get__(self, instance, owner):
+        if instance is None:
+            return self.text
+        try:
+            return getattr(instance, self.slot)
+        except AttributeError:
+            return self.text
+
+
+def _intern_key(value):
+    # 1, 1.0 and True are equal but give different
+    # messages, so the types are part of the key
+    kind = type(value)
+    if kind is tuple or kind is frozenset:
+        return kind, kind(map(_intern_key, value))
+    return kind, value
+
+
+def _arg_key(value):
+    # lists and sets given as arguments are compared by
+    # content, the shared instance gets its own copy
+    kind = type(value)
+    if kind is list:
+        return kind, tuple(map(_intern_key, value))
+    if kind is set:
+        return kind, frozenset(map(_intern_key, value))
+    if kind is tuple or kind is frozenset:
+        return kind, kind(map(_intern_key, value))
+    return kind, value
+
+
+def _arg_copy(value):
+    kind = type(value)
+    if kind is list or kind is set:
+        return kind(value)
+    return value
+
+
+class ValidatorRegistry(object):
+    """
+    Flyweight registry of the built-in validators.
+    Building a registered class with arguments that
+    can be hashed (lists and sets are compared by
+    content) returns the one instance made for those
+    arguments, so Length(0, maximum=5) written in a
+    thousand rule sets is a single object. Instances
+    are frozen and held weakly, they go away with the
+    last rule set using them. Other arguments, like a
+    dict or a list of dicts, get a new instance.
+
+    Arguments are compared as given: Length(0, 5) and
+    Length(0, maximum=5) are two instances.
+
+    Shared instances can't be modified, a custom
+    message is passed when building the validator
+    instead and is part of what is compared. With
+    enabled = False, and for arguments that can't be
+    shared, every call builds a new instance that can
+    be modified as before.
+
+    # Example:
+        assert Length(0, maximum=5) is Length(0, maximum=5)
+        Length(1, 5, err_message="must be 1 to 5 letters")
+
+        @validator_registry.register
+        class Even(SharedValidator):
+            err_message = "must be even"
+
+            def __call__(self, value):
+                return value % 2 == 0
+
+    """
+
+    def __init__(self):
+        self.classes = set()
+        # False builds a new instance every time
+        self.enabled = True
+        self._instances = weakref.WeakValueDictionary()
+        self._lock = threading.Lock()
+
+    def register(self, cls):
+        """
+        Share the instances of cls, a SharedValidator
+        subclass. Its subclasses are not shared unless
+        they are registered too.
+        """
+        self.classes.add(cls)
+        return cls
+
+    def get(self, cls, args, kwargs):
+        if not self.enabled:
+            return _construct(cls, args, kwargs)
+        key = (cls,) + tuple(map(_arg_key, args))
+        if kwargs:
+            key += tuple((name, _arg_key(kwargs[name])) for name in sorted(kwargs))
+        try:
+            # no lock needed to read, the GIL keeps the dict consistent
+            instance = self._instances.get(key)
+        except TypeError:
+            # unhashable arguments, the instance isn't shared
+            return _construct(cls, args, kwargs)
+        if instance is not None:
+            return instance
+        if kwargs:
+            kwargs = dict((name, _arg_copy(value)) for name, value in kwargs.items())
+        instance = self.build(cls, tuple(map(_arg_copy, args)), kwargs)
+        with self._lock:
+            # another thread may have built it meanwhile
+            return self._instances.setdefault(key, instance)
+
+    def build(self, cls, args, kwargs):
+        instance = _construct(cls, args, kwargs)
+        object.__setattr__(instance, "_frozen", True)
+        return instance
+
+    def clear(self):
+        with self._lock:
+            self._instances.clear()
+
+    def __len__(self):
+        return len(self._instances)
+
+
+validator_registry = ValidatorRegistry()
+
+
+_MESSAGES = ("err_message", "not_message")
+
+
+def _construct(cls, args, kwargs):
+    # type.__call__, with _frozen set before __init__ so
+    # SharedValidator.__setattr__ can read it as a slot.
+    # err_message/not_message are set after __init__.
+    messages = ()
+    if "err_message" in kwargs or "not_message" in kwargs:
+        kwargs = dict(kwargs)
+        messages = [(name, kwargs.pop(name)) for name in _MESSAGES if name in kwargs]
+    instance = cls.__new__(cls, *args, **kwargs)
+    object.__setattr__(instance, "_frozen", False)
+    if isinstance(instance, cls):
+        instance.__init__(*args, **kwargs)
+        for name, message in messages:
+            setattr(instance, name, message)
+    return instance
+
+
+class _SharedMeta(type(Validator)):
+    """
+    Routes the construction of registered classes
+    through validator_registry.
+    """
+
+    def __new__(meta, name, bases, namespace):
+        for message in _MESSAGES:
+            if is_str(namespace.get(message)):
+                namespace[message] = fixed_message(message, namespace[message])
+        return super(_SharedMeta, meta).__new__(meta, name, bases, namespace)
+
+    def __call__(cls, *args, **kwargs):
+        if cls in validator_registry.classes:
+            return validator_registry.get(cls, args, kwargs)
+        return _construct(cls, args, kwargs)
+
+
+class SharedValidator(_SharedMeta("_SharedBase", (Validator,), {"__slots__": ()})):
+    """
+    Base of the validators configured only by their
+    arguments. Instances of classes registered with
+    validator_registry are shared and can't be
+    modified once built. Every subclass accepts
+    err_message and not_message keyword arguments
+    setting a custom message.
+
+    # Example:
+        validations = {
+            "name": [Length(1, 20, err_message="must be 1 to 20 letters")]
+        }
+
+    """
+
+    __slots__ = ("_frozen", "_err_message", "_not_message", "__weakref__")
+
+    def __setattr__(self, name, value):
+        if self._frozen:
+            raise AttributeError("%s validators are shared and can't be modified, pass err_message/not_message "
+                                 "when building one instead" % type(self).__name__)
+        object.__setattr__(self, name, value)
+
+    def __setstate__(self, state):
+        # pickle and copy restore the attributes with setattr,
+        # possibly after _frozen
+        if isinstance(state, tuple):
+            state, slots = state
+        else:
+            slots = None
+        for attributes in (state, slots):
+            for name, value in (attributes or {}).items():
+                object.__setattr__(self, name, value)
+
+
+def _truncated_repr(collection, limit=20):
+    try:
+        size = len(collection)
+    except TypeError:
+        return repr(collection)
+    if size <= limit:
+        return repr(collection)
+    head = ", ".join(repr(item) for item in itertools.islice(collection, limit))
+    return "[%s, ...] (%d values)" % (head, size)
+
+
+@validator_registry.register
+class Isalnum(SharedValidator):
+    """判断字符串中只能由字母和数字的组合，不能有特殊符号"""
+
+    __slots__ = ()
+
+    err_message = "must be numbers and letters"
+    not_message = "must not be numbers and letters"
+
+    def __call__(self, value):
+        if is_str(value):
+            return value.isalnum()
+        else:
+            return False
+
+
+@validator_registry.register
+class Isalpha(SharedValidator):
+    """字符串里面都是字母，并且至少是一个字母，结果就为真，（汉字也可以）其他情况为假"""
+
+    __slots__ = ()
+
+    err_message = "must be all letters"
+    not_message = "must not be all letters"
+
+    def __call__(self, value):
+        if is_str(value):
+            # if isinstance(value, str) or isinstance(value, unicode):
+            return value.isalpha()
+        else:
+            return False
+
+
+@validator_registry.register
+class Isdigit(SharedValidator):
+    """函数判断是否全为数字"""
+
+    __slots__ = ()
+
+    err_message = "must be all numbers"
+    not_message = "must not be all numbers"
+
+    def __call__(self, value):
+        if is_str(value):
+            return value.isdigit()
+        else:
+            return False
+
+
+@validator_registry.register
+class Email(SharedValidator):
+    """Verify that the value is an Email or not.
+    """
+
+    __slots__ = ()
+
+    pure = True
+
+    err_message = "Invalid Email"
+    not_message = "Invalid Email"
+
+    def __call__(self, value):
+        try:
+            if not value or "@" not in value:
+                return False
+            user_part, domain_part = value.rsplit('@', 1)
+            if not (USER_REGEX.match(user_part) and DOMAIN_REGEX.match(domain_part)):
+                return False
+            return True
+        except:
+            return False
+
+
+# strptime's own patterns for the directives a fixed
+# format may use, so the fast path accepts exactly
+# the same strings.
+_FORMAT_DIRECTIVES = {
+    "Y": r"(?P<Y>\d\d\d\d)",
+    "m": r"(?P<m>1[0-2]|0[1-9]|[1-9])",
+    "d": r"(?P<d>3[01]|[12]\d|0[1-9]|[1-9]| [1-9])",
+    "H": r"(?P<H>2[0-3]|[0-1]\d|\d)",
+    "M": r"(?P<M>[0-5]\d|\d)",
+    "S": r"(?P<S>6[0-1]|[0-5]\d|\d)",
+    "f": r"(?P<f>[0-9]{1,6})",
+}
+
+
+def compile_format(format):
+    """
+    Compile a strptime format made only of the
+    %Y %m %d %H %M %S %f directives and literal
+    characters into a regex for parse_fixed.
+    Returns None for any other format.
+    """
+    parts = []
+    i = 0
+    while i < len(format):
+        char = format[i]
+        if char == "%":
+            directive = format[i + 1:i + 2]
+            if directive == "%":
+                parts.append("%")
+            elif directive in _FORMAT_DIRECTIVES and "%" + directive not in format[:i]:
+                parts.append(_FORMAT_DIRECTIVES[directive])
+            else:
+                return None
+            i += 2
+        elif char.isspace():
+            return None
+        else:
+            parts.append(re.escape(char))
+            i += 1
+    return re.compile("".join(parts) + r"\Z", re.IGNORECASE)
+
+
+def parse_fixed(regex, value):
+    """
+    Parse value with a regex from compile_format,
+    equivalent to datetime.datetime.strptime.
+    """
+    found = regex.match(value)
+    if found is None:
+        raise ValueError("%r does not match the format" % (value,))
+    parts = found.groupdict()
+    return datetime.datetime(
+        int(parts.get("Y", 1900)), int(parts.get("m", 1)), int(parts.get("d", 1)),
+        int(parts.get("H", 0)), int(parts.get("M", 0)), int(parts.get("S", 0)),
+        int(parts.get("f", "0").ljust(6, "0")),
+    )
+
+
+@validator_registry.register
+class Datetime(SharedValidator):
+    """
+    Validate that the value matches the datetime format.
+
+    Fixed-width formats such as the default one are
+    parsed with a precompiled regex instead of strptime.
+    With convert=True the parsed datetime replaces the
+    value, so the handler doesn't parse it again.
+    """
+
+    __slots__ = ("format", "convert", "regex")
+
+    DEFAULT_FORMAT = '%Y-%m-%dT%H:%M:%S.%fZ'
+
+    err_message = "Invalid Datetime format"
+    not_message = "Invalid Datetime format"
+    pure = True
+
+    def __init__(self, format=None, convert=False):
+        self.format = format or self.DEFAULT_FORMAT
+        self.convert = convert
+        self.regex = compile_format(self.format)
+
+    def parse(self, v):
+        if self.regex is None:
+            return datetime.datetime.strptime(v, self.format)
+        return parse_fixed(self.regex, v)
+
+    def __call__(self, v):
+        try:
+            self.parse(v)
+        except (TypeError, ValueError):
+            return False
+        return True
+
+    def __repr__(self):
+        return 'Datetime(format=%s)' % self.format
+
+
+@validator_registry.register
+class Date(Datetime):
+    """
+    Validate that the value matches the date format.
+    With convert=True the value is replaced by a date.
+    """
+
+    __slots__ = ()
+
+    DEFAULT_FORMAT = '%Y-%m-%d'
+
+    err_message = "Invalid Date format"
+    not_message = "Invalid Date format"
+
+    def parse(self, v):
+        return super(Date, self).parse(v).date()
+
+    def __repr__(self):
+        return 'Date(format=%s)' % self.format
+
+
+@validator_registry.register
+class In(SharedValidator):
+    """
+    Use to specify that the
+    value of the key being
+    validated must exist
+    within the collection
+    passed to this validator.
+
+    The collection is indexed once when the validator
+    is built: hashable items go into a frozenset,
+    orderable ones into a sorted list searched with
+    bisect. With intervals=True the collection is a
+    sequence of inclusive (low, high) pairs instead.
+    Error messages list at most `max_listed` values.
+
+    # Example:
+        validations = {
+            "field": [In([1, 2, 3])],
+            "port": [In([(1, 1023), (8000, 8999)], intervals=True)]
+        }
+        passes = {"field": 1, "port": 8080}
+        fails  = {"field": 4, "port": 2000}
+
+    """
+
+    __slots__ = ("collection", "intervals", "index", "sorted", "highs")
+
+    max_listed = 20
+
+    def __init__(self, collection, intervals=False):
+        self.collection = collection
+        self.intervals = intervals
+        self.index = None
+        self.sorted = None
+        if intervals:
+            self.sorted, self.highs = _merge_intervals(collection)
+        elif not isinstance(collection, _OWN_CONTAINS):
+            # sets and dicts are already hashed, strings
+            # and ranges have their own `in`
+            try:
+                self.index = frozenset(collection)
+            except TypeError:
+                try:
+                    self.sorted = sorted(collection)
+                except TypeError:
+                    pass
+
+    @lazy_message
+    def err_message(self):
+        if self.intervals:
+            return "must fall within one of %s" % _truncated_repr(self.collection, self.max_listed)
+        return "must be one of %s" % _truncated_repr(self.collection, self.max_listed)
+
+    @lazy_message
+    def not_message(self):
+        if self.intervals:
+            return "must not fall within any of %s" % _truncated_repr(self.collection, self.max_listed)
+        return "must not be one of %s" % _truncated_repr(self.collection, self.max_listed)
+
+    def __call__(self, value):
+        if self.intervals:
+            i = bisect_right(self.sorted, value) - 1
+            return i >= 0 and value <= self.highs[i]
+        if self.index is not None:
+            try:
+                return value in self.index
+            except TypeError:
+                # unhashable value, compare the slow way
+                return (value in self.collection)
+        if self.sorted is not None:
+            try:
+                i = bisect_left(self.sorted, value)
+                return i < len(self.sorted) and self.sorted[i] == value
+            except TypeError:
+                return (value in self.collection)
+        return (value in self.collection)
+
+
+def _merge_intervals(intervals):
+    lows, highs = [], []
+    for low, high in sorted(intervals):
+        if highs and low <= highs[-1]:
+            highs[-1] = max(highs[-1], high)
+        else:
+            lows.append(low)
+            highs.append(high)
+    return lows, highs
+
+
+@validator_registry.register
+class Not(SharedValidator):
+    """
+    Use to negate the requirement
+    of another validator. Does not
+    work with Required.
+
+    """
+
+    __slots__ = ("validator",)
+
+    def __init__(self, validator):
+        self.validator = validator
+
+    @lazy_message
+    def err_message(self):
+        return getattr(self.validator, "not_message", "failed validation")
+
+    @lazy_message
+    def not_message(self):
+        return getattr(self.validator, "err_message", "failed validation")
+
+    def __call__(self, value):
+        return not self.validator(value)
+
+
+@validator_registry.register
+class Range(SharedValidator):
+    """
+    Use to specify that the value of the
+    key being validated must fall between
+    the start and end values. By default
+    the range is inclusive, though the
+    range can be made excusive by setting
+    inclusive to false.
+
+    With convert=True the float it compared
+    replaces the value.
+
+    # Example:
+        validations = {
+            "field": [Range(0, 10)]
+        }
+        passes = {"field": 10}
+        fails = {"field" : 11}
+
+    """
+
+    __slots__ = ("start", "end", "reverse", "auto", "convert")
+
+    def __init__(self, start, end, reverse=True, auto=True, convert=False):
+        self.start = start
+        self.end = end
+        self.reverse = reverse
+        self.auto = auto
+        self.convert = convert
+
+    @lazy_message
+    def err_message(self):
+        return "must fall between %s and %s" % (self.start, self.end)
+
+    @lazy_message
+    def not_message(self):
+        return "must not fall between %s and %s" % (self.start, self.end)
+
+    def __call__(self, value):
+        if self.auto:
+            value = float(value)
+        if self.reverse:
+            return self.start <= value <= self.end
+        else:
+            return self.start < value < self.end
+
+    def parse(self, value):
+        if self.auto:
+            value = float(value)
+        if not (self.start <= value <= self.end if self.reverse else self.start < value < self.end):
+            raise ValueError(self.err_message)
+        return value
+
+
+@validator_registry.register
+class GreaterThan(SharedValidator):
+    """
+    Use to specify that the value of the
+    key being validated must be greater
+    than a given value. By default the
+    bound is exclusive, though the bound
+    can be made inclusive by setting
+    inclusive to true.
+
+    With convert=True the float it compared
+    replaces the value.
+
+    # Example:
+        validations = {
+            "field": [GreaterThan(10)]
+        }
+        passes = {"field": 11}
+        fails = {"field" : 10}
+
+    """
+
+    __slots__ = ("lower_bound", "reverse", "auto", "convert")
+
+    def __init__(self, lower_bound, reverse=False, auto=True, convert=False):
+        self.lower_bound = lower_bound
+        self.reverse = reverse
+        self.auto = auto
+        self.convert = convert
+
+    @lazy_message
+    def err_message(self):
+        return "must be greater than %s" % (self.lower_bound,)
+
+    @lazy_message
+    def not_message(self):
+        return "must not be greater than %s" % (self.lower_bound,)
+
+    def __call__(self, value):
+        if self.auto:
+            value = float(value)
+        if self.reverse:
+            return self.lower_bound <= value
+        else:
+            return self.lower_bound < value
+
+    def parse(self, value):
+        if self.auto:
+            value = float(value)
+        if not (self.lower_bound <= value if self.reverse else self.lower_bound < value):
+            raise ValueError(self.err_message)
+        return value
+
+
+_TRUE_STRINGS = frozenset(["true", "1", "yes", "y", "on"])
+_FALSE_STRINGS = frozenset(["false", "0", "no", "n", "off"])
+
+
+def to_bool(value):
+    """
+    Convert "true"/"false", "1"/"0", "yes"/"no",
+    "on"/"off" (any case), bools and the ints 0
+    and 1 to a bool, raising ValueError otherwise.
+    """
+    if value is True or value is False:
+        return value
+    if is_str(value):
+        lowered = value.strip().lower()
+        if lowered in _TRUE_STRINGS:
+            return True
+        if lowered in _FALSE_STRINGS:
+            return False
+    elif value in (0, 1):
+        return bool(value)
+    raise ValueError("%r is not a boolean" % (value,))
+
+
+@validator_registry.register
+class Coerce(SharedValidator):
+    """
+    Use to convert the value of the key being
+    validated once, with converter, before the
+    validators after it run. They and the handler
+    get the converted value. The value fails if the
+    converter raises. bool uses to_bool, so "false"
+    becomes False.
+
+    Only a Coerce in a list of rules replaces the
+    value. As a bare rule ("page": Coerce(int)) or
+    inside Each([...]) it just checks that the value
+    converts, the elements of a list stay as they are.
+
+    # Example:
+        validations = {
+            "page": [Required, Coerce(int), Range(1, 100, auto=False)],
+            "price": [Coerce(Decimal)],
+            "day": [Date(convert=True)]
+        }
+        passes = {"page": "3"}  # the handler gets 3
+        fails  = {"page": "three"}
+
+    """
+
+    __slots__ = ("converter", "name")
+
+    convert = True
+
+    def __init__(self, converter):
+        self.converter = to_bool if converter is bool else converter
+        self.name = getattr(converter, "__name__", repr(converter))
+
+    @lazy_message
+    def err_message(self):
+        return "must be convertible to %s" % self.name
+
+    @lazy_message
+    def not_message(self):
+        return "must not be convertible to %s" % self.name
+
+    def parse(self, value):
+        return self.converter(value)
+
+    def __call__(self, value):
+        try:
+            self.converter(value)
+        except Exception:
+            return False
+        return True
+
+
+@validator_registry.register
+class Equals(SharedValidator):
+    """
+    Use to specify that the
+    value of the key being
+    validated must be equal to
+    the value that was passed
+    to this validator.
+
+    # Example:
+        validations = {
+            "field": [Equals(1)]
+        }
+        passes = {"field":1}
+        fails  = {"field":4}
+
+    """
+
+    __slots__ = ("obj",)
+
+    def __init__(self, obj):
+        self.obj = obj
+
+    @lazy_message
+    def err_message(self):
+        return "must be equal to %r" % (self.obj,)
+
+    @lazy_message
+    def not_message(self):
+        return "must not be equal to %r" % (self.obj,)
+
+    def __call__(self, value):
+        return value == self.obj
+
+
+@validator_registry.register
+class Blank(SharedValidator):
+    """
+    Use to specify that the
+    value of the key being
+    validated must be equal to
+    the empty string.
+
+    This is a shortcut for saying
+    Equals("").
+
+    # Example:
+        validations = {
+            "field": [Blank()]
+        }
+        passes = {"field":""}
+        fails  = {"field":"four"}
+
+    """
+
+    __slots__ = ()
+
+    err_message = "must be an empty string"
+    not_message = "must not be an empty string"
+
+    def __call__(self, value):
+        return value == ""
+
+
+@validator_registry.register
+class Truthy(SharedValidator):
+    """
+    Use to specify that the
+    value of the key being
+    validated must be truthy,
+    i.e. would cause an if statement
+    to evaluate to True.
+
+    # Example:
+        validations = {
+            "field": [Truthy()]
+        }
+        passes = {"field": 1}
+        fails  = {"field": 0}
+
+
+    """
+
+    __slots__ = ()
+
+    err_message = "must be True-equivalent value"
+    not_message = "must be False-equivalent value"
+
+    def __call__(self, value):
+        if value:
+            return True
+        else:
+            return False
+
+
+def Required(field, dictionary):
+    """
+    When added to a list of validations
+    for a dictionary key indicates that
+    the key must be present. This
+    should not be called, just inserted
+    into the list of validations.
+
+    # Example:
+        validations = {
+            "field": [Required, Equals(2)]
+        }
+
+    By default, keys are considered
+    optional and their validations
+    will just be ignored if the field
+    is not present in the dictionary
+    in question.
+
+    """
+
+    return (field in dictionary)
+
+
+@validator_registry.register
+class InstanceOf(SharedValidator):
+    """
+    Use to specify that the
+    value of the key being
+    validated must be an instance
+    of the passed in base class
+    or its subclasses.
+
+    # Example:
+        validations = {
+            "field": [InstanceOf(basestring)]
+        }
+        passes = {"field": ""} # is a <'str'>, subclass of basestring
+        fails  = {"field": str} # is a <'type'>
+
+    """
+
+    __slots__ = ("base_class",)
+
+    def __init__(self, base_class):
+        self.base_class = base_class
+
+    @lazy_message
+    def err_message(self):
+        return "must be an instance of %s or its subclasses" % self.base_class.__name__
+
+    @lazy_message
+    def not_message(self):
+        return "must not be an instance of %s or its subclasses" % self.base_class.__name__
+
+    def __call__(self, value):
+        return isinstance(value, self.base_class)
+
+
+@validator_registry.register
+class SubclassOf(SharedValidator):
+    """
+    Use to specify that the
+    value of the key being
+    validated must be a subclass
+    of the passed in base class.
+
+    # Example:
+        validations = {
+            "field": [SubclassOf(basestring)]
+        }
+        passes = {"field": str} # is a subclass of basestring
+        fails  = {"field": int}
+
+    """
+
+    __slots__ = ("base_class",)
+
+    def __init__(self, base_class):
+        self.base_class = base_class
+
+    @lazy_message
+    def err_message(self):
+        return "must be a subclass of %s" % self.base_class.__name__
+
+    @lazy_message
+    def not_message(self):
+        return "must not be a subclass of %s" % self.base_class.__name__
+
+    def __call__(self, class_):
+        return issubclass(class_, self.base_class)
+
+
+@validator_registry.register
+class Pattern(SharedValidator):
+    """
+    Use to specify that the
+    value of the key being
+    validated must match the
+    pattern provided to the
+    validator.
+
+    # Example:
+        validations = {
+            "field": [Pattern('\d\d\%')]
+        }
+        passes = {"field": "30%"}
+        fails  = {"field": "30"}
+
+    """
+
+    __slots__ = ("pattern", "compiled")
+
+    pure = True
+
+    def __init__(self, pattern):
+        self.pattern = pattern
+        self.compiled = compile_pattern(pattern)
+
+    @lazy_message
+    def err_message(self):
+        return "must match regex pattern %s" % (self.pattern,)
+
+    @lazy_message
+    def not_message(self):
+        return "must not match regex pattern %s" % (self.pattern,)
+
+    def __call__(self, value):
+        return self.compiled.match(value)
+
+
+_patterns = OrderedDict()
+_patterns_lock = threading.Lock()
+# patterns kept by compile_pattern, the least recently
+# used ones are dropped first
+_PATTERNS_MAXSIZE = 1024
+
+
+def compile_pattern(pattern, flags=0):
+    """
+    Process-wide registry of compiled regexes, so the
+    same pattern used across many rule sets is only
+    compiled once and shared. It is a bounded LRU, so
+    patterns built from request data can't grow it
+    without limit.
+    """
+    key = (type(pattern), pattern, flags)
+    with _patterns_lock:
+        compiled = _patterns.pop(key, None)
+        if compiled is not None:
+            _patterns[key] = compiled
+            return compiled
+    compiled = re.compile(pattern, flags)
+    with _patterns_lock:
+        compiled = _patterns.setdefault(key, compiled)
+        if len(_patterns) > _PATTERNS_MAXSIZE:
+            _patterns.popitem(last=False)
+    return compiled
+
+
+class PatternSet(object):
+    """
+    Several Pattern validators of one field run as
+    a single regex pass. Each pattern becomes an
+    optional capturing lookahead at the start of
+    the value, so the groups left unset tell which
+    patterns did not match.
+    """
+
+    def __init__(self, patterns):
+        self.patterns = tuple(patterns)
+        self.compiled = compile_pattern("".join("(?:(?=(%s)))?" % p.pattern for p in self.patterns))
+
+    @staticmethod
+    def combinable(v):
+        # patterns with their own groups would shift the
+        # group numbers (and break backreferences)
+        return type(v) is Pattern and is_str(v.pattern) and v.compiled.groups == 0
+
+    def __repr__(self):
+        return 'PatternSet(%r)' % [p.pattern for p in self.patterns]
+
+
+class Then(Validator):
+    """
+    Special validator for use as
+    part of the If rule.
+    If the conditional part of the validation
+    passes, then this is used to apply another
+    set of dependent rules.
+
+    # Example:
+        validations = {
+            "foo": [If(Equals(1), Then({"bar": [Equals(2)]}))]
+        }
+        passes = {"foo": 1, "bar": 2}
+        also_passes = {"foo": 2, "bar": 3}
+        fails = {"foo": 1, "bar": 3}
+    """
+
+    def __init__(self, validation):
+        self.validation = validation
+        self.compiled = compile_rules(validation)
+
+    def __call__(self, dictionary, fail_fast=False):
+        return self.compiled(dictionary, fail_fast)
+
+
+class If(Validator):
+    """
+    Special conditional validator.
+    If the validator passed as the first
+    parameter to this function passes,
+    then a second set of rules will be
+    applied to the dictionary.
+
+    # Example:
+        validations = {
+            "foo": [If(Equals(1), Then({"bar": [Equals(2)]}))]
+        }
+        passes = {"foo": 1, "bar": 2}
+        also_passes = {"foo": 2, "bar": 3}
+        fails = {"foo": 1, "bar": 3}
+    """
+
+    def __init__(self, validator, then_clause):
+        self.validator = validator
+        self.then_clause = then_clause
+
+    def __call__(self, value, dictionary, fail_fast=False):
+        conditional = False
+        dependent = None
+        if self.validator(value):
+            conditional = True
+            if fail_fast:
+                dependent = self.then_clause(dictionary, fail_fast)
+            else:
+                dependent = self.then_clause(dictionary)
+        return conditional, dependent
+
+
+@validator_registry.register
+class Length(SharedValidator):
+    """
+    Use to specify that the
+    value of the key being
+    validated must have at least
+    `minimum` elements and optionally
+    at most `maximum` elements.
+
+    At least one of the parameters
+    to this validator must be non-zero,
+    and neither may be negative.
+
+    # Example:
+        validations = {
+            "field": [Length(0, maximum=5)]
+        }
+        passes = {"field": "hello"}
+        fails  = {"field": "hello world"}
+
+    """
+
+    __slots__ = ("minimum", "maximum")
+
+    err_messages = {
+        "maximum": "must be at most {0} elements in length",
+        "minimum": "must be at least {0} elements in length",
+        "range": "must{0}be between {1} and {2} elements in length"
+    }
+
+    def __init__(self, minimum, maximum=0):
+        if not minimum and not maximum:
+            raise ValueError("Length must have a non-zero minimum or maximum parameter.")
+        if minimum < 0 or maximum < 0:
+            raise ValueError("Length cannot have negative parameters.")
+
+        self.minimum = minimum
+        self.maximum = maximum
+
+    @lazy_message
+    def err_message(self):
+        if self.minimum and self.maximum:
+            return self.err_messages["range"].format(' ', self.minimum, self.maximum)
+        if self.minimum:
+            return self.err_messages["minimum"].format(self.minimum)
+        return self.err_messages["maximum"].format(self.maximum)
+
+    @lazy_message
+    def not_message(self):
+        if self.minimum and self.maximum:
+            return self.err_messages["range"].format(' not ', self.minimum, self.maximum)
+        if self.minimum:
+            return self.err_messages["maximum"].format(self.minimum - 1)
+        return self.err_messages["minimum"].format(self.maximum + 1)
+
+    def __call__(self, value):
+        if self.maximum:
+            return self.minimum <= len(value) <= self.maximum
+        else:
+            return self.minimum <= len(value)
+
+
+@validator_registry.register
+class Contains(SharedValidator):
+    """
+    Use to ensure that the value of the key
+    being validated contains the value passed
+    into the Contains validator. Works with
+    any type that supports the 'in' syntax.
+
+    # Example:
+        validations = {
+            "field": [Contains(3)]
+        }
+        passes = {"field": [1, 2, 3]}
+        fails  = {"field": [4, 5, 6]}
+
+    """
+
+    __slots__ = ("contained",)
+
+    def __init__(self, contained):
+        self.contained = contained
+
+    @lazy_message
+    def err_message(self):
+        return "must contain {0}".format(self.contained)
+
+    @lazy_message
+    def not_message(self):
+        return "must not contain {0}".format(self.contained)
+
+    def __call__(self, container):
+        return self.contained in container
+
+
+class Each(Validator):
+    """
+    Use to ensure that
+
+    If Each is passed a list of validators, it
+    just applies each of them to each element in
+    the list.
+
+    If it's instead passed a *dictionary*, it treats
+    it as a validation to be applied to each element in
+    the dictionary.
+
+    With fail_fast, it stops at the first failing
+    element and reports only that error. Validating
+    with fail_fast turns it on for the Each rules of
+    the mapping as well.
+
+    When NumPy is installed, lists of at least
+    `vectorize_min` plain ints/floats or strs checked
+    with Range, GreaterThan, Equals, In or Length (on
+    strs) are evaluated column-wise in one go, giving
+    the same errors as the element by element loop.
+
+    Given a concurrent.futures executor, lists of dicts
+    with at least `parallel_min` items are split into
+    chunks of `chunk_size` and validated on the pool,
+    the errors are merged back in index order. A
+    ProcessPoolExecutor needs picklable rules (no
+    lambdas, no codegen plans), a ThreadPoolExecutor
+    only helps validators that release the GIL.
+
+    # Example:
+        pool = ProcessPoolExecutor(4)
+        validations = {
+            "items": [Each({"id": [Required]}, executor=pool)]
+        }
+
+    """
+
+    vectorize_min = 256
+
+    def __init__(self, validations, fail_fast=False, executor=None, parallel_min=1000, chunk_size=500):
+        assert isinstance(validations, (list, tuple, set, dict))
+        self.validations = validations
+        self.fail_fast = fail_fast
+        self.executor = executor
+        self.parallel_min = parallel_min
+        self.chunk_size = chunk_size
+        if isinstance(validations, dict):
+            self.compiled = compile_rules(validations)
+            self.batched = self.compiled.batched
+        else:
+            self.batch_flags = tuple(getattr(v, "batch_call", None) is not None for v in validations)
+            self.batched = any(self.batch_flags)
+
+    def __call__(self, container, fail_fast=False):
+        assert isinstance(container, (list, tuple, set))
+        fail_fast = fail_fast or self.fail_fast
+
+        # handle the "apply simple validation to each in list"
+        # use case
+        if isinstance(self.validations, (list, tuple, set)):
+            if self.batched:
+                return self._batched(container, fail_fast)
+            failures = self._vectorized(container)
+            # consecutive failures of the same validator share
+            # one message string
+            last = message = None
+            if failures is not None:
+                errors = []
+                for index in numpy.flatnonzero(failures.any(axis=0)):
+                    for v, failed in zip(self.validations, failures[:, index]):
+                        if failed:
+                            if v is not last:
+                                last, message = v, "all values " + v.err_message
+                            errors.append(message)
+                            if fail_fast:
+                                return False, errors
+                return (len(errors) == 0, errors)
+            errors = []
+            for item in container:
+                for v in self.validations:
+                    valid = v(item)
+                    if not valid:
+                        if v is not last:
+                            last, message = v, "all values " + v.err_message
+                        errors.append(message)
+                        if fail_fast:
+                            return False, errors
+
+        # handle the somewhat messier list of dicts case
+        if isinstance(self.validations, dict):
+            if self.batched and not fail_fast and _current_batch() is None:
+                # a tuple like the other paths, not a ValidationResult
+                valid, errors = _Batch().run(self, container)
+                return valid, errors
+            if self.executor is not None and len(container) >= self.parallel_min:
+                errors = self._parallel(container, fail_fast)
+            else:
+                errors = {}
+                for index, err in iter_validate_many(self.compiled, container, fail_fast):
+                    errors[index] = err
+                    if fail_fast:
+                        break
+
+        return (len(errors) == 0, errors)
+
+    def _batched(self, container, fail_fast=False):
+        # Batching validators get all elements at once, or
+        # defer them to the batch of the running validation
+        # so one lookup covers the whole payload.
+        batch = _current_batch()
+        items = list(container)
+        columns = []
+        for v, batched in zip(self.validations, self.batch_flags):
+            if not batched:
+                columns.append([v(item) for item in items])
+            elif batch is not None and not fail_fast:
+                columns.append([batch.defer(v, item, "all values ") for item in items])
+            else:
+                columns.append(v.batch_call(items))
+        errors = []
+        last = message = None
+        for index in range(len(items)):
+            for v, column in zip(self.validations, columns):
+                valid = column[index]
+                if isinstance(valid, _Deferred):
+                    errors.append(valid)
+                elif not valid:
+                    if v is not last:
+                        last, message = v, "all values " + v.err_message
+                    errors.append(message)
+                    if fail_fast:
+                        return False, errors
+        return (len(errors) == 0, errors)
+
+    def _parallel(self, container, fail_fast=False):
+        records = list(container)
+        offsets = list(range(0, len(records), self.chunk_size))
+        chunks = self.executor.map(
+            _validate_chunk,
+            [self.compiled] * len(offsets),
+            offsets,
+            [records[offset:offset + self.chunk_size] for offset in offsets],
+            [fail_fast] * len(offsets),
+        )
+        # map() yields chunks in submission order, so the
+        # merged errors don't depend on which worker finished first.
+        errors = {}
+        for chunk in chunks:
+            for index, err in chunk:
+                errors[index] = err
+                if fail_fast:
+                    return errors
+        return errors
+
+    def iter_valid(self, iterable):
+        """
+        Streaming counterpart of calling Each: accepts
+        any iterable, yields its elements one at a time
+        as they pass and raises StreamValidationError
+        for the first element that fails.
+        """
+        if isinstance(self.validations, dict):
+            errors = defaultdict(list)
+            for index, item in enumerate(iterable):
+                self.compiled.collect(item, errors, self.fail_fast)
+                if errors:
+                    raise StreamValidationError(index, dict(errors))
+                yield item
+        else:
+            for index, item in enumerate(iterable):
+                errors = []
+                for v in self.validations:
+                    try:
+                        valid = v(item)
+                    except Exception:
+                        # a failure, like in _validate_and_store_errs
+                        valid = False
+                    if not valid:
+                        errors.append("all values " + v.err_message)
+                        if self.fail_fast:
+                            break
+                if errors:
+                    raise StreamValidationError(index, errors)
+                yield item
+
+    def failing_indices(self, container):
+        """
+        Return the sorted indices of the elements
+        of container that fail validation.
+        """
+        if isinstance(self.validations, dict):
+            return [index for index, _ in iter_validate_many(self.compiled, container)]
+        failures = self._vectorized(container)
+        if failures is not None:
+            return numpy.flatnonzero(failures.any(axis=0)).tolist()
+        return [index for index, item in enumerate(container)
+                if not all(v(item) for v in self.validations)]
+
+    def _vectorized(self, container):
+        """
+        A (validators x elements) boolean array of failures,
+        or None when the NumPy fast path does not apply.
+        """
+        if len(container) < self.vectorize_min or _load_numpy() is None:
+            return None
+        types = set(map(type, container))
+        if types <= _NUMERIC_TYPES:
+            if int in types and not _exact_as_float(container):
+                return None
+            column = numpy.array(list(container))
+        elif types == _STR_TYPES and not _has_nul(container):
+            column = numpy.array(list(container), dtype=str)
+        else:
+            return None
+        failures = []
+        for v in self.validations:
+            passed = _vectorized_check(v, column)
+            if passed is None:
+                return None
+            failures.append(~passed)
+        return numpy.array(failures).reshape(len(failures), len(column))
+
+
+def _validate_chunk(plan, offset, records, fail_fast):
+    # module level so process pools can pickle it
+    errors = []
+    for index, err in iter_validate_many(plan, records, fail_fast):
+        errors.append((offset + index, err))
+        if fail_fast:
+            break
+    return errors
+
+
+_NUMERIC_TYPES = frozenset([int, float])
+_STR_TYPES = frozenset([str])
+
+
+def _plain_numbers(values):
+    return all(type(value) in _NUMERIC_TYPES for value in values)
+
+
+# ints are exact as float64 up to 2**53
+_FLOAT_EXACT = 2 ** 53
+
+
+def _exact_as_float(numbers):
+    # NumPy compares ints with floats, and int64 with
+    # float bounds, as float64, unlike Python. A NaN
+    # makes min/max fail the check, the loop handles it.
+    return -_FLOAT_EXACT <= min(numbers) and max(numbers) <= _FLOAT_EXACT
+
+
+def _has_nul(strings):
+    # NumPy drops trailing "\x00" from its fixed-width
+    # strings, "a\x00" would compare equal to "a"
+    return "\x00" in "".join(strings)
+
+
+def _vectorized_check(v, column):
+    # Only combinations the loop would evaluate without
+    # raising are vectorized, everything else returns None.
+    kind = type(v)
+    numeric = column.dtype.kind in "iuf"
+    if kind is Range and numeric and _plain_numbers((v.start, v.end)):
+        if v.auto:
+            column = column.astype(float)
+        if v.reverse:
+            return (v.start <= column) & (column <= v.end)
+        return (v.start < column) & (column < v.end)
+    if kind is GreaterThan and numeric and _plain_numbers((v.lower_bound,)):
+        if v.auto:
+            column = column.astype(float)
+        if v.reverse:
+            return v.lower_bound <= column
+        return v.lower_bound < column
+    if kind is Equals:
+        if numeric and _plain_numbers((v.obj,)) or not numeric and is_str(v.obj) and "\x00" not in v.obj:
+            return column == v.obj
+        return None
+    if kind is In and not v.intervals and isinstance(v.collection, (list, tuple, set, frozenset)):
+        if numeric and _plain_numbers(v.collection) or (
+                not numeric and all(map(is_str, v.collection)) and not _has_nul(v.collection)):
+            return numpy.isin(column, list(v.collection))
+        return None
+    if kind is Length and not numeric:
+        lengths = numpy.char.str_len(column)
+        if v.maximum:
+            return (v.minimum <= lengths) & (lengths <= v.maximum)
+        return v.minimum <= lengths
+    return None
+
+
+class StreamValidationError(ValueError):
+    """
+    Raised while streaming when the element
+    at `index` fails validation with `errors`.
+    """
+
+    def __init__(self, index, errors):
+        super(StreamValidationError, self).__init__(index, errors)
+        self.index = index
+        self.errors = errors
+
+
+@validator_registry.register
+class Url(SharedValidator):
+    """
+    Use to specify that the
+    value of the key being
+    validated must be a Url.
+
+    This is a shortcut for saying
+    Url().
+
+    # Example:
+        validations = {
+            "field": [Url()]
+        }
+        passes = {"field":"http://vk.com"}
+        fails  = {"field":"/1https://vk.com"}
+
+    """
+
+    __slots__ = ()
+
+    pure = True
+
+    err_message = "must be a valid URL"
+    not_message = "must not be a valid URL"
+
+    def __call__(self, value):
+        try:
+            result = urlparse(value)
+            return all([result.scheme, result.netloc])
+        except:
+            return False
+
+
+CacheInfo = namedtuple('CacheInfo', ['hits', 'misses', 'maxsize', 'currsize'])
+
+
+class ResultCache(object):
+    """
+    Thread-safe bounded LRU of validator results,
+    keyed on (validator, type of the value, value),
+    1, 1.0 and True are equal but cached apart, as
+    validators may check the type. Values that can't
+    be hashed are validated without caching, and
+    exceptions are never cached.
+
+    # Example:
+        cache = ResultCache(maxsize=10000)
+        validations = {
+            "email": [Memoized(Email(), cache)]
+        }
+        cache.info()  # CacheInfo(hits=..., misses=..., maxsize=10000, currsize=...)
+
+    """
+
+    def __init__(self, maxsize=4096):
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self._results = OrderedDict()
+        self._lock = threading.Lock()
+
+    def call(self, validator, value):
+        key = (validator, type(value), value)
+        try:
+            hash(key)
+        except TypeError:
+            return validator(value)
+        with self._lock:
+            if key in self._results:
+                self.hits += 1
+                result = self._results[key] = self._results.pop(key)
+                return result
+        result = validator(value)
+        with self._lock:
+            self.misses += 1
+            self._results[key] = result
+            if len(self._results) > self.maxsize:
+                self._results.popitem(last=False)
+        return result
+
+    def info(self):
+        with self._lock:
+            return CacheInfo(self.hits, self.misses, self.maxsize, len(self._results))
+
+    def clear(self):
+        with self._lock:
+            self._results.clear()
+            self.hits = self.misses = 0
+
+
+result_cache = ResultCache()
+
+
+class Memoized(Validator):
+    """
+    Wraps a validator so its results are looked
+    up in a ResultCache, the shared result_cache
+    unless another one is given. Only use it on
+    validators whose result depends on the value
+    alone.
+
+    """
+
+    pure = True
+
+    def __init__(self, validator, cache=None):
+        self.validator = validator
+        self.cache = result_cache if cache is None else cache
+
+    @lazy_message
+    def err_message(self):
+        return getattr(self.validator, "err_message", "failed validation")
+
+    @lazy_message
+    def not_message(self):
+        return getattr(self.validator, "not_message", "failed validation")
+
+    def __call__(self, value):
+        return self.cache.call(self.validator, value)
+
+    def __repr__(self):
+        return 'Memoized(%r)' % self.validator
+
+
+def memoize_rules(validation, cache=None):
+    """
+    Return a copy of a rules mapping where every
+    validator declaring pure = True, including those
+    in nested mappings, is wrapped in Memoized.
+    Validators with convert=True are left as they are,
+    they replace the value and the cache only keeps
+    whether it passed.
+
+    :param validation: a mapping of keys to validators
+    :type validation: dict
+
+    :param cache: the ResultCache to use, defaults
+    to the shared result_cache
+
+    :return: a new mapping of keys to validators
+
+    """
+
+    def wrap(v):
+        if isinstance(v, dict):
+            return memoize_rules(v, cache)
+        if getattr(v, "convert", False) is True:
+            return v
+        if getattr(v, "pure", False) and not isinstance(v, Memoized):
+            return Memoized(v, cache)
+        return v
+
+    memoized = {}
+    for key in validation:
+        rule = validation[key]
+        if isinstance(rule, (list, tuple)):
+            memoized[key] = [wrap(v) for v in rule]
+        else:
+            memoized[key] = wrap(rule)
+    return memoized
+
+
+class BatchValidator(Validator):
+    """
+    Base for validators that check many values with
+    a single lookup, like existence checks against a
+    database. Subclasses implement batch_call(values),
+    returning one result per value in the same order,
+    each one what __call__ would return for it.
+
+    While a plan validates a dictionary, the values for
+    every batch validator, including those in nested
+    mappings, Each and Then rules, are collected first
+    and batch_call is called once per validator at the
+    end. With fail_fast the values are checked one by
+    one instead.
+
+    # Example:
+        class ProductExists(BatchValidator):
+            err_message = "must be an existing product"
+
+            def __init__(self, products):
+                self.products = products
+
+            def batch_call(self, values):
+                found = self.products.existing(set(values))
+                return [value in found for value in values]
+
+        validations = {
+            "lines": [Each({"product_id": [Required, ProductExists(db)]})]
+        }
+
+    """
+
+    def __call__(self, value):
+        return self.batch_call([value])[0]
+
+    @abstractmethod
+    def batch_call(self, values):
+        raise NotImplementedError
+
+
+_batching = threading.local()
+
+
+def _current_batch():
+    return getattr(_batching, "batch", None)
+
+
+class _Deferred(object):
+    """
+    Placeholder put in the errors for a value
+    that waits for its validator's batch_call.
+    """
+
+    __slots__ = ("validator", "value", "prefix", "messages")
+
+    def __init__(self, validator, value, prefix):
+        self.validator = validator
+        self.value = value
+        self.prefix = prefix
+        self.messages = ()
+
+
+class _Batch(object):
+    """
+    The values deferred by batch validators during
+    one validation, grouped per validator.
+    """
+
+    def __init__(self):
+        self.pending = OrderedDict()
+
+    def defer(self, validator, value, prefix=None):
+        deferred = _Deferred(validator, value, prefix)
+        self.pending.setdefault(id(validator), []).append(deferred)
+        return deferred
+
+    def run(self, validate, value):
+        _batching.batch = self
+        try:
+            result = validate(value)
+        finally:
+            _batching.batch = None
+        if not self.pending:
+            return result
+        self.flush()
+        errors = _resolve_deferred(result[1])
+        return ValidationResult(valid=not errors, errors=errors)
+
+    def flush(self):
+        for deferred in self.pending.values():
+            validator = deferred[0].validator
+            try:
+                results = validator.batch_call([d.value for d in deferred])
+                if len(results) != len(deferred):
+                    raise ValueError("batch_call returned %d results for %d values" % (len(results), len(deferred)))
+            except Exception:
+                results = [(False, validator.err_message)] * len(deferred)
+            for d, valid in zip(deferred, results):
+                d.messages = _batch_messages(validator, valid, d.prefix)
+
+
+def _batch_messages(validator, valid, prefix=None):
+    if prefix is not None:
+        # an element of Each([...])
+        return () if valid else (prefix + validator.err_message,)
+    # same rules as _validate_and_store_errs
+    if isinstance(valid, tuple):
+        errs = valid[1]
+        if errs and isinstance(errs, list):
+            return errs
+        return (errs,) if errs else ()
+    return () if valid else (getattr(validator, "err_message", "failed validation"),)
+
+
+def _resolve_deferred(errors):
+    # Replace the placeholders with their messages and drop
+    # the lists and mappings left empty by passing values.
+    if isinstance(errors, dict):
+        resolved = {}
+        for key in errors:
+            value = _resolve_deferred(errors[key])
+            if value or not isinstance(value, (dict, list)):
+                resolved[key] = value
+        return resolved
+    if isinstance(errors, list):
+        resolved = []
+        for error in errors:
+            if isinstance(error, _Deferred):
+                resolved.extend(error.messages)
+                continue
+            error = _resolve_deferred(error)
+            if error or not isinstance(error, (dict, list)):
+                resolved.append(error)
+        return resolved
+    return errors
+
+
+def _has_batched(run, v):
+    if run is _run_batched:
+        return True
+    if run is _run_nested:
+        return v.batched
+    if run is _run_if:
+        return getattr(getattr(v.then_clause, "compiled", None), "batched", False)
+    return getattr(v, "batched", False) is True
+
+
+class CompiledRules(object):
+    """
+    A rules mapping turned into a flat execution plan.
+
+    Every key of the mapping becomes a
+    (key, required, guarded, steps) entry, where steps is
+    an ordered tuple of (runner, validator) pairs, so
+    validating a dictionary no longer has to look for
+    Required, nested dicts or If clauses on every call.
+    Instances are callable and return a ValidationResult,
+    with fail_fast=True they stop at the first error.
+
+    # Example:
+        plan = compile_rules({"field": [Required, Equals(2)]})
+        plan({"field": 2})  # ValidationResult(valid=True, errors={})
+
+    """
+
+    codegen = False
+
+    def __init__(self, validation):
+        self.validation = validation
+        self.fields = tuple(_compile_field(key, validation[key], self.codegen) for key in validation)
+        self.batched = any(_has_batched(run, v) for _, _, _, steps in self.fields for run, v in steps)
+
+    def __call__(self, dictionary, fail_fast=False):
+        if _instrument is not None:
+            return _instrument.call(self, dictionary, fail_fast)
+        return self._call(dictionary, fail_fast)
+
+    def _call(self, dictionary, fail_fast=False):
+        if self.batched and not fail_fast and _current_batch() is None:
+            return _Batch().run(self, dictionary)
+        errors = defaultdict(list)
+        self.collect(dictionary, errors, fail_fast)
+        if len(errors) > 0:
+            # `errors` gets downgraded from defaultdict to dict
+            # because it makes for prettier output
+            return ValidationResult(valid=False, errors=dict(errors))
+        else:
+            return ValidationResult(valid=True, errors={})
+
+    def collect(self, dictionary, errors, fail_fast=False):
+        """
+        Run the plan against dictionary, adding any
+        failures to the errors defaultdict(list).
+        """
+        if _instrument is not None and _instrument.recording():
+            return _instrument.collect(self, dictionary, errors, fail_fast)
+        for key, required, guarded, steps in self.fields:
+            if guarded:
+                # don't break on optional keys
+                if key not in dictionary:
+                    if required:
+                        errors[key] = "must be present"
+                        if fail_fast:
+                            break
+                    continue
+            for run, v in steps:
+                # a value that couldn't be converted isn't
+                # checked any further
+                if run(v, dictionary, key, errors, fail_fast) is False:
+                    break
+                if fail_fast and errors:
+                    break
+            if fail_fast and errors:
+                break
+
+    def __len__(self):
+        return len(self.fields)
+
+    def __repr__(self):
+        return 'CompiledRules(%r)' % self.validation
+
+
+class GeneratedRules(CompiledRules):
+    """
+    A CompiledRules plan that is turned into
+    Python source once and exec'd, giving one
+    straight-line function per rules mapping.
+
+    Required checks and the Equals, In, Length,
+    Range and GreaterThan built-ins are inlined
+    with their parameters bound as constants, so
+    changing a validator's attributes afterwards
+    has no effect on the plan. Any other validator
+    is still called as usual. The generated code is
+    kept in the `source` attribute.
+
+    While metrics are recorded a second function,
+    generated on first use, runs the same code with
+    the timing and counting calls added.
+
+    """
+
+    codegen = True
+
+    def __init__(self, validation):
+        super(GeneratedRules, self).__init__(validation)
+        self.source, namespace = _generate_source(self.fields)
+        exec(compile(self.source, "<validator %r>" % list(validation), "exec"), namespace)
+        self.func = namespace["generated_validate"]
+        self.instrumented_func = None
+
+    def _call(self, dictionary, fail_fast=False):
+        if self.batched and not fail_fast and _current_batch() is None:
+            return _Batch().run(self, dictionary)
+        if _instrument is not None and _instrument.recording():
+            return self._instrumented()(dictionary, fail_fast, _instrument)
+        return self.func(dictionary, fail_fast)
+
+    def collect(self, dictionary, errors, fail_fast=False):
+        if _instrument is not None and _instrument.recording():
+            errors.update(self._instrumented()(dictionary, fail_fast, _instrument).errors)
+        else:
+            errors.update(self.func(dictionary, fail_fast).errors)
+
+    def _instrumented(self):
+        if self.instrumented_func is None:
+            source, namespace = _generate_source(self.fields, instrumented=True)
+            exec(compile(source, "<validator %r>" % list(self.validation), "exec"), namespace)
+            self.instrumented_func = namespace["generated_validate"]
+        return self.instrumented_func
+
+    def __repr__(self):
+        return 'GeneratedRules(%r)' % self.validation
+
+
+def compile_rules(validation, codegen=False):
+    """
+    Compile a mapping of keys to validators into
+    a reusable CompiledRules plan. Nested dicts are
+    compiled into sub-plans, Required is turned into
+    a flag and If/Then clauses are classified up front.
+    Already compiled plans are returned unchanged.
+
+    :param validation: a mapping of keys to validators
+    :type validation: dict
+
+    :param codegen: generate a specialized function
+    for the mapping instead, see GeneratedRules
+    :type codegen: bool
+
+    :return: a CompiledRules instance
+
+    """
+
+    if isinstance(validation, CompiledRules):
+        if not codegen or validation.codegen:
+            return validation
+        validation = validation.validation
+    if codegen:
+        return GeneratedRules(validation)
+    return CompiledRules(validation)
+
+
+def _plan_for(rules):
+    # the plan of validate_many and validate_async,
+    # compiled once per call
+    if isinstance(rules, CompiledRules):
+        return rules
+    return compile_rules(rules)
+
+
+def _step(v, codegen=False):
+    # Ok, need to deal with nested
+    # validations.
+    if isinstance(v, dict):
+        return _run_nested, compile_rules(v, codegen)
+    # special handling for the
+    # If(Then()) form
+    if isinstance(v, If):
+        return _run_if, v
+    # Each, told whether the validation is fail_fast
+    if isinstance(v, Each):
+        return _run_each, v
+    # validators that hand a parsed value on
+    if getattr(v, "convert", False) is True:
+        return _run_convert, v
+    # validators that check many values at once
+    if getattr(v, "batch_call", None) is not None:
+        return _run_batched, v
+    # handling for normal validators
+    return _validate_and_store_errs, v
+
+
+def _compile_field(key, rule, codegen=False):
+    if isinstance(rule, (list, tuple)):
+        # Skip Required, it becomes the required flag
+        # and is handled before the steps are run.
+        steps = []
+        for v in rule:
+            if v == Required:
+                continue
+            steps.append(_step(v, codegen))
+        return key, Required in rule, True, _combine_patterns(steps)
+    if rule == Required:
+        return key, True, True, ()
+    # a single bare validator is called even if
+    # the key is missing, just like before.
+    return key, False, False, ((_validate_and_store_errs, rule),)
+
+
+def _combine_patterns(steps):
+    # Adjacent Pattern steps are merged into one PatternSet
+    # step. Only adjacent ones, so the errors keep their order.
+    combined = []
+    run_of_patterns = []
+    for step in steps + [(None, None)]:
+        run, v = step
+        if run is _validate_and_store_errs and PatternSet.combinable(v):
+            run_of_patterns.append(v)
+            continue
+        if len(run_of_patterns) > 1:
+            try:
+                combined.append((_run_patterns, PatternSet(run_of_patterns)))
+            except re.error:
+                # e.g. global inline flags not at the start
+                combined.extend((_validate_and_store_errs, p) for p in run_of_patterns)
+        else:
+            combined.extend((_validate_and_store_errs, p) for p in run_of_patterns)
+        run_of_patterns = []
+        if run is not None:
+            combined.append(step)
+    return tuple(combined)
+
+
+def validate(validation, dictionary, fail_fast=False):
+    """
+    Validate that a dictionary passes a set of
+    key-based validators. If all of the keys
+    in the dictionary are within the parameters
+    specified by the validation mapping, then
+    the validation passes.
+
+    A mapping is walked as it is on every call, so it
+    can be built per call or edited in place. Rules used
+    again and again are cheaper as a compile_rules plan.
+
+    :param validation: a mapping of keys to validators,
+    or a plan returned by compile_rules
+    :type validation: dict
+
+    :param dictionary: dictionary to be validated
+    :type dictionary: dict
+
+    :param fail_fast: stop at the first failing field
+    and return only its error
+    :type fail_fast: bool
+
+    :return: a tuple containing a bool indicating
+    success or failure and a mapping of fields
+    to error messages.
+
+    """
+
+    if isinstance(validation, CompiledRules) or _instrument is not None:
+        return _plan_for(validation)(dictionary, fail_fast)
+    errors = defaultdict(list)
+    _walk(validation, dictionary, errors, fail_fast)
+    if len(errors) > 0:
+        return ValidationResult(valid=False, errors=dict(errors))
+    else:
+        return ValidationResult(valid=True, errors={})
+
+
+def _walk(validation, dictionary, errors, fail_fast=False):
+    # CompiledRules.collect over the raw mapping, with
+    # the steps compile_rules would plan
+    for key in validation:
+        rule = validation[key]
+        if isinstance(rule, (list, tuple)):
+            # don't break on optional keys
+            if key not in dictionary:
+                if Required in rule:
+                    errors[key] = "must be present"
+                    if fail_fast:
+                        break
+                continue
+            for v in rule:
+                if v == Required:
+                    continue
+                if isinstance(v, dict):
+                    run = _run_walk
+                else:
+                    run, v = _step(v)
+                if run(v, dictionary, key, errors, fail_fast) is False:
+                    break
+                if fail_fast and errors:
+                    break
+        elif rule == Required:
+            if key not in dictionary:
+                errors[key] = "must be present"
+        else:
+            _validate_and_store_errs(rule, dictionary, key, errors, fail_fast)
+        if fail_fast and errors:
+            break
+
+
+def _run_walk(validation, dictionary, key, errors, fail_fast=False):
+    # _run_nested for a nested mapping validate() walks
+    nested_errors = defaultdict(list)
+    _walk(validation, dictionary[key], nested_errors, fail_fast)
+    if nested_errors:
+        errors[key].append(dict(nested_errors))
+
+
+def validate_many(validation, records, fail_fast=False):
+    """
+    Validate every dictionary in records against
+    the same set of rules. The rules are compiled
+    once and the scratch error mapping is reused
+    between records.
+
+    # Example:
+        validate_many({"id": [Required]}, [{"id": 1}, {}])
+        # ValidationResult(valid=False, errors={1: {'id': 'must be present'}})
+
+    :param validation: a mapping of keys to validators,
+    or a plan returned by compile_rules
+    :type validation: dict
+
+    :param records: an iterable of dictionaries
+
+    :param fail_fast: stop at the first failing field
+    of each record
+    :type fail_fast: bool
+
+    :return: a ValidationResult whose errors map only
+    the indices of failing records to their errors.
+
+    """
+
+    plan = _plan_for(validation)
+    if plan.batched and not fail_fast and _current_batch() is None:
+        # one batch_call per validator for all of the records
+        return _Batch().run(lambda records: validate_many(plan, records), records)
+    errors = dict(iter_validate_many(plan, records, fail_fast))
+    return ValidationResult(valid=not errors, errors=errors)
+
+
+def iter_validate_many(validation, records, fail_fast=False):
+    """
+    Generator version of validate_many, yielding
+    (index, errors) for each failing record as soon
+    as it has been checked.
+    """
+
+    plan = _plan_for(validation)
+    errors = defaultdict(list)
+    for index, record in enumerate(records):
+        plan.collect(record, errors, fail_fast)
+        if errors:
+            yield index, dict(errors)
+            errors.clear()
+
+
+_WHITESPACE = re.compile(r"[ \t\n\r]*")
+# what ends or nests a value outside and inside of strings
+_NESTING = re.compile(r'[][{}"]')
+_STRING_STOP = re.compile(r'["\\]')
+
+
+def iter_json_array(stream, chunk_size=65536):
+    """
+    Incrementally parse a JSON array from a binary
+    file-like stream, yielding its elements one by
+    one. Only the element being parsed and one chunk
+    of input are held in memory. Anything but
+    whitespace after the closing "]" is an error.
+
+    # Example:
+        for item in iter_json_array(request.stream):
+            ...
+
+    :param stream: object with a read(size) method
+    returning UTF-8 encoded bytes
+
+    :param chunk_size: number of bytes read at a time
+    :type chunk_size: int
+
+    """
+
+    decoder = json.JSONDecoder()
+    text = codecs.getincrementaldecoder("utf-8")()
+    buf, pos, eof = "", 0, False
+    # start: expect "[", first: a value or "]",
+    # value: a value, sep: "," or "]", end: only whitespace
+    state = "start"
+    while True:
+        pos = _WHITESPACE.match(buf, pos).end()
+        if pos == len(buf):
+            if eof:
+                if state == "end":
+                    return
+                raise ValueError("unexpected end of JSON array")
+            buf, pos, eof = _read_more(stream, text, buf, pos, chunk_size)
+            continue
+        char = buf[pos]
+        if state == "start":
+            if char != "[":
+                raise ValueError("expected a JSON array")
+            pos += 1
+            state = "first"
+        elif state == "end":
+            raise ValueError("unexpected data after the JSON array at position %d" % pos)
+        elif state == "sep" or (state == "first" and char == "]"):
+            pos += 1
+            if char == "]":
+                state = "end"
+            elif char == ",":
+                state = "value"
+            else:
+                raise ValueError("expected ',' or ']' at position %d" % (pos - 1))
+        else:
+            try:
+                item, end = decoder.raw_decode(buf, pos)
+            except ValueError:
+                if eof:
+                    raise
+                if char not in '[{"':
+                    # a literal or number cut by the chunk
+                    buf, pos, eof = _read_more(stream, text, buf, pos, chunk_size)
+                    continue
+                # an array, object or string longer than what was
+                # read: find its end first, decode it once
+                buf, pos = _read_value(stream, text, buf, pos, chunk_size), 0
+                item, end = decoder.raw_decode(buf, pos)
+            # a number cut at the end of the buffer, like
+            # "12" of "12.5e3", continues in the next chunk
+            if char in "-0123456789" and not eof and (end == len(buf) or buf[end] in ".eE+-0123456789"):
+                buf, pos, eof = _read_more(stream, text, buf, pos, chunk_size)
+                continue
+            pos = end
+            state = "sep"
+            yield item
+
+
+def _read_more(stream, text, buf, pos, chunk_size):
+    data = stream.read(chunk_size)
+    eof = not data
+    return buf[pos:] + text.decode(data or b"", final=eof), 0, eof
+
+
+def _read_value(stream, text, buf, pos, chunk_size):
+    """
+    Read on until the array, object or string starting
+    at buf[pos] is complete and return it with what was
+    read after it. Every chunk is scanned once and they
+    are only joined at the end, so an element many
+    chunks long costs linear time.
+    """
+    end, scan = _scan_value(buf, pos, (0, False, False))
+    pieces = [buf[pos:]]
+    while end is None:
+        data = stream.read(chunk_size)
+        if not data:
+            raise ValueError("unexpected end of JSON array")
+        piece = text.decode(data)
+        end, scan = _scan_value(piece, 0, scan)
+        pieces.append(piece)
+    return "".join(pieces)
+
+
+def _scan_value(text, i, scan):
+    """
+    Look for the end of a JSON value in text from i on.
+    scan is (depth, in_string, escaped) where the last
+    piece of the value stopped. Returns the index after
+    the value, or None and the scan to resume from.
+    """
+    depth, in_string, escaped = scan
+    if escaped:
+        if i >= len(text):
+            return None, scan
+        i += 1
+    while True:
+        if in_string:
+            found = _STRING_STOP.search(text, i)
+            if found is None:
+                return None, (depth, True, False)
+            i = found.end()
+            if found.group() == "\\":
+                if i >= len(text):
+                    return None, (depth, True, True)
+                i += 1
+                continue
+            in_string = False
+            if not depth:
+                return i, None
+        else:
+            found = _NESTING.search(text, i)
+            if found is None:
+                return None, (depth, False, False)
+            i = found.end()
+            char = found.group()
+            if char == '"':
+                in_string = True
+            elif char in "[{":
+                depth += 1
+            else:
+                depth -= 1
+                if depth <= 0:
+                    return i, None
+
+
+def _validate_and_store_errs(validator, dictionary, key, errors, fail_fast=False):
+    # Validations shouldn't throw exceptions because of
+    # type mismatches and the like. If the rule is 'Length(5)' and
+    # the value in the field is 5, that should be a validation failure,
+    # not a TypeError because you can't call len() on an int.
+    # It's not ideal to have to hide exceptions like this because
+    # there could be actual problems with a validator, but we're just going
+    # to have to rely on tests preventing broken things.
+    try:
+        valid = validator(dictionary[key])
+    except Exception:
+        # Since we caught an exception while trying to validate,
+        # treat it as a failure and return the normal error message
+        # for that validator.
+        valid = (False, validator.err_message)
+    if isinstance(valid, tuple):
+        valid, errs = valid
+        if errs and isinstance(errs, list):
+            errors[key] += errs
+        elif errs:
+            errors[key].append(errs)
+    elif not valid:
+        # set a default error message for things like lambdas
+        # and other callables that won't have an err_message set.
+        msg = getattr(validator, "err_message", "failed validation")
+        errors[key].append(msg)
+
+
+def _run_each(each, dictionary, key, errors, fail_fast=False):
+    # _validate_and_store_errs, passing fail_fast on so a
+    # bad element stops the validation like a bad field
+    try:
+        if fail_fast:
+            _, errs = each(dictionary[key], fail_fast)
+        else:
+            _, errs = each(dictionary[key])
+    except Exception:
+        errs = each.err_message
+    if errs and isinstance(errs, list):
+        errors[key] += errs
+    elif errs:
+        errors[key].append(errs)
+
+
+def _run_nested(plan, dictionary, key, errors, fail_fast=False):
+    _, nested_errors = plan(dictionary[key], fail_fast)
+    if nested_errors:
+        errors[key].append(nested_errors)
+
+
+def _run_patterns(pattern_set, dictionary, key, errors, fail_fast=False):
+    try:
+        found = pattern_set.compiled.match(dictionary[key])
+    except Exception:
+        # not a string, every pattern fails like it would alone
+        found = None
+    for index, p in enumerate(pattern_set.patterns, 1):
+        if found is None or found.group(index) is None:
+            errors[key].append(p.err_message)
+            if fail_fast:
+                return
+
+
+def _run_convert(validator, dictionary, key, errors, fail_fast=False):
+    # Validators with convert=True parse the value once
+    # and the parsed value replaces it in the dictionary,
+    # so later validators and the handler get it as is.
+    try:
+        value = validator.parse(dictionary[key])
+    except Exception:
+        errors[key].append(validator.err_message)
+        return False
+    dictionary[key] = value
+
+
+def _run_batched(validator, dictionary, key, errors, fail_fast=False):
+    batch = _current_batch()
+    if batch is not None and not fail_fast:
+        errors[key].append(batch.defer(validator, dictionary[key]))
+        return
+    try:
+        valid = validator.batch_call([dictionary[key]])[0]
+    except Exception:
+        valid = (False, validator.err_message)
+    messages = _batch_messages(validator, valid)
+    if messages:
+        errors[key] += messages
+
+
+def _run_if(validator, dictionary, key, errors, fail_fast=False):
+    if fail_fast:
+        conditional, dependent = validator(dictionary[key], dictionary, fail_fast)
+    else:
+        conditional, dependent = validator(dictionary[key], dictionary)
+    # if the If() condition passed and there were errors
+    # in the second set of rules, then add them to the
+    # list of errors for the key with the condtional
+    # as a nested dictionary of errors.
+    if conditional and dependent[1]:
+        errors[key].append(dependent[1])
+
+
+def _inline_check(v, value, const):
+    """
+    Source of a boolean expression equivalent to calling
+    the built-in validator v on `value`, or None if v
+    has to be called. Only exact built-in types are
+    inlined, subclasses may override __call__.
+    """
+    kind = type(v)
+    if kind is Equals:
+        return "%s == %s" % (value, const(v.obj))
+    if kind is In and v.index is not None:
+        return "%s in %s" % (value, const(v.index))
+    if kind is Length:
+        if v.maximum:
+            return "%s <= len(%s) <= %s" % (const(v.minimum), value, const(v.maximum))
+        return "%s <= len(%s)" % (const(v.minimum), value)
+    if kind is Range:
+        if v.auto:
+            value = "float(%s)" % value
+        op = "<=" if v.reverse else "<"
+        return "%s %s %s %s %s" % (const(v.start), op, value, op, const(v.end))
+    if kind is GreaterThan:
+        if v.auto:
+            value = "float(%s)" % value
+        op = "<=" if v.reverse else "<"
+        return "%s %s %s" % (const(v.lower_bound), op, value)
+    return None
+
+
+def _generate_source(fields, instrumented=False):
+    # With instrumented=True the function takes the
+    # Instrumentation as `rec` and reports to it like
+    # Instrumentation.collect does.
+    namespace = {
+        "defaultdict": defaultdict,
+        "ValidationResult": ValidationResult,
+    }
+
+    def const(obj):
+        name = "_c%d" % len(namespace)
+        namespace[name] = obj
+        return name
+
+    def labels(v):
+        return const((("validator", _validator_name(v)),))
+
+    if instrumented:
+        lines = ["def generated_validate(d, fail_fast, rec):", "    errors = defaultdict(list)"]
+    else:
+        lines = ["def generated_validate(d, fail_fast):", "    errors = defaultdict(list)"]
+    bail = "if fail_fast and errors: return ValidationResult(valid=False, errors=dict(errors))"
+    for key, required, guarded, steps in fields:
+        k = const(key)
+        indent = "    "
+        if instrumented:
+            lines.append("    s = rec.start(%s)" % k)
+            lines.append("    try:")
+            indent = "        "
+        if guarded:
+            lines.append("%sif %s not in d:" % (indent, k))
+            if required:
+                lines.append('%s    errors[%s] = "must be present"' % (indent, k))
+                lines.append("%s    %s" % (indent, bail))
+            else:
+                lines.append("%s    pass" % indent)
+            if steps:
+                lines.append("%selse:" % indent)
+                indent += "    "
+        for run, v in steps:
+            check = None
+            if run is _validate_and_store_errs:
+                check = _inline_check(v, "d[%s]" % k, const)
+            if check is None and instrumented:
+                lines.append("%sn = len(errors.get(%s, ()))" % (indent, k))
+            if run is _run_convert:
+                lines.append("%sok = %s(%s, d, %s, errors, fail_fast) is not False" % (indent, const(run), const(v), k))
+                if instrumented:
+                    lines.append("%srec.ran(%s, errors, %s, n)" % (indent, labels(v), k))
+                lines.append("%s%s" % (indent, bail))
+                lines.append("%sif ok:" % indent)
+                lines.append("%s    pass" % indent)
+                indent += "    "
+                continue
+            if check is None:
+                lines.append("%s%s(%s, d, %s, errors, fail_fast)" % (indent, const(run), const(v), k))
+                if instrumented:
+                    lines.append("%srec.ran(%s, errors, %s, n)" % (indent, labels(v), k))
+                lines.append("%s%s" % (indent, bail))
+                continue
+            lines.extend([
+                "%stry:" % indent,
+                "%s    ok = %s" % (indent, check),
+                "%sexcept Exception:" % indent,
+                "%s    ok = False" % indent,
+            ])
+            if instrumented:
+                lines.append("%srec.step(%s, not ok)" % (indent, labels(v)))
+            lines.extend([
+                "%sif not ok:" % indent,
+                "%s    errors[%s].append(%s)" % (indent, k, const(v.err_message)),
+                "%s    %s" % (indent, bail),
+            ])
+        if instrumented:
+            lines.append("    finally:")
+            lines.append("        rec.finish(s)")
+    lines.extend([
+        "    if errors:",
+        "        return ValidationResult(valid=False, errors=dict(errors))",
+        "    return ValidationResult(valid=True, errors={})",
+        "",
+    ])
+    return "\n".join(lines), namespace
+
+
+_clock = getattr(time, "perf_counter", time.time)
+# the Instrumentation in use, None when metrics are off
+_instrument = None
+
+
+class MetricsRegistry(object):
+    """
+    In-process metrics sink keeping counters and
+    histograms in memory, keyed by name and labels.
+    Any object with the same increment/observe
+    methods can be used as a sink instead.
+
+    # Example:
+        registry = enable_metrics(sample_rate=0.1)
+        ...
+        print(prometheus_text(registry))
+
+    """
+
+    buckets = (.0001, .00025, .0005, .001, .0025, .005, .01, .025, .05, .1, .25, .5, 1.0, 2.5)
+    # histograms that don't measure seconds
+    bucket_sets = {
+        "validator_payload_fields": (1, 2, 5, 10, 20, 50, 100, 200, 500, 1000),
+    }
+
+    def __init__(self):
+        self.counters = OrderedDict()
+        self.histograms = OrderedDict()
+        self._lock = threading.Lock()
+
+    def increment(self, name, labels=(), amount=1):
+        key = (name, labels)
+        with self._lock:
+            self.counters[key] = self.counters.get(key, 0) + amount
+
+    def observe(self, name, value, labels=()):
+        key = (name, labels)
+        bounds = self.bucket_sets.get(name, self.buckets)
+        with self._lock:
+            histogram = self.histograms.get(key)
+            if histogram is None:
+                histogram = self.histograms[key] = [[0] * len(bounds), 0.0, 0]
+            # buckets are stored per bound and summed up on export
+            index = bisect_left(bounds, value)
+            if index < len(bounds):
+                histogram[0][index] += 1
+            histogram[1] += value
+            histogram[2] += 1
+
+    def clear(self):
+        with self._lock:
+            self.counters.clear()
+            self.histograms.clear()
+
+
+def _prometheus_labels(labels, extra=()):
+    pairs = []
+    for name, value in tuple(labels) + tuple(extra):
+        value = str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+        pairs.append('%s="%s"' % (name, value))
+    return "{%s}" % ",".join(pairs) if pairs else ""
+
+
+def prometheus_text(registry):
+    """
+    Render a MetricsRegistry in the Prometheus
+    text exposition format.
+    """
+    lines = []
+    typed = set()
+    with registry._lock:
+        counters = list(registry.counters.items())
+        histograms = [(key, [list(h[0]), h[1], h[2]]) for key, h in registry.histograms.items()]
+    # the samples of one metric have to be grouped together
+    counters.sort(key=lambda item: item[0][0])
+    histograms.sort(key=lambda item: item[0][0])
+    for (name, labels), value in counters:
+        if name not in typed:
+            typed.add(name)
+            lines.append("# TYPE %s counter" % name)
+        lines.append("%s%s %s" % (name, _prometheus_labels(labels), value))
+    for (name, labels), (counts, total, count) in histograms:
+        if name not in typed:
+            typed.add(name)
+            lines.append("# TYPE %s histogram" % name)
+        cumulative = 0
+        for bound, n in zip(registry.bucket_sets.get(name, registry.buckets), counts):
+            cumulative += n
+            lines.append("%s_bucket%s %d" % (name, _prometheus_labels(labels, (("le", bound),)), cumulative))
+        lines.append("%s_bucket%s %d" % (name, _prometheus_labels(labels, (("le", "+Inf"),)), count))
+        lines.append("%s_sum%s %r" % (name, _prometheus_labels(labels), total))
+        lines.append("%s_count%s %d" % (name, _prometheus_labels(labels), count))
+    return "\n".join(lines) + "\n"
+
+
+class Instrumentation(object):
+    """
+    Measures validations into a sink. A validation
+    started by validate, a plan or one of the decorators
+    is sampled as a whole, with the given probability.
+
+    Recorded metrics:
+        validator_validation_seconds{route}  histogram
+        validator_field_seconds{route,field}  histogram
+        validator_payload_fields{route}  histogram
+        validator_calls_total{validator}  counter
+        validator_failures_total{validator}  counter
+
+    Fields of nested mappings, Each items and Then
+    clauses are labelled with their dotted path under
+    the field holding them, like "lines.product_id".
+    Nested mappings count as the validator "dict".
+
+    """
+
+    def __init__(self, sink, sample_rate=1.0):
+        self.sink = sink
+        self.sample_rate = sample_rate
+        self.local = threading.local()
+
+    def recording(self):
+        return getattr(self.local, "recording", False)
+
+    def measure(self, route, func, *args):
+        """
+        Call func(*args) as one validation of route.
+        """
+        local = self.local
+        if getattr(local, "depth", 0):
+            return func(*args)
+        local.recording = self.sample_rate >= 1 or random.random() < self.sample_rate
+        local.route = route
+        local.prefix = ""
+        local.depth = 1
+        try:
+            if not local.recording:
+                return func(*args)
+            start = _clock()
+            try:
+                return func(*args)
+            finally:
+                self.sink.observe("validator_validation_seconds", _clock() - start, (("route", route),))
+        finally:
+            local.recording = False
+            local.depth = 0
+
+    def call(self, plan, dictionary, fail_fast=False):
+        local = self.local
+        depth = getattr(local, "depth", 0)
+        if not depth:
+            return self.measure("", self.call, plan, dictionary, fail_fast)
+        if not local.recording:
+            return plan._call(dictionary, fail_fast)
+        if depth == 1:
+            try:
+                size = len(dictionary)
+            except Exception:
+                size = 0
+            self.sink.observe("validator_payload_fields", size, (("route", local.route),))
+        local.depth = depth + 1
+        try:
+            # generated plans run their instrumented function
+            return plan._call(dictionary, fail_fast)
+        finally:
+            local.depth = depth
+
+    def collect(self, plan, dictionary, errors, fail_fast=False):
+        """
+        CompiledRules.collect, timing every field and
+        counting calls and failures per validator class.
+        """
+        for key, required, guarded, steps in plan.fields:
+            started = self.start(key)
+            try:
+                if guarded and key not in dictionary:
+                    if required:
+                        errors[key] = "must be present"
+                else:
+                    for run, v in steps:
+                        failed = len(errors.get(key, ()))
+                        converted = run(v, dictionary, key, errors, fail_fast) is not False
+                        self.ran((("validator", _validator_name(v)),), errors, key, failed)
+                        if not converted or (fail_fast and errors):
+                            break
+            finally:
+                self.finish(started)
+            if fail_fast and errors:
+                break
+
+    def start(self, key):
+        # the fields validated until finish are nested in this one
+        local = self.local
+        prefix = local.prefix
+        field = prefix + str(key)
+        local.prefix = field + "."
+        return field, prefix, _clock()
+
+    def finish(self, started):
+        field, prefix, start = started
+        self.sink.observe("validator_field_seconds", _clock() - start, (("route", self.local.route), ("field", field)))
+        self.local.prefix = prefix
+
+    def step(self, labels, failed):
+        self.sink.increment("validator_calls_total", labels)
+        if failed:
+            self.sink.increment("validator_failures_total", labels)
+
+    def ran(self, labels, errors, key, before):
+        # values waiting for a batch_call aren't known to fail yet
+        after = errors.get(key, ())
+        self.step(labels, len(after) > before and not isinstance(after[-1], _Deferred))
+
+
+def _validator_name(v):
+    if isinstance(v, CompiledRules):
+        # the plan of a nested mapping
+        return "dict"
+    if isinstance(v, Validator) or not hasattr(v, "__name__"):
+        return type(v).__name__
+    # plain functions and lambdas
+    return v.__name__
+
+
+def enable_metrics(sink=None, sample_rate=1.0):
+    """
+    Start recording metrics of validations.
+
+    :param sink: object with increment(name, labels, amount=1)
+    and observe(name, value, labels) methods, a new
+    MetricsRegistry when None
+    :param sample_rate: fraction of validations to record
+    :return: the sink
+    """
+    global _instrument
+    if sink is None:
+        sink = MetricsRegistry()
+    _instrument = Instrumentation(sink, sample_rate)
+    return sink
+
+
+def disable_metrics():
+    """
+    Stop recording metrics, validations then run
+    without any instrumentation.
+    """
+    global _instrument
+    _instrument = None